@@ -0,0 +1,96 @@
+"""
+A persistent, on-disk cache for reflected catalog information.
+
+Entries are keyed by cluster/database namespace, relation oid and kind
+(like ``'relation'`` for the catalog rows describing a table or view).
+Each entry is stored alongside a *fingerprint* derived from cheap
+catalog attributes: the relation's name, kind, column count and
+distribution style from ``pg_class``, plus a digest of every column's
+name, type, encoding, distkey flag and sort key position from
+``pg_attribute``. An entry is only returned if the relation's current
+fingerprint matches, so relations that were dropped, recreated or
+renamed are refetched, as are those changed in place by ALTER TABLE:
+columns added, dropped, renamed, widened or re-encoded, and distribution
+or sort keys changed.
+
+Alterations which change none of these, like a new column default,
+are not detected; call `clear` after making such changes.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import os
+import pickle
+import sqlite3
+import threading
+
+
+class ReflectionCache(object):
+    """SQLite-backed storage for reflected catalog rows.
+
+    Pass an instance as the *reflection_cache* argument to `Redshift`
+    to make `Redshift.reflected_tables` consult it.
+
+    Parameters
+    ----------
+    path : str
+        Location of the SQLite database;
+        defaults to ``$HOME/.shiftmanager/cache.sqlite``
+    """
+
+    def __init__(self, path=None):
+        if path is None:
+            directory = os.path.join(os.path.expanduser("~"), ".shiftmanager")
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            path = os.path.join(directory, "cache.sqlite")
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    namespace TEXT NOT NULL,
+                    oid INTEGER NOT NULL,
+                    kind TEXT NOT NULL,
+                    fingerprint TEXT NOT NULL,
+                    payload BLOB NOT NULL,
+                    PRIMARY KEY (namespace, oid, kind)
+                )""")
+
+    def get(self, namespace, oid, kind, fingerprint):
+        """Return the cached payload, or None if missing or stale."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT fingerprint, payload FROM entries "
+                "WHERE namespace = ? AND oid = ? AND kind = ?",
+                (namespace, oid, kind)).fetchone()
+        if row is None or row[0] != fingerprint:
+            return None
+        return pickle.loads(bytes(row[1]))
+
+    def put(self, namespace, oid, kind, fingerprint, payload):
+        """Store *payload*, replacing any existing entry."""
+        blob = sqlite3.Binary(pickle.dumps(payload, protocol=2))
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries "
+                "(namespace, oid, kind, fingerprint, payload) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (namespace, oid, kind, fingerprint, blob))
+
+    def clear(self, namespace=None):
+        """Remove all entries, or only those for *namespace*."""
+        with self._lock, self._db:
+            if namespace is None:
+                self._db.execute("DELETE FROM entries")
+            else:
+                self._db.execute("DELETE FROM entries WHERE namespace = ?",
+                                 (namespace,))
+
+
+def relation_fingerprint(row):
+    """Return a fingerprint for a `queries.relation_fingerprints` row."""
+    return '%s:%s:%s:%s:%s' % (row.relname, row.relkind, row.relnatts,
+                               row.diststyle, row.columns)
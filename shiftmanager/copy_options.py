@@ -0,0 +1,215 @@
+"""
+Options for Redshift COPY statements.
+
+A `CopyOptions` validates and renders the parameters of a COPY once, so
+that every loader builds its statements the same way. Besides the data
+format, the options that matter most for load speed are:
+
+* ``COMPUPDATE OFF``, skipping automatic compression analysis, which
+  samples and re-encodes the data when loading into an empty table
+* ``STATUPDATE OFF``, skipping the ANALYZE run after the load
+* ``MAXERROR``, ``ACCEPTINVCHARS``, ``TRUNCATECOLUMNS`` and
+  ``BLANKSASNULL``, tolerating dirty rows rather than failing the load
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+# Data formats and compressions understood by `CopyOptions`
+COPY_FORMATS = ('json', 'csv')
+COPY_COMPRESSIONS = ('gzip', 'lzop', 'bzip2', 'zstd')
+
+# Largest MAXERROR Redshift accepts
+MAX_COPY_ERRORS = 100000
+
+
+def _quote(value):
+    return "'%s'" % value.replace("'", "''")
+
+
+def _switch(name, value):
+    if value is None:
+        return None
+    return '%s %s' % (name, 'ON' if value else 'OFF')
+
+
+class CopyOptions(object):
+    """Validated parameters of a COPY statement.
+
+    Options are validated and rendered on creation; use `replace` to
+    derive a variant.
+
+    >>> options = CopyOptions('csv', maxerror=10, ignoreheader=1,
+    ...                       compupdate=False, statupdate=False)
+    >>> print(options)
+    MANIFEST GZIP IGNOREHEADER 1 MAXERROR 10 COMPUPDATE OFF STATUPDATE OFF
+    >>> print(options.statement('events', 's3://bucket/events.manifest',
+    ...                         'aws_iam_role=arn'))
+    COPY events
+    FROM 's3://bucket/events.manifest'
+    CREDENTIALS 'aws_iam_role=arn'
+    CSV
+    MANIFEST GZIP IGNOREHEADER 1 MAXERROR 10 COMPUPDATE OFF STATUPDATE OFF
+
+    Parameters
+    ----------
+    data_format : str
+        ``'json'`` or ``'csv'``
+    manifest : bool
+        The source is a manifest listing the files to load
+    compression : str
+        Compression of the files, one of `COPY_COMPRESSIONS`, or None
+    columns : list of str
+        Load only these columns of the table, in the order they appear
+        in the files; other columns get their defaults
+    timeformat : str
+        Format of TIMESTAMP values, like ``'auto'``
+    dateformat : str
+        Format of DATE values, like ``'auto'``
+    ignoreheader : int
+        Number of header lines to skip in each CSV file
+    acceptinvchars : bool or str
+        Replace invalid UTF-8 characters, with ``'?'`` or the given
+        character, rather than failing the load
+    truncatecolumns : bool
+        Truncate values too long for their VARCHAR or CHAR column
+    blanksasnull : bool
+        Load blank strings into VARCHAR and CHAR columns as NULL
+    emptyasnull : bool
+        Load empty strings into VARCHAR and CHAR columns as NULL
+    maxerror : int
+        Number of bad rows to skip before the load fails
+    compupdate : bool
+        Turn automatic compression analysis on or off; by default
+        Redshift analyzes loads into empty tables
+    statupdate : bool
+        Turn the ANALYZE after the load on or off; by default Redshift
+        analyzes loads which change the table significantly
+    """
+
+    def __init__(self, data_format='json', manifest=True, compression='gzip',
+                 columns=None, timeformat=None, dateformat=None,
+                 ignoreheader=None, acceptinvchars=None,
+                 truncatecolumns=False, blanksasnull=False,
+                 emptyasnull=False, maxerror=None, compupdate=None,
+                 statupdate=None):
+        self._kwargs = dict(
+            data_format=data_format, manifest=manifest,
+            compression=compression, columns=columns, timeformat=timeformat,
+            dateformat=dateformat, ignoreheader=ignoreheader,
+            acceptinvchars=acceptinvchars, truncatecolumns=truncatecolumns,
+            blanksasnull=blanksasnull, emptyasnull=emptyasnull,
+            maxerror=maxerror, compupdate=compupdate, statupdate=statupdate)
+        data_format = data_format.lower()
+        if data_format not in COPY_FORMATS:
+            raise ValueError("Unsupported COPY format %r; expected one of %s"
+                             % (data_format, ', '.join(COPY_FORMATS)))
+        if compression is not None:
+            compression = compression.lower()
+            if compression not in COPY_COMPRESSIONS:
+                raise ValueError(
+                    "Unsupported COPY compression %r; expected one of %s"
+                    % (compression, ', '.join(COPY_COMPRESSIONS)))
+        if ignoreheader is not None:
+            if data_format != 'csv':
+                raise ValueError("IGNOREHEADER only applies to CSV")
+            if int(ignoreheader) < 0:
+                raise ValueError("ignoreheader must not be negative")
+        if maxerror is not None and not 0 <= int(maxerror) <= MAX_COPY_ERRORS:
+            raise ValueError("maxerror must be between 0 and %d"
+                             % MAX_COPY_ERRORS)
+        if (acceptinvchars not in (None, True, False) and
+                len(acceptinvchars) != 1):
+            raise ValueError("acceptinvchars must be a single character")
+        if columns is not None and not columns:
+            raise ValueError("columns must not be empty")
+        self.data_format = data_format
+        self.columns = list(columns) if columns is not None else None
+
+        clauses = []
+        if manifest:
+            clauses.append('MANIFEST')
+        if compression is not None:
+            clauses.append(compression.upper())
+        if ignoreheader is not None:
+            clauses.append('IGNOREHEADER %d' % int(ignoreheader))
+        if timeformat is not None:
+            clauses.append('TIMEFORMAT %s' % _quote(timeformat))
+        if dateformat is not None:
+            clauses.append('DATEFORMAT %s' % _quote(dateformat))
+        if acceptinvchars is True:
+            clauses.append('ACCEPTINVCHARS')
+        elif acceptinvchars:
+            clauses.append('ACCEPTINVCHARS AS %s' % _quote(acceptinvchars))
+        if truncatecolumns:
+            clauses.append('TRUNCATECOLUMNS')
+        if blanksasnull:
+            clauses.append('BLANKSASNULL')
+        if emptyasnull:
+            clauses.append('EMPTYASNULL')
+        if maxerror is not None:
+            clauses.append('MAXERROR %d' % int(maxerror))
+        clauses.append(_switch('COMPUPDATE', compupdate))
+        clauses.append(_switch('STATUPDATE', statupdate))
+        self._rendered = ' '.join(c for c in clauses if c is not None)
+
+    def __str__(self):
+        return self._rendered
+
+    def __repr__(self):
+        return 'CopyOptions(%s)' % ', '.join(
+            '%s=%r' % item for item in sorted(self._kwargs.items()))
+
+    def replace(self, **changes):
+        """Return a copy of these options with *changes* applied.
+
+        >>> print(CopyOptions(timeformat='auto').replace(compupdate=False))
+        MANIFEST GZIP TIMEFORMAT 'auto' COMPUPDATE OFF
+        """
+        kwargs = dict(self._kwargs)
+        kwargs.update(changes)
+        return CopyOptions(**kwargs)
+
+    def staging(self):
+        """Return these options with the fast defaults for loading a
+        short-lived staging table: no compression analysis, since the
+        staging table is created with its encodings, and no ANALYZE,
+        since it is only read once."""
+        return self.replace(compupdate=False, statupdate=False)
+
+    def statement(self, table, source, credentials, jsonpaths=None):
+        """Return a COPY statement loading *table* from *source*.
+
+        Parameters
+        ----------
+        table : str
+            The (quoted) name of the table to load
+        source : str
+            The S3 path of the manifest or files to load
+        credentials : str
+            An authorization string, like
+            ``'aws_iam_role=arn:aws:iam::0123456789:role/MyRole'``
+        jsonpaths : str
+            The S3 path of a jsonpaths file for JSON data;
+            by default, fields are matched to columns by name
+        """
+        target = table
+        if self.columns is not None:
+            target += ' (%s)' % ', '.join('"%s"' % column
+                                          for column in self.columns)
+        if self.data_format == 'json':
+            data_format = 'JSON %s' % _quote(jsonpaths or 'auto')
+        else:
+            data_format = 'CSV'
+        return '\n'.join([
+            'COPY %s' % target,
+            'FROM %s' % _quote(source),
+            'CREDENTIALS %s' % _quote(credentials),
+            data_format,
+            self._rendered,
+        ])
+
+
+# Defaults of the loaders, matching the files they stage
+JSON_COPY_OPTIONS = CopyOptions('json', timeformat='auto')
+CSV_COPY_OPTIONS = CopyOptions('csv')
@@ -0,0 +1,337 @@
+"""
+Recommend column compression encodings from data before it is loaded.
+
+An `EncodingAdvisor` watches rows as a loader stages them (see the
+*advisor* arguments of `Redshift.copy_json_to_table` and
+`Redshift.copy_table_to_redshift`), profiling a contiguous sample of each
+column for cardinality, run lengths, deltas between consecutive values and
+value widths. Its recommendations can be applied to a
+`sqlalchemy.schema.Table` so that generated DDL is well-encoded on first
+load, without an ANALYZE COMPRESSION pass on the cluster.
+
+Profiles are computed with NumPy when it is installed.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+from collections import OrderedDict, namedtuple
+import csv
+import datetime
+import decimal
+from io import StringIO
+import json
+import numbers
+import re
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Kinds of values a column can hold, from most to least specific
+BOOLEAN = 'boolean'
+INTEGER = 'integer'
+DECIMAL = 'decimal'
+FLOAT = 'float'
+DATE = 'date'
+TIMESTAMP = 'timestamp'
+STRING = 'string'
+
+# Columns whose values repeat this many times in a row on average
+# compress best with RUNLENGTH
+RUNLENGTH_MIN_AVERAGE_RUN = 16
+# BYTEDICT stores up to 255 distinct values per block in a one-byte index
+BYTEDICT_MAX_DISTINCT = 255
+# DELTA stores differences between consecutive values in a single byte
+DELTA_MAX_ABS_DELTA = 127
+
+INTEGER_RE = re.compile(r'^[-+]?\d+$')
+DECIMAL_RE = re.compile(r'^[-+]?\d*\.\d+$')
+FLOAT_RE = re.compile(r'^[-+]?(\d+\.?\d*|\.\d+)[eE][-+]?\d+$')
+DATE_RE = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+TIMESTAMP_RE = re.compile(
+    r'^\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}(\.\d{1,6})?$')
+BOOLEAN_TEXT = {'t': True, 'true': True, 'f': False, 'false': False}
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+# Statistics describing the sampled values of a single column
+ColumnProfile = namedtuple('ColumnProfile', [
+    'kind', 'count', 'nulls', 'distinct', 'average_run', 'max_abs_delta',
+    'max_width'])
+
+
+def parse_text(value):
+    """Convert text, as found in a CSV file, to the value it represents.
+
+    >>> parse_text('42'), parse_text('f'), parse_text('')
+    (42, False, None)
+    >>> parse_text('2016-01-02 03:04:05')
+    datetime.datetime(2016, 1, 2, 3, 4, 5)
+    """
+    if value == '':
+        return None
+    if INTEGER_RE.match(value):
+        return int(value)
+    if DECIMAL_RE.match(value):
+        return decimal.Decimal(value)
+    if FLOAT_RE.match(value):
+        return float(value)
+    if value.lower() in BOOLEAN_TEXT:
+        return BOOLEAN_TEXT[value.lower()]
+    if DATE_RE.match(value):
+        return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+    if TIMESTAMP_RE.match(value):
+        value = value.replace('T', ' ')
+        fmt = '%Y-%m-%d %H:%M:%S.%f' if '.' in value else '%Y-%m-%d %H:%M:%S'
+        return datetime.datetime.strptime(value, fmt)
+    return value
+
+
+def flatten_json(doc, prefix=(), path='$'):
+    """Yield ``(name parts, jsonpath, value)`` for the leaves of *doc*.
+
+    Nested dicts are flattened; lists are kept whole, since COPY loads
+    them as JSON text.
+
+    >>> [('_'.join(parts), path) for parts, path, _ in
+    ...  flatten_json({'user': {'id': 1}})] == [('user_id', "$['user']['id']")]
+    True
+    """
+    for key, value in doc.items():
+        key_path = "%s['%s']" % (path, key)
+        if isinstance(value, dict) and value:
+            for leaf in flatten_json(value, prefix + (key,), key_path):
+                yield leaf
+        else:
+            yield prefix + (key,), key_path, value
+
+
+def value_kind(value):
+    """Return the kind of a single non-null *value*.
+
+    >>> value_kind(True), value_kind(3), value_kind(3.5), value_kind('x')
+    ('boolean', 'integer', 'float', 'string')
+    """
+    if isinstance(value, bool):
+        return BOOLEAN
+    if isinstance(value, numbers.Integral):
+        return INTEGER
+    if isinstance(value, decimal.Decimal):
+        return DECIMAL
+    if isinstance(value, float):
+        return FLOAT
+    if isinstance(value, datetime.datetime):
+        return TIMESTAMP
+    if isinstance(value, datetime.date):
+        return DATE
+    return STRING
+
+
+def combine_kinds(kinds):
+    """Return the kind able to represent values of all *kinds*.
+
+    >>> combine_kinds(['integer', 'decimal'])
+    'decimal'
+    >>> combine_kinds(['date', 'timestamp'])
+    'timestamp'
+    >>> combine_kinds(['integer', 'string'])
+    'string'
+    """
+    kinds = set(kinds)
+    if len(kinds) <= 1:
+        return kinds.pop() if kinds else STRING
+    if kinds <= set([INTEGER, DECIMAL]):
+        return DECIMAL
+    if kinds <= set([INTEGER, DECIMAL, FLOAT]):
+        return FLOAT
+    if kinds <= set([DATE, TIMESTAMP]):
+        return TIMESTAMP
+    return STRING
+
+
+def _ordinal(value, kind):
+    """Return the integer Redshift stores for *value*, for delta encoding."""
+    if kind == TIMESTAMP:
+        delta = value - EPOCH
+        return (delta.days * 86400 + delta.seconds) * 1000000 + \
+            delta.microseconds
+    if kind == DATE:
+        return value.toordinal()
+    return value
+
+
+def _width(value):
+    if not isinstance(value, (str, type(u''))):
+        value = str(value)
+    return len(value.encode('utf-8'))
+
+
+def profile_column(values):
+    """Return a `ColumnProfile` for a sequence of sampled *values*.
+
+    >>> profile_column([1, 1, 1, 2, 2, None]).average_run
+    2.5
+    """
+    present = [v for v in values if v is not None]
+    kind = combine_kinds(value_kind(v) for v in present)
+    if kind == STRING:
+        present = [v if isinstance(v, (str, type(u''))) else str(v)
+                   for v in present]
+    elif kind in (DECIMAL, FLOAT):
+        present = [float(v) for v in present]
+    elif kind == TIMESTAMP:
+        present = [v if isinstance(v, datetime.datetime)
+                   else datetime.datetime.combine(v, datetime.time())
+                   for v in present]
+    count, nulls = len(values), len(values) - len(present)
+    if not present:
+        return ColumnProfile(kind, count, nulls, 0, float(count), None, 0)
+
+    max_abs_delta = None
+    if np is not None:
+        widths = np.fromiter((_width(v) for v in present), dtype=np.int64,
+                             count=len(present))
+        if kind in (STRING, BOOLEAN):
+            array = np.array(present, dtype=object)
+            distinct = len(set(present))
+        else:
+            array = np.array(present if kind != DATE and kind != TIMESTAMP
+                             else [_ordinal(v, kind) for v in present])
+            distinct = len(np.unique(array))
+        runs = 1 + int(np.count_nonzero(array[1:] != array[:-1]))
+        if kind in (INTEGER, DATE, TIMESTAMP) and len(array) > 1:
+            max_abs_delta = int(np.abs(np.diff(array)).max())
+        max_width = int(widths.max())
+    else:
+        distinct = len(set(present))
+        runs = 1 + sum(1 for a, b in zip(present, present[1:]) if a != b)
+        if kind in (INTEGER, DATE, TIMESTAMP) and len(present) > 1:
+            ordinals = [_ordinal(v, kind) for v in present]
+            max_abs_delta = max(abs(b - a) for a, b in
+                                zip(ordinals, ordinals[1:]))
+        max_width = max(_width(v) for v in present)
+    return ColumnProfile(kind, count, nulls, distinct, len(present) / runs,
+                         max_abs_delta, max_width)
+
+
+def recommend_encoding(profile):
+    """Return the ENCODE type best suited to a `ColumnProfile`.
+
+    >>> recommend_encoding(ColumnProfile('integer', 100, 0, 90, 1.0, 5, 3))
+    'delta'
+    >>> recommend_encoding(ColumnProfile('string', 100, 0, 12, 1.2, None, 8))
+    'bytedict'
+    """
+    kind = profile.kind
+    if profile.average_run >= RUNLENGTH_MIN_AVERAGE_RUN:
+        return 'runlength'
+    if kind == BOOLEAN:
+        return 'zstd'
+    if kind in (INTEGER, DATE, TIMESTAMP):
+        if (profile.max_abs_delta is not None and
+                profile.max_abs_delta <= DELTA_MAX_ABS_DELTA):
+            return 'delta'
+        return 'az64'
+    if kind == DECIMAL:
+        return 'az64'
+    if profile.distinct <= BYTEDICT_MAX_DISTINCT:
+        return 'bytedict'
+    return 'zstd'
+
+
+class EncodingAdvisor(object):
+    """Profile rows as they are staged and recommend column encodings.
+
+    Only the first *sample_size* rows are profiled; a contiguous sample
+    preserves the runs and deltas that RUNLENGTH and DELTA rely on.
+
+    Parameters
+    ----------
+    sample_size : int
+        Number of rows to profile
+    columns : list of str
+        Names for the positions of sequence rows, like those parsed
+        from CSV; dict rows are profiled by key, with the keys of nested
+        dicts joined by underscores
+    """
+
+    def __init__(self, sample_size=100000, columns=None):
+        self.sample_size = sample_size
+        self.columns = list(columns) if columns is not None else None
+        self.rows_seen = 0
+        self._samples = OrderedDict()
+
+    def _column(self, key):
+        samples = self._samples.get(key)
+        if samples is None:
+            # Columns first seen late are null in the rows before
+            samples = self._samples[key] = [None] * self.rows_sampled
+        return samples
+
+    @property
+    def rows_sampled(self):
+        return min(self.rows_seen, self.sample_size)
+
+    def observe(self, row):
+        """Add a single dict or sequence *row* to the sample."""
+        if self.rows_seen >= self.sample_size:
+            self.rows_seen += 1
+            return
+        if isinstance(row, dict):
+            # Named like the columns `SchemaInferrer` creates
+            items = (('_'.join(parts), value)
+                     for parts, _, value in flatten_json(row))
+        else:
+            names = self.columns or range(len(row))
+            items = zip(names, row)
+        seen = set()
+        for key, value in items:
+            if isinstance(value, (dict, list)):
+                value = json.dumps(value) if value else None
+            self._column(key).append(value)
+            seen.add(key)
+        self.rows_seen += 1
+        for key, samples in self._samples.items():
+            if key not in seen:
+                samples.append(None)
+
+    def observe_csv(self, text):
+        """Parse CSV *text*, as staged by `copy_table_to_redshift`,
+        and add its rows to the sample.
+        """
+        if self.rows_seen >= self.sample_size:
+            return
+        for row in csv.reader(StringIO(text)):
+            self.observe([parse_text(value) for value in row])
+            if self.rows_seen >= self.sample_size:
+                break
+
+    def profiles(self):
+        """Return an `OrderedDict` mapping columns to `ColumnProfile`."""
+        return OrderedDict((key, profile_column(values))
+                           for key, values in self._samples.items())
+
+    def recommendations(self):
+        """Return an `OrderedDict` mapping columns to ENCODE types."""
+        return OrderedDict((key, recommend_encoding(profile))
+                           for key, profile in self.profiles().items())
+
+    def apply(self, table, raw_columns=()):
+        """Set recommended encodings on the columns of *table*.
+
+        Columns are matched by name, or by position for sequence rows
+        without *columns* names. Columns in *raw_columns*, like the
+        leading sort key column, are left RAW so that range-restricted
+        scans can skip blocks as effectively as possible.
+        """
+        recommendations = self.recommendations()
+        for position, column in enumerate(table.columns):
+            encoding = recommendations.get(column.key,
+                                           recommendations.get(position))
+            if column.key in raw_columns:
+                encoding = 'raw'
+            if encoding is not None:
+                column.info['encode'] = encoding
+        return table
@@ -0,0 +1,360 @@
+"""
+Infer tight Redshift column types for data before it is loaded.
+
+A `SchemaInferrer` watches every row a loader stages (see the
+*create_table* arguments of `Redshift.copy_json_to_table` and
+`Redshift.copy_table_to_redshift`), tracking the kinds of values in each
+column along with their integer ranges, numeric precision and byte widths.
+It then builds a `sqlalchemy.schema.Table` using the narrowest types that
+hold the data, so that `Redshift.table_definition` can compile its
+CREATE TABLE statement.
+
+`redshift_type_for_postgres` does the same for the columns of an
+existing Postgres table; see `Redshift.pg_infer_table`.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+from collections import OrderedDict
+import csv
+import decimal
+from io import StringIO
+import json
+import math
+import re
+
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import DOUBLE_PRECISION
+
+from shiftmanager.encoding import (BOOLEAN, DATE, DECIMAL, FLOAT, INTEGER,
+                                   TIMESTAMP, DATE_RE, TIMESTAMP_RE,
+                                   combine_kinds, flatten_json, parse_text,
+                                   value_kind)
+
+# Inclusive ranges of the Redshift integer types, narrowest first
+INTEGER_TYPES = [
+    (-2 ** 15, 2 ** 15 - 1, sa.SMALLINT),
+    (-2 ** 31, 2 ** 31 - 1, sa.INTEGER),
+    (-2 ** 63, 2 ** 63 - 1, sa.BIGINT),
+]
+MAX_NUMERIC_PRECISION = 38
+MAX_VARCHAR_LENGTH = 65535
+# Length for columns holding only NULLs, whose width is unknown
+DEFAULT_VARCHAR_LENGTH = 256
+# Fraction of the widest value added to VARCHAR lengths, so that slightly
+# longer values arriving in later loads still fit
+DEFAULT_HEADROOM = 0.25
+
+# Parts of a jsonpath, like ['key'] or [0]
+JSONPATH_PART_RE = re.compile(r"\['([^']*)'\]|\[(\d+)\]")
+
+# Postgres types (as named by information_schema.columns.data_type)
+# with a direct Redshift equivalent
+POSTGRES_TYPES = {
+    'smallint': sa.SMALLINT,
+    'integer': sa.INTEGER,
+    'bigint': sa.BIGINT,
+    'real': sa.REAL,
+    'double precision': DOUBLE_PRECISION,
+    'boolean': sa.BOOLEAN,
+    'date': sa.DATE,
+    'timestamp without time zone': sa.TIMESTAMP,
+}
+
+
+def varchar_length(width, headroom=DEFAULT_HEADROOM):
+    """Return a VARCHAR length for values up to *width* bytes wide.
+
+    >>> varchar_length(20), varchar_length(0), varchar_length(60000)
+    (25, 1, 65535)
+    """
+    length = int(math.ceil(width * (1 + headroom)))
+    return min(MAX_VARCHAR_LENGTH, max(1, length))
+
+
+def integer_type(low, high):
+    """Return the narrowest integer type holding *low* through *high*.
+
+    >>> integer_type(0, 40000)
+    INTEGER()
+    >>> integer_type(-2 ** 70, 0)
+    NUMERIC(precision=22, scale=0)
+    """
+    for type_low, type_high, type_class in INTEGER_TYPES:
+        if type_low <= low and high <= type_high:
+            return type_class()
+    digits = max(len(str(abs(low))), len(str(abs(high))))
+    if digits <= MAX_NUMERIC_PRECISION:
+        return sa.NUMERIC(digits, 0)
+    return None
+
+
+def _digits(value):
+    """Return the digits of *value* before and after the decimal point.
+
+    >>> _digits(decimal.Decimal('-123.45')), _digits(7)
+    ((3, 2), (1, 0))
+    """
+    if not isinstance(value, decimal.Decimal):
+        return len(str(abs(value))), 0
+    _, digits, exponent = value.as_tuple()
+    if exponent >= 0:
+        return len(digits) + exponent, 0
+    return max(len(digits) + exponent, 0), -exponent
+
+
+class _ColumnStats(object):
+    """Running statistics of the values seen in one column."""
+
+    def __init__(self):
+        self.kinds = set()
+        self.low = self.high = None
+        self.integer_digits = self.scale = 0
+        self.width = 0
+        self.timezone = False
+
+    def add(self, value, width):
+        if value is None:
+            return
+        kind = value_kind(value)
+        self.kinds.add(kind)
+        self.width = max(self.width, width)
+        if kind == INTEGER:
+            self.low = value if self.low is None else min(self.low, value)
+            self.high = value if self.high is None else max(self.high, value)
+        if kind in (INTEGER, DECIMAL):
+            integer_digits, scale = _digits(value)
+            self.integer_digits = max(self.integer_digits, integer_digits)
+            self.scale = max(self.scale, scale)
+        elif kind == TIMESTAMP and value.tzinfo is not None:
+            self.timezone = True
+
+    def column_type(self, headroom):
+        """Return the narrowest SQLAlchemy type for the values seen."""
+        if not self.kinds:
+            return sa.VARCHAR(DEFAULT_VARCHAR_LENGTH)
+        kind = combine_kinds(self.kinds)
+        column_type = None
+        if kind == BOOLEAN:
+            column_type = sa.BOOLEAN()
+        elif kind == INTEGER:
+            column_type = integer_type(self.low, self.high)
+        elif kind == DECIMAL:
+            precision = self.integer_digits + self.scale
+            if precision <= MAX_NUMERIC_PRECISION:
+                column_type = sa.NUMERIC(max(precision, 1), self.scale)
+            else:
+                column_type = DOUBLE_PRECISION()
+        elif kind == FLOAT:
+            column_type = DOUBLE_PRECISION()
+        elif kind == DATE:
+            column_type = sa.DATE()
+        elif kind == TIMESTAMP:
+            column_type = sa.TIMESTAMP(timezone=self.timezone)
+        if column_type is None:
+            column_type = sa.VARCHAR(varchar_length(self.width, headroom))
+        return column_type
+
+
+def _parse_json_string(value):
+    """Parse date and timestamp strings, which COPY converts with
+    ``TIMEFORMAT 'auto'``; other JSON strings stay strings."""
+    if DATE_RE.match(value) or TIMESTAMP_RE.match(value):
+        return parse_text(value)
+    return value
+
+
+def _path_name(path):
+    """Return a column name for a jsonpath.
+
+    >>> str(_path_name("$['user']['ids'][0]"))
+    'user_ids_0'
+    """
+    return '_'.join(key or index
+                    for key, index in JSONPATH_PART_RE.findall(path))
+
+
+class SchemaInferrer(object):
+    """Infer Redshift column types from rows as they are staged.
+
+    Unlike `shiftmanager.encoding.EncodingAdvisor`, every row is observed,
+    since a single wide or large value missed by sampling would make
+    the load fail.
+
+    Parameters
+    ----------
+    columns : list of str
+        Names for the positions of sequence rows, like those parsed
+        from CSV; dict rows are named by key, with the keys of nested
+        dicts joined by underscores
+    """
+
+    def __init__(self, columns=None):
+        self.columns = list(columns) if columns is not None else None
+        self.rows_seen = 0
+        self._stats = OrderedDict()
+        self._paths = {}
+
+    def _column(self, key):
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = self._stats[key] = _ColumnStats()
+        return stats
+
+    def _observe_values(self, items):
+        for key, value, width in items:
+            self._column(key).add(value, width)
+        self.rows_seen += 1
+
+    def observe(self, row):
+        """Add a single dict or sequence *row* to the statistics."""
+        if not isinstance(row, dict):
+            names = self.columns or range(len(row))
+            self._observe_values(
+                (key, value, len(('%s' % value).encode('utf-8')))
+                for key, value in zip(names, row))
+            return
+        items = []
+        for parts, path, value in flatten_json(row):
+            key = '_'.join(parts)
+            self._paths[key] = path
+            if isinstance(value, (dict, list)):
+                value = json.dumps(value) if value else None
+            elif isinstance(value, (str, type(u''))):
+                value = _parse_json_string(value)
+            if value is None:
+                width = 0
+            elif isinstance(value, (str, type(u''))):
+                width = len(value.encode('utf-8'))
+            else:
+                width = len(json.dumps(value, default=str))
+            items.append((key, value, width))
+        self._observe_values(items)
+
+    def observe_csv(self, text):
+        """Parse CSV *text*, as staged by `copy_table_to_redshift`,
+        and add its rows to the statistics.
+        """
+        names = self.columns
+        for row in csv.reader(StringIO(text)):
+            keys = names or range(len(row))
+            self._observe_values(
+                (key, parse_text(value), len(value.encode('utf-8')))
+                for key, value in zip(keys, row))
+
+    def column_types(self, headroom=DEFAULT_HEADROOM, jsonpaths=None):
+        """Return an `OrderedDict` mapping columns to SQLAlchemy types.
+
+        Parameters
+        ----------
+        headroom : float
+            Fraction of the widest value to add to VARCHAR lengths
+        jsonpaths : dict
+            Order the columns to match this jsonpaths file, as they must
+            be to COPY with it; paths never observed get VARCHAR columns
+        """
+        if jsonpaths is None:
+            keys = list(self._stats)
+        else:
+            keys_by_path = dict((path, key)
+                                for key, path in self._paths.items())
+            keys = [keys_by_path.get(path) or _path_name(path)
+                    for path in jsonpaths['jsonpaths']]
+        return OrderedDict((key, self._stats.get(key, _ColumnStats())
+                            .column_type(headroom))
+                           for key in keys)
+
+    def jsonpaths(self):
+        """Return a Redshift jsonpaths dict matching the column order of
+        `table`, for COPYing the observed dict rows."""
+        return {'jsonpaths': [self._paths[key] for key in self._stats]}
+
+    def table(self, name, schema=None, metadata=None,
+              headroom=DEFAULT_HEADROOM, distkey=None, sortkey=None,
+              diststyle=None, interleaved=False, jsonpaths=None):
+        """Return a `sqlalchemy.schema.Table` with the inferred columns.
+
+        Parameters
+        ----------
+        name : str
+            Name of the table
+        schema : str
+            Schema of the table
+        metadata : `sqlalchemy.schema.MetaData`
+            MetaData to define the table in; defaults to a new one
+        headroom : float
+            Fraction of the widest value to add to VARCHAR lengths
+        distkey : str
+            Column to distribute rows by
+        sortkey : str or list of str
+            Column(s) to sort rows by
+        diststyle : str
+            One of ``'EVEN'``, ``'KEY'`` or ``'ALL'``
+        interleaved : bool
+            Use an interleaved rather than a compound sort key
+        jsonpaths : dict
+            Order the columns to match this jsonpaths file
+        """
+        column_types = self.column_types(headroom, jsonpaths)
+        columns = [sa.Column(key, column_type)
+                   for key, column_type in column_types.items()]
+        return build_table(name, columns, schema, metadata, distkey,
+                           sortkey, diststyle, interleaved)
+
+
+def build_table(name, columns, schema=None, metadata=None, distkey=None,
+                sortkey=None, diststyle=None, interleaved=False):
+    """Return a `sqlalchemy.schema.Table` of *columns* with Redshift
+    distribution and sort options, as accepted by `SchemaInferrer.table`.
+    """
+    table_kwargs = {}
+    if distkey is not None:
+        table_kwargs['redshift_distkey'] = distkey
+    if diststyle is not None:
+        table_kwargs['redshift_diststyle'] = diststyle.upper()
+    if sortkey is not None:
+        if interleaved:
+            table_kwargs['redshift_interleaved_sortkey'] = sortkey
+        else:
+            table_kwargs['redshift_sortkey'] = sortkey
+    if metadata is None:
+        metadata = sa.MetaData()
+    return sa.Table(name, metadata, *columns, schema=schema, **table_kwargs)
+
+
+def is_measured(data_type):
+    """Return whether Postgres columns of *data_type* become VARCHARs
+    sized by measuring their values."""
+    return (data_type not in POSTGRES_TYPES and
+            data_type not in ('numeric', 'timestamp with time zone'))
+
+
+def redshift_type_for_postgres(data_type, precision=None, scale=None,
+                               width=None, headroom=DEFAULT_HEADROOM):
+    """Return the Redshift type for a Postgres column.
+
+    Text and other types without a Redshift equivalent become VARCHARs
+    sized from *width*, the measured maximum byte length of the column's
+    values as text (`DEFAULT_VARCHAR_LENGTH` if unknown, as for a column
+    of NULLs). Postgres character lengths count characters rather
+    than bytes, so they are not used. Pass the measured *precision* and
+    *scale* for unconstrained numeric columns.
+
+    >>> redshift_type_for_postgres('numeric', 12, 2)
+    NUMERIC(precision=12, scale=2)
+    >>> redshift_type_for_postgres('text', width=40)
+    VARCHAR(length=50)
+    """
+    type_class = POSTGRES_TYPES.get(data_type)
+    if type_class is not None:
+        return type_class()
+    if data_type == 'timestamp with time zone':
+        return sa.TIMESTAMP(timezone=True)
+    if data_type == 'numeric':
+        if precision is not None and precision <= MAX_NUMERIC_PRECISION:
+            return sa.NUMERIC(max(precision, 1), scale or 0)
+        return DOUBLE_PRECISION()
+    if width is None:
+        return sa.VARCHAR(DEFAULT_VARCHAR_LENGTH)
+    return sa.VARCHAR(varchar_length(width, headroom))
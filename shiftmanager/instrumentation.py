@@ -0,0 +1,258 @@
+"""
+Listeners for observing the statements and pipeline phases run by `Redshift`.
+
+A listener is any callable accepting a single `Event`. Register listeners
+with `Redshift.add_listener`::
+
+    stats = AggregatingListener()
+    redshift.add_listener(stats)
+    redshift.add_listener(LoggingListener())
+
+Two kinds of events are emitted:
+
+* ``'statement'`` events for each SQL batch sent to Redshift,
+  named for the method which sent them (``'execute'``, ``'iter_query'``, ...)
+* ``'phase'`` events for each step of the S3 and Postgres loaders
+  (``'serialize'``, ``'upload'``, ``'copy'``, ...)
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+from contextlib import contextmanager
+import hashlib
+import logging
+import re
+import time
+
+
+# Literals and whitespace runs which are normalized away in fingerprints
+STRING_LITERAL_RE = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_statement(statement):
+    """Return *statement* with literals replaced and whitespace collapsed.
+
+    >>> print(normalize_statement("SELECT *\\n  FROM foo WHERE id = 42"))
+    SELECT * FROM foo WHERE id = ?
+    >>> print(normalize_statement("INSERT INTO foo VALUES ('a''b', 1.5)"))
+    INSERT INTO foo VALUES (?, ?)
+    """
+    if isinstance(statement, bytes):
+        statement = statement.decode('utf-8')
+    normalized = STRING_LITERAL_RE.sub('?', statement)
+    normalized = NUMBER_LITERAL_RE.sub('?', normalized)
+    return WHITESPACE_RE.sub(' ', normalized).strip()
+
+
+def fingerprint(statement):
+    """Return a short hash identifying the normalized form of *statement*.
+
+    Statements differing only in their literal values share a fingerprint.
+
+    >>> fingerprint("SELECT 1") == fingerprint("SELECT  2")
+    True
+    """
+    return _hash(normalize_statement(statement))
+
+
+def _hash(normalized):
+    return hashlib.md5(normalized.encode('utf-8')).hexdigest()[:16]
+
+
+class Event(object):
+    """A single instrumented statement or pipeline phase.
+
+    Attributes
+    ----------
+    kind : str
+        Either ``'statement'`` or ``'phase'``
+    name : str
+        The method (for statements) or pipeline step (for phases)
+    statement : str or None
+        The normalized SQL text, for statement events; computed on first
+        access, so events nobody inspects cost nothing to normalize
+    fingerprint : str or None
+        A hash of *statement*, stable across differing literal values
+    start, end : float
+        Unix timestamps bounding the event
+    duration : float
+        Seconds elapsed between *start* and *end*
+    rowcount : int or None
+        Rows affected or returned, where known
+    bytes_serialized, bytes_compressed, bytes_uploaded : int or None
+        Data volumes handled during a phase, where known
+    query_id : int or None
+        The Redshift query id, as returned by ``pg_last_query_id()``
+    error : Exception or None
+        The exception raised during the event, if any
+    """
+
+    def __init__(self, kind, name, statement=None):
+        self.kind = kind
+        self.name = name
+        self._raw_statement = statement
+        self._statement = None
+        self._fingerprint = None
+        self.start = None
+        self.end = None
+        self.duration = None
+        self.rowcount = None
+        self.bytes_serialized = None
+        self.bytes_compressed = None
+        self.bytes_uploaded = None
+        self.query_id = None
+        self.error = None
+
+    @property
+    def statement(self):
+        if self._statement is None and self._raw_statement is not None:
+            self._statement = normalize_statement(self._raw_statement)
+        return self._statement
+
+    @property
+    def fingerprint(self):
+        if self._fingerprint is None and self.statement is not None:
+            self._fingerprint = _hash(self.statement)
+        return self._fingerprint
+
+    def __repr__(self):
+        return '<Event %s %s %s %.3fs>' % (
+            self.kind, self.name, self.fingerprint or '-',
+            self.duration or 0.0)
+
+
+@contextmanager
+def instrumented(listeners, kind, name, statement=None):
+    """Yield an `Event` which is timed and dispatched to *listeners*.
+
+    The caller may fill in attributes like *rowcount* on the yielded event.
+    If the block raises, the exception is recorded on the event
+    before being re-raised. With no *listeners*, the event is not timed.
+    """
+    event = Event(kind, name, statement)
+    if not listeners:
+        yield event
+        return
+    event.start = time.time()
+    try:
+        yield event
+    except Exception as e:
+        event.error = e
+        raise
+    finally:
+        event.end = time.time()
+        event.duration = event.end - event.start
+        for listener in listeners:
+            listener(event)
+
+
+class LoggingListener(object):
+    """Log a one-line summary of each event.
+
+    Parameters
+    ----------
+    logger : `logging.Logger`
+        Defaults to the ``shiftmanager`` logger
+    level : int
+        Level at which successful events are logged;
+        failed events are always logged at ERROR
+    """
+
+    def __init__(self, logger=None, level=logging.INFO):
+        self.logger = logger or logging.getLogger('shiftmanager')
+        self.level = level
+
+    def __call__(self, event):
+        fields = ['%s %s' % (event.kind, event.name),
+                  'duration=%.3fs' % event.duration]
+        for attr in ('fingerprint', 'query_id', 'rowcount',
+                     'bytes_serialized', 'bytes_compressed',
+                     'bytes_uploaded'):
+            value = getattr(event, attr)
+            if value is not None:
+                fields.append('%s=%s' % (attr, value))
+        if event.error is not None:
+            fields.append('error=%r' % event.error)
+            self.logger.error(' '.join(fields))
+        else:
+            self.logger.log(self.level, ' '.join(fields))
+
+
+class EventStats(object):
+    """Accumulated totals for events sharing a kind, name and fingerprint.
+    """
+
+    def __init__(self, kind, name, fingerprint, statement):
+        self.kind = kind
+        self.name = name
+        self.fingerprint = fingerprint
+        self.statement = statement
+        self.count = 0
+        self.errors = 0
+        self.total_duration = 0.0
+        self.max_duration = 0.0
+        self.rowcount = 0
+        self.bytes_serialized = 0
+        self.bytes_compressed = 0
+        self.bytes_uploaded = 0
+
+    @property
+    def mean_duration(self):
+        return self.total_duration / self.count if self.count else 0.0
+
+    def add(self, event):
+        self.count += 1
+        if event.error is not None:
+            self.errors += 1
+        self.total_duration += event.duration
+        self.max_duration = max(self.max_duration, event.duration)
+        for attr in ('rowcount', 'bytes_serialized', 'bytes_compressed',
+                     'bytes_uploaded'):
+            value = getattr(event, attr)
+            if value is not None and value > 0:
+                setattr(self, attr, getattr(self, attr) + value)
+
+    def __repr__(self):
+        return '<EventStats %s %s %s count=%d total=%.3fs>' % (
+            self.kind, self.name, self.fingerprint or '-',
+            self.count, self.total_duration)
+
+
+class AggregatingListener(object):
+    """Aggregate event timings and volumes in memory.
+
+    Events are grouped by kind, name and statement fingerprint, so that
+    hot paths can be identified across many executions::
+
+        >>> stats = AggregatingListener()
+        >>> with instrumented([stats], 'statement', 'execute', 'SELECT 1'):
+        ...     pass
+        >>> with instrumented([stats], 'statement', 'execute', 'SELECT 2'):
+        ...     pass
+        >>> for s in stats.summary():
+        ...     print(s.name, s.statement, s.count)
+        execute SELECT ? 2
+    """
+
+    def __init__(self):
+        self.stats = {}
+
+    def __call__(self, event):
+        key = (event.kind, event.name, event.fingerprint)
+        stats = self.stats.get(key)
+        if stats is None:
+            stats = self.stats[key] = EventStats(
+                event.kind, event.name, event.fingerprint, event.statement)
+        stats.add(event)
+
+    def summary(self):
+        """Return a list of `EventStats`, by descending total duration."""
+        return sorted(self.stats.values(),
+                      key=lambda s: s.total_duration, reverse=True)
+
+    def reset(self):
+        """Discard all accumulated statistics."""
+        self.stats = {}
@@ -1,6 +1,10 @@
 # flake8: noqa
 
 from .admin import AdminMixin
+from .advisor import AdvisorMixin
+from .compression import CompressionMixin
+from .maintenance import MaintenanceMixin
+from .migration import MigrationMixin
 from .postgres import PostgresMixin
 from .reflection import ReflectionMixin
 from .s3 import S3Mixin
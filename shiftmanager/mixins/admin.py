@@ -1,7 +1,29 @@
+from collections import namedtuple
+import datetime
 import functools
 import random
+import re
 import string
 
+import psycopg2
+
+from shiftmanager import queries
+
+# Settings of a user that `provisioning_batch` compares; *parameters*
+# maps configuration parameters to their values as text
+UserState = namedtuple('UserState', [
+    'name', 'createdb', 'createuser', 'valid_until', 'parameters', 'groups'])
+
+# Keys of a user spec that aren't configuration parameters
+USER_OPTIONS = ('password', 'valid_until', 'createdb', 'createuser', 'groups')
+
+# A time zone offset at the end of a timestamp
+TIMEZONE_RE = re.compile(r'(\d\d:\d\d:\d\d(?:\.\d+)?)[+-]\d\d(?::?\d\d)?$')
+
+# Formats accepted for VALID UNTIL strings, once any time zone is removed
+VALID_UNTIL_FORMATS = ('%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S',
+                       '%Y-%m-%d %H:%M', '%Y-%m-%d')
+
 
 def random_password(length=64):
     """Return a strong password valid for Redshift.
@@ -33,6 +55,168 @@ def random_password(length=64):
     return ''.join(chars)
 
 
+def _literal(value):
+    """Render *value* as a SQL literal without a database round trip.
+
+    >>> print(_literal("it's"))
+    'it''s'
+    """
+    return psycopg2.extensions.adapt(value).getquoted().decode('utf-8')
+
+
+def _valid_until(value):
+    """Normalize a VALID UNTIL time for comparison.
+
+    >>> import datetime
+    >>> print(_valid_until(datetime.datetime(2015, 1, 1)))
+    2015-01-01 00:00:00
+    >>> print(_valid_until('2015-01-01 00:00:00+00'))
+    2015-01-01 00:00:00
+    >>> print(_valid_until('2015-01-01'))
+    2015-01-01 00:00:00
+    >>> print(_valid_until('infinity'))
+    infinity
+    """
+    if value is None:
+        return None
+    if not hasattr(value, 'strftime'):
+        text = TIMEZONE_RE.sub(r'\1', str(value).strip()).replace('T', ' ')
+        for fmt in VALID_UNTIL_FORMATS:
+            try:
+                value = datetime.datetime.strptime(text, fmt)
+                break
+            except ValueError:
+                pass
+        else:
+            return text
+    return value.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def parse_user_state(rows):
+    """Return ``(users, groups)`` from rows of `queries.users_and_groups`.
+
+    *users* maps user names to `UserState` and *groups* maps group names
+    to sets of member names.
+    """
+    names, users, members = {}, {}, {}
+    for kind, name, sysid, createdb, superuser, valid_until, extra in rows:
+        if kind == 'user':
+            names[sysid] = name
+            parameters = dict(setting.split('=', 1)
+                              for setting in (extra or '').split('\n')
+                              if '=' in setting)
+            users[name] = (createdb, superuser, valid_until, parameters)
+        else:
+            members[name] = [int(i) for i in (extra or '').split(',') if i]
+    groups = dict((group, set(names[i] for i in ids if i in names))
+                  for group, ids in members.items())
+    states = {}
+    for name, (createdb, superuser, valid_until, parameters) in users.items():
+        states[name] = UserState(
+            name, bool(createdb), bool(superuser), valid_until, parameters,
+            set(group for group, group_members in groups.items()
+                if name in group_members))
+    return states, groups
+
+
+def diff_users(current_users, current_groups, users, groups=(),
+               drop_users=False, drop_groups=False, reset_passwords=False,
+               quote=lambda name: name):
+    """Return the statements turning the current users and groups into
+    the desired ones; see `AdminMixin.provisioning_batch`.
+
+    >>> users, groups = parse_user_state([
+    ...     ('user', 'ann', 100, False, False, None, 'search_path=a'),
+    ...     ('group', 'analysts', 1, None, None, None, '100')])
+    >>> for statement in diff_users(users, groups, {
+    ...         'ann': {'groups': ['analysts']},
+    ...         'bob': {'password': 'Secret123', 'groups': ['analysts'],
+    ...                 'wlm_query_slot_count': 2}}):
+    ...     print(statement)
+    ALTER USER ann RESET search_path
+    CREATE USER bob PASSWORD 'Secret123'
+    ALTER USER bob SET wlm_query_slot_count = 2
+    ALTER GROUP analysts ADD USER bob
+    """
+    statements = []
+    wanted_groups = set(groups)
+    for spec in users.values():
+        wanted_groups.update(spec.get('groups') or ())
+    for group in sorted(wanted_groups - set(current_groups)):
+        statements.append('CREATE GROUP %s' % quote(group))
+
+    membership = {}
+    for name in sorted(users):
+        spec = users[name]
+        parameters = dict((key, value) for key, value in spec.items()
+                          if key not in USER_OPTIONS)
+        current = current_users.get(name)
+        options = []
+        if current is None:
+            if spec.get('createdb'):
+                options.append('CREATEDB')
+            if spec.get('createuser'):
+                options.append('CREATEUSER')
+            password = spec.get('password')
+            options.append('PASSWORD %s' % (_literal(password)
+                                            if password else 'DISABLE'))
+            if spec.get('valid_until') is not None:
+                options.append('VALID UNTIL %s' % _literal(
+                    _valid_until(spec['valid_until'])))
+            statements.append('CREATE USER %s %s' % (quote(name),
+                                                     ' '.join(options)))
+            current = UserState(name, None, None, None, {}, set())
+        else:
+            for key, flag in (('createdb', current.createdb),
+                              ('createuser', current.createuser)):
+                if spec.get(key) is not None and bool(spec[key]) != flag:
+                    options.append(('' if spec[key] else 'NO') + key.upper())
+            if reset_passwords and spec.get('password'):
+                options.append('PASSWORD %s' % _literal(spec['password']))
+            if (spec.get('valid_until') is not None and
+                    _valid_until(spec['valid_until']) !=
+                    _valid_until(current.valid_until)):
+                options.append('VALID UNTIL %s' % _literal(
+                    _valid_until(spec['valid_until'])))
+            if options:
+                statements.append('ALTER USER %s %s' % (quote(name),
+                                                        ' '.join(options)))
+        for param in sorted(parameters):
+            value = parameters[param]
+            if value is None:
+                continue
+            if current.parameters.get(param) != str(value):
+                statements.append('ALTER USER %s SET %s = %s'
+                                  % (quote(name), param, value))
+        for param in sorted(current.parameters):
+            if parameters.get(param) is None:
+                statements.append('ALTER USER %s RESET %s'
+                                  % (quote(name), param))
+        desired = set(spec.get('groups') or ())
+        for group in desired - current.groups:
+            membership.setdefault(group, ([], []))[0].append(name)
+        for group in current.groups - desired:
+            membership.setdefault(group, ([], []))[1].append(name)
+
+    for group in sorted(membership):
+        added, removed = membership[group]
+        if added:
+            statements.append('ALTER GROUP %s ADD USER %s' % (
+                quote(group), ', '.join(quote(n) for n in sorted(added))))
+        if removed:
+            statements.append('ALTER GROUP %s DROP USER %s' % (
+                quote(group), ', '.join(quote(n) for n in sorted(removed))))
+    if drop_users:
+        # Superusers, like the rdsdb system account, are never dropped
+        for name in sorted(set(current_users) - set(users)):
+            if not current_users[name].createuser:
+                statements.append('DROP USER %s' % quote(name))
+    if drop_groups:
+        for group in sorted(set(current_groups) - wanted_groups):
+            statements.append('DROP GROUP %s' % quote(group))
+    return statements
+
+
 class AdminMixin(object):
     """User administration base class for `Redshift`."""
 
@@ -142,3 +326,65 @@ class AdminMixin(object):
                 options.append("SET %s = %s" % (param, value))
         statement += ' '.join(options)
         return self.mogrify(statement, data, execute)
+
+    def user_state(self):
+        """Return the current ``(users, groups)`` of the cluster, read from
+        ``pg_user`` and ``pg_group`` in one query; see `parse_user_state`.
+        """
+        return parse_user_state(
+            self.engine.execute(queries.users_and_groups).fetchall())
+
+    def provisioning_batch(self, users, groups=(), drop_users=False,
+                           drop_groups=False, reset_passwords=False,
+                           current=None, execute=False):
+        """Return a SQL str bringing users and groups in line with a spec.
+
+        The current state is read with `user_state` and compared to the
+        spec, and only the differences are rendered, locally and without
+        a round trip per statement, into a single batch that runs in one
+        transaction. An empty string means nothing needs to change.
+
+        Each user's spec is a dict taking the arguments of `create_user`
+        and describes the complete desired state: the user is added to and
+        removed from groups to match *groups*, and configuration
+        parameters it doesn't mention are reset. Flags and VALID UNTIL are
+        only changed when given. Passwords can't be compared, so they are
+        only used for new users (who otherwise get PASSWORD DISABLE)
+        unless *reset_passwords* is set::
+
+            redshift.provisioning_batch({
+                'ann': {'groups': ['analysts'], 'wlm_query_slot_count': 2},
+                'bob': {'password': password, 'valid_until': '2018-01-01',
+                        'groups': ['analysts', 'etl']},
+            }, execute=True)
+
+        Parameters
+        ----------
+        users : dict
+            Maps user names to dicts with optional ``password``,
+            ``valid_until``, ``createdb``, ``createuser`` and ``groups``
+            keys; other keys are configuration parameters, like
+            ``wlm_query_slot_count``
+        groups : iterable of str
+            Groups to create even if no user belongs to them
+        drop_users : boolean
+            Drop users not in *users*, other than superusers
+        drop_groups : boolean
+            Drop groups neither in *groups* nor held by any user
+        reset_passwords : boolean
+            Set the passwords of existing users to those in *users*
+        current : tuple
+            The ``(users, groups)`` from `user_state`, if already read
+        execute : boolean
+            Execute the batch in addition to returning it.
+        """
+        current_users, current_groups = current or self.user_state()
+        statements = diff_users(current_users, current_groups, users, groups,
+                                drop_users, drop_groups, reset_passwords,
+                                self.preparer.quote)
+        if not statements:
+            return ''
+        batch = ';\n'.join(statements) + ';'
+        if execute:
+            self.execute(batch)
+        return batch
@@ -0,0 +1,482 @@
+"""
+Mixin classes for recommending distribution and sort keys
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+from collections import defaultdict, namedtuple
+import datetime
+import re
+
+from shiftmanager import queries
+
+# Tables no bigger than this are worth copying to every node
+# (DISTSTYLE ALL) when queries keep broadcasting them
+DISTSTYLE_ALL_MAX_MB = 512
+# Default number of columns in a recommended compound sort key
+SORTKEY_COLUMNS = 2
+# A replacement distribution key needs at least this many distinct values
+# per slice to spread rows evenly, and few NULLs, which all hash to one slice
+MIN_DISTKEY_VALUES_PER_SLICE = 100
+MAX_DISTKEY_NULL_FRACTION = 0.05
+
+# A row from queries.table_key_stats
+TableKeyStats = namedtuple('TableKeyStats', [
+    'schema', 'table', 'table_id', 'diststyle', 'sortkey1', 'size_mb',
+    'tbl_rows', 'skew_rows'])
+
+# System table rows read for a period of query history;
+# see `AdvisorMixin.workload`
+Workload = namedtuple('Workload', [
+    'tables', 'columns', 'explain', 'scans', 'redistribution', 'days',
+    'fetched_at'])
+
+# A recommended key change; *kwargs* are ready to pass to `deep_copy`,
+# and *dist_benefit* and *sort_benefit* estimate the MB of redistribution
+# and of scanning per day each change would save
+KeyRecommendation = namedtuple('KeyRecommendation', [
+    'schema', 'table', 'diststyle', 'distkey', 'sortkey', 'dist_benefit',
+    'sort_benefit', 'benefit', 'kwargs'])
+
+# A table whose rows are unevenly spread across slices, with the
+# distribution recommended to fix it; *block_skew* is the ratio of the
+# fullest slice's blocks to the average, *excess_mb* how many more MB
+# (blocks) than its fair share the fullest slice holds, and *cardinality*
+# maps the measured columns to (approximate distinct values, null fraction)
+SkewedTable = namedtuple('SkewedTable', [
+    'schema', 'table', 'size_mb', 'skew_rows', 'block_skew', 'excess_mb',
+    'diststyle', 'distkey', 'cardinality', 'kwargs'])
+
+# Data distribution steps of a join, from EXPLAIN;
+# DS_DIST_NONE and DS_DIST_ALL_NONE joins move no data
+REDISTRIBUTING_JOIN_RE = re.compile(
+    r'\bDS_(BCAST_INNER|DIST_INNER|DIST_OUTER|DIST_BOTH|DIST_ALL_INNER)\b')
+SCAN_RE = re.compile(r'\bScan on ("?[\w$]+"?)(?: ("?[\w$]+"?))?')
+JOIN_CONDITION_RE = re.compile(r'(?:Hash|Merge) Cond: (.*)')
+COLUMN_EQUALITY_RE = re.compile(
+    r'"?([\w$]+)"?\."?([\w$]+)"?\)?(?:::[a-z ]+?)?\)* = '
+    r'\(*"?([\w$]+)"?\."?([\w$]+)"?')
+FILTER_RE = re.compile(r'Filter: (.*)')
+FILTER_PREDICATE_RE = re.compile(
+    r'"?([A-Za-z_][\w$]*)"?\)?(?:::[a-z ]+?)?\s(>=|<=|<>|=|>|<)\s')
+RANGE_OPERATORS = ('>=', '<=', '>', '<')
+DISTKEY_RE = re.compile(r'^KEY\((.*)\)$')
+BYTES_PER_MB = 1024 * 1024
+
+
+def _unquote(name):
+    return name.strip('"').lower()
+
+
+def current_distkey(stats):
+    """Return the distribution key column of a `TableKeyStats`, if any.
+
+    >>> stats = TableKeyStats('public', 'sales', 1, 'KEY(listid)', None,
+    ...                       10, 100, 1.0)
+    >>> str(current_distkey(stats))
+    'listid'
+    """
+    match = DISTKEY_RE.match(stats.diststyle or '')
+    return match.group(1) if match else None
+
+
+class _QueryPlan(object):
+    """The plan tree of a single query, from its ``stl_explain`` rows."""
+
+    def __init__(self, rows, scanned_tables):
+        self.nodes = {}
+        self.children = defaultdict(list)
+        for _, nodeid, parentid, plannode, info in rows:
+            if nodeid in self.nodes:
+                # Long node details continue on following rows
+                _, node, extra = self.nodes[nodeid]
+                self.nodes[nodeid] = (parentid, node,
+                                      extra + ' ' + (info or ''))
+                continue
+            self.nodes[nodeid] = (parentid, plannode or '', info or '')
+            self.children[parentid].append(nodeid)
+        # Resolve table names and aliases to table ids
+        self.names = {}
+        self.scans = {}
+        for nodeid, (_, plannode, _) in self.nodes.items():
+            match = SCAN_RE.search(plannode)
+            if not match:
+                continue
+            table_id = scanned_tables.get(_unquote(match.group(1)))
+            if table_id is None:
+                continue
+            self.scans[nodeid] = table_id
+            self.names[_unquote(match.group(1))] = table_id
+            if match.group(2):
+                self.names[_unquote(match.group(2))] = table_id
+
+    def subtree_table(self, nodeid):
+        """Return the first table scanned beneath *nodeid*."""
+        pending = [nodeid]
+        while pending:
+            node = pending.pop(0)
+            if node in self.scans:
+                return self.scans[node]
+            pending.extend(sorted(self.children[node]))
+        return None
+
+    def joins(self):
+        """Yield ``(distribution, [(table_id, column), ...], inner)`` for
+        each join: the step moving data between slices (like
+        ``'BCAST_INNER'``, or None), the columns compared by the join
+        condition, and the table id of the inner side."""
+        for nodeid, (_, plannode, info) in sorted(self.nodes.items()):
+            match = JOIN_CONDITION_RE.search(info)
+            if 'Join' not in plannode or not match:
+                continue
+            children = sorted(self.children[nodeid])
+            sides = {}
+            if len(children) == 2:
+                sides = {'outer': self.subtree_table(children[0]),
+                         'inner': self.subtree_table(children[1])}
+            columns = []
+            for equality in COLUMN_EQUALITY_RE.findall(match.group(1)):
+                for qualifier, column in (equality[:2], equality[2:]):
+                    qualifier = _unquote(qualifier)
+                    table_id = sides.get(qualifier, self.names.get(qualifier))
+                    if table_id is not None:
+                        columns.append((table_id, _unquote(column)))
+            distribution = REDISTRIBUTING_JOIN_RE.search(plannode)
+            yield (distribution.group(1) if distribution else None,
+                   columns, sides.get('inner'))
+
+    def filters(self):
+        """Yield ``(table_id, column, operator)`` for each comparison
+        filtering a table scan."""
+        for nodeid, table_id in sorted(self.scans.items()):
+            match = FILTER_RE.search(self.nodes[nodeid][2])
+            if not match:
+                continue
+            for column, operator in FILTER_PREDICATE_RE.findall(
+                    match.group(1)):
+                yield table_id, _unquote(column), operator
+
+
+class AdvisorMixin(object):
+    """Distribution and sort key advisor base class for `Redshift`."""
+
+    def workload(self, schema=None, days=7, use_cache=True, max_age=None):
+        """Return a `Workload` of system table rows describing recent
+        queries, reading each system table with a single query.
+
+        Results are stored in `workload_cache` and reused by later calls
+        for the same schemas and period.
+
+        Parameters
+        ----------
+        schema : `str` or list of `str`
+            The schema (or schemas) whose columns to read;
+            defaults to ``'public'``
+        days : `int`
+            Number of days of query history to read; STL tables only
+            keep a few days of history
+        use_cache : `bool`
+            Reuse a cached `Workload` rather than querying again
+        max_age : `float`
+            Only reuse a cached `Workload` younger than this many seconds
+        """
+        if schema is None:
+            schema = ['public']
+        elif not isinstance(schema, (list, tuple, set)):
+            schema = [schema]
+        key = (tuple(sorted(schema)), days)
+        cached = self.workload_cache.get(key) if use_cache else None
+        if cached is not None:
+            age = (datetime.datetime.utcnow() -
+                   cached.fetched_at).total_seconds()
+            if max_age is None or age <= max_age:
+                return cached
+
+        params = {'days': int(days)}
+        tables = [TableKeyStats(*row) for row in
+                  self.engine.execute(queries.table_key_stats)]
+        columns = [tuple(row) for row in self.engine.execute(
+            queries.table_columns, {'schemas': key[0]})]
+        explain = [tuple(row) for row in
+                   self.engine.execute(queries.workload_explain, params)]
+        scans = [tuple(row) for row in
+                 self.engine.execute(queries.workload_scans, params)]
+        redistribution = dict(
+            (query, int(size or 0)) for query, size in
+            self.engine.execute(queries.workload_redistribution, params))
+        workload = Workload(tables, columns, explain, scans, redistribution,
+                            days, datetime.datetime.utcnow())
+        self.workload_cache[key] = workload
+        return workload
+
+    def key_recommendations(self, schema=None, days=7,
+                            sortkey_columns=SORTKEY_COLUMNS,
+                            min_benefit=0.0, use_cache=True, max_age=None,
+                            workload=None):
+        """Recommend distribution and sort keys from recent query history.
+
+        Query plans in ``stl_explain`` show which columns each table is
+        joined on, and whether the join had to broadcast or redistribute
+        rows between slices (the bytes moved are taken from
+        ``svl_query_summary``). Each table's distribution key is set to the
+        column whose joins moved the most data, or small tables that are
+        repeatedly broadcast get DISTSTYLE ALL.
+        Scan filters in ``stl_explain``, weighed by the rows ``stl_scan``
+        read and then discarded, give the columns whose range-restricted
+        scans would skip the most blocks; the most valuable lead a
+        compound sort key.
+
+        Benefits are estimated in MB per day: data moved between slices,
+        and data scanned only to be filtered out.
+        Candidate distribution keys should have many distinct, evenly
+        spread values; check them before migrating.
+
+        Parameters
+        ----------
+        schema : `str` or list of `str`
+            The schema (or schemas) whose tables to advise on;
+            defaults to ``'public'``
+        days : `int`
+            Number of days of query history to analyze
+        sortkey_columns : `int`
+            Maximum number of columns in a recommended sort key
+        min_benefit : `float`
+            Skip recommendations saving less than this many MB per day
+        use_cache : `bool`
+            Reuse system table rows cached by `workload`
+        max_age : `float`
+            Only reuse cached system table rows younger than this
+            many seconds
+        workload : `Workload`
+            Analyze these system table rows rather than reading them
+
+        Returns
+        -------
+        list of `KeyRecommendation`
+            Ordered by benefit, greatest first; pass each to
+            `key_migration_batches`, or its *kwargs* to `deep_copy`
+        """
+        if schema is None:
+            schema = ['public']
+        elif not isinstance(schema, (list, tuple, set)):
+            schema = [schema]
+        if workload is None:
+            workload = self.workload(schema, days, use_cache, max_age)
+        schemas = set(schema)
+        tables = dict((stats.table_id, stats) for stats in workload.tables
+                      if stats.schema in schemas)
+        columns = defaultdict(set)
+        for schema_name, relname, column in workload.columns:
+            columns[(schema_name, relname)].add(column)
+
+        scanned = defaultdict(dict)
+        skippable = defaultdict(int)
+        for query, table_id, name, pre_filter, rows in workload.scans:
+            scanned[query][_unquote(name)] = table_id
+            skippable[(query, table_id)] += max(
+                int(pre_filter or 0) - int(rows or 0), 0)
+
+        plans = defaultdict(list)
+        for row in workload.explain:
+            plans[row[0]].append(row)
+
+        moved = defaultdict(lambda: defaultdict(float))
+        broadcast = defaultdict(float)
+        filtered = defaultdict(lambda: defaultdict(float))
+        for query, rows in plans.items():
+            plan = _QueryPlan(rows, scanned[query])
+            # Attribute the data the query moved evenly to its
+            # redistributing joins
+            joins = [join for join in plan.joins() if join[0]]
+            for distribution, join_columns, inner in joins:
+                share = workload.redistribution.get(query, 0) / len(joins)
+                for table_id, column in join_columns:
+                    moved[table_id][column] += share
+                if distribution == 'BCAST_INNER' and inner is not None:
+                    broadcast[inner] += share
+            for table_id, column, operator in plan.filters():
+                # Range comparisons make the best use of zone maps
+                weight = 1.0 if operator in RANGE_OPERATORS else 0.5
+                filtered[table_id][column] += (
+                    weight * skippable[(query, table_id)])
+
+        recommendations = []
+        per_day = 1.0 / max(workload.days, 1)
+        for table_id, stats in tables.items():
+            known = columns[(stats.schema, stats.table)]
+            mb_per_row = (float(stats.size_mb or 0) / stats.tbl_rows
+                          if stats.tbl_rows else 0.0)
+            kwargs = {}
+            diststyle = distkey = sortkey = None
+            dist_benefit = sort_benefit = 0.0
+
+            candidates = [(size, column) for column, size
+                          in moved[table_id].items() if column in known]
+            if (broadcast[table_id] and
+                    (stats.size_mb or 0) <= DISTSTYLE_ALL_MAX_MB and
+                    not (stats.diststyle or '').startswith('ALL')):
+                diststyle = 'ALL'
+                dist_benefit = broadcast[table_id] / BYTES_PER_MB * per_day
+                kwargs.update(redshift_diststyle='ALL',
+                              redshift_distkey=None)
+            elif candidates:
+                size, column = max(candidates)
+                if column != current_distkey(stats):
+                    diststyle, distkey = 'KEY', column
+                    dist_benefit = size / BYTES_PER_MB * per_day
+                    kwargs.update(redshift_diststyle='KEY',
+                                  redshift_distkey=column)
+
+            ranked = sorted(((weight, column) for column, weight
+                             in filtered[table_id].items()
+                             if column in known and weight > 0),
+                            reverse=True)
+            if ranked and ranked[0][1] != stats.sortkey1:
+                sortkey = [column for _, column in ranked[:sortkey_columns]]
+                sort_benefit = ranked[0][0] * mb_per_row * per_day
+                kwargs.update(redshift_sortkey=sortkey,
+                              redshift_interleaved_sortkey=None)
+
+            benefit = dist_benefit + sort_benefit
+            if not kwargs or benefit < min_benefit:
+                continue
+            recommendations.append(KeyRecommendation(
+                stats.schema, stats.table, diststyle, distkey, sortkey,
+                dist_benefit, sort_benefit, benefit, kwargs))
+        recommendations.sort(key=lambda rec: (-rec.benefit, rec.schema,
+                                              rec.table))
+        return recommendations
+
+    def skewed_tables(self, schema=None, min_skew=2.0, limit=None,
+                      candidates=None):
+        """Rank the tables in *schema* whose rows pile up on few slices,
+        recommending a distribution for each.
+
+        Row skew comes from ``svv_table_info`` and per-slice block counts
+        from ``stv_blocklist``, each read for the whole schema with one
+        query. For each offender, a single scan then measures the
+        approximate cardinality and NULL fraction of candidate columns:
+        small tables are recommended DISTSTYLE ALL, others the candidate
+        with the most distinct values (if it has enough, and few NULLs),
+        or DISTSTYLE EVEN failing that.
+
+        Parameters
+        ----------
+        schema : `str` or list of `str`
+            The schema (or schemas) to inspect; defaults to ``'public'``
+        min_skew : `float`
+            Report tables whose row skew (fullest slice over emptiest) or
+            block skew (fullest slice over the average) reaches this ratio
+        limit : `int`
+            Only analyze this many of the worst offenders
+        candidates : dict
+            Maps table keys (``'schema.table'``) to the columns to consider
+            as distribution keys; by default every column is considered
+
+        Returns
+        -------
+        list of `SkewedTable`
+            Ordered by *excess_mb*, greatest first; pass them to
+            `key_migration_batches` to redistribute them
+        """
+        if schema is None:
+            schema = ['public']
+        elif not isinstance(schema, (list, tuple, set)):
+            schema = [schema]
+        tables = [TableKeyStats(*row) for row in
+                  self.engine.execute(queries.table_key_stats)
+                  if row[0] in schema]
+        if not tables:
+            return []
+        slices = self.engine.execute(queries.slice_count).fetchone()[0]
+        blocks = defaultdict(list)
+        for table_id, _, count in self.engine.execute(
+                queries.slice_blocks,
+                {'table_ids': tuple(t.table_id for t in tables)}):
+            blocks[table_id].append(count)
+        columns = defaultdict(list)
+        for schema_name, relname, column in self.engine.execute(
+                queries.table_columns, {'schemas': tuple(schema)}):
+            columns[schema_name + '.' + relname].append(column)
+
+        offenders = []
+        for stats in tables:
+            if (stats.diststyle or '').startswith('ALL'):
+                # Copies of the table on each node's first slice are
+                # not skew
+                continue
+            counts = blocks[stats.table_id]
+            mean = float(sum(counts)) / slices if counts else 0.0
+            block_skew = max(counts) / mean if mean else 1.0
+            if max(stats.skew_rows or 1, block_skew) < min_skew:
+                continue
+            offenders.append((max(counts) - mean if counts else 0.0,
+                              block_skew, stats))
+        offenders.sort(key=lambda offender: -offender[0])
+
+        skewed = []
+        for excess, block_skew, stats in offenders[:limit]:
+            key = stats.schema + '.' + stats.table
+            cardinality, choices = {}, []
+            if (stats.size_mb or 0) > DISTSTYLE_ALL_MAX_MB:
+                distkey = current_distkey(stats)
+                measured = [column for column in (candidates or {}).get(
+                    key, columns[key]) if column != distkey]
+                cardinality = self._column_cardinality(stats, measured)
+                enough = MIN_DISTKEY_VALUES_PER_SLICE * slices
+                choices = sorted(
+                    ((distinct, column) for column, (distinct, nulls)
+                     in cardinality.items()
+                     if distinct >= enough and
+                     nulls <= MAX_DISTKEY_NULL_FRACTION), reverse=True)
+            if (stats.size_mb or 0) <= DISTSTYLE_ALL_MAX_MB:
+                diststyle, distkey = 'ALL', None
+            elif choices:
+                diststyle, distkey = 'KEY', choices[0][1]
+            else:
+                diststyle, distkey = 'EVEN', None
+            skewed.append(SkewedTable(
+                stats.schema, stats.table, stats.size_mb, stats.skew_rows,
+                block_skew, excess, diststyle, distkey, cardinality,
+                {'redshift_diststyle': diststyle,
+                 'redshift_distkey': distkey}))
+        return skewed
+
+    def _column_cardinality(self, stats, columns):
+        """Return approximate distinct values and NULL fraction for
+        *columns* of a table, measured in a single scan."""
+        if not columns or not stats.tbl_rows:
+            return {}
+        quote = self.preparer.quote
+        measures = ['COUNT(*)']
+        for column in columns:
+            measures.append('APPROXIMATE COUNT(DISTINCT %s)' % quote(column))
+            measures.append('COUNT(%s)' % quote(column))
+        statement = 'SELECT %s FROM %s.%s' % (
+            ', '.join(measures), self.preparer.quote_schema(stats.schema),
+            quote(stats.table))
+        row = self.engine.execute(statement).fetchone()
+        total = row[0] or 1
+        return dict((column, (row[1 + 2 * i],
+                              1.0 - float(row[2 + 2 * i]) / total))
+                    for i, column in enumerate(columns))
+
+    def key_migration_batches(self, recommendations, **kwargs):
+        """Return `deep_copy` batches applying each `KeyRecommendation`
+        or `SkewedTable` redistribution.
+
+        Parameters
+        ----------
+        recommendations : list of `KeyRecommendation` or `SkewedTable`
+            Recommendations from `key_recommendations` or `skewed_tables`
+        kwargs :
+            Additional keyword arguments are passed to `deep_copy`
+        """
+        batches = []
+        for rec in recommendations:
+            options = dict(kwargs)
+            options.update(rec.kwargs)
+            batches.append(self.deep_copy(rec.table, schema=rec.schema,
+                                          **options))
+        return batches
@@ -0,0 +1,186 @@
+"""
+Mixin classes for analyzing column compression encodings
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+from collections import namedtuple
+import datetime
+from multiprocessing.pool import ThreadPool
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+from shiftmanager.wlm import wlm_statements
+
+# Recommended encodings for a table, as returned by ANALYZE COMPRESSION;
+# *encodings* and *reductions* map column names to the recommended encoding
+# and its estimated size reduction (in percent)
+EncodingAnalysis = namedtuple('EncodingAnalysis', [
+    'table', 'encodings', 'reductions', 'comprows', 'analyzed_at'])
+
+
+def analyze_compression_statement(table_name, comprows=None):
+    """
+    >>> print(analyze_compression_statement('my_schema.my_table', 20000))
+    ANALYZE COMPRESSION my_schema.my_table COMPROWS 20000
+    """
+    statement = "ANALYZE COMPRESSION %s" % table_name
+    if comprows is not None:
+        statement += " COMPROWS %d" % int(comprows)
+    return statement
+
+
+class CompressionMixin(object):
+    """Compression analysis base class for `Redshift`."""
+
+    def analyze_compression(self, tables, schema=None, comprows=None,
+                            workers=4, use_cache=True, max_age=None,
+                            wlm_query_group=None, wlm_slot_count=None):
+        """Run ANALYZE COMPRESSION on *tables*, several at a time.
+
+        Results are stored in `encoding_cache`, keyed by table key,
+        and reused by later calls as well as by `table_definition` and
+        `deep_copy` with ``analyze_compression=True``.
+        With more than one worker, each worker runs its analyses on its
+        own connection from `create_connection`.
+        A table that fails to be analyzed doesn't stop the others; once
+        they have finished, and their results are cached, each failure
+        is reported and the first is raised.
+
+        Parameters
+        ----------
+        tables : list of `str` or `sqlalchemy.schema.Table`
+            The tables to analyze
+        schema : `str`
+            The database schema in which to look for *tables*
+            (only used for str names)
+        comprows : `int`
+            Number of rows to sample per table (the ``COMPROWS`` option);
+            by default Redshift samples 100,000 rows per slice
+        workers : `int`
+            Maximum number of analyses to run concurrently
+        use_cache : `bool`
+            Reuse cached results rather than analyzing again
+        max_age : `float`
+            Only reuse cached results younger than this many seconds
+        wlm_query_group : `str`
+            WLM query group in which to run the analyses
+        wlm_slot_count : `int`
+            Number of WLM slots to claim for each analysis; defaults to the
+            ``'analyze_compression'`` entry of `wlm_policy`
+
+        Returns
+        -------
+        dict
+            Maps table keys to `EncodingAnalysis` results
+        """
+        names = {}
+        for table in tables:
+            if hasattr(table, 'key'):
+                names[table.key] = self.preparer.format_table(table)
+            else:
+                key = table if schema is None else schema + '.' + table
+                quoted = self.preparer.quote(table)
+                if schema is not None:
+                    quoted = self.preparer.quote_schema(schema) + '.' + quoted
+                names[key] = quoted
+
+        results = {}
+        now = datetime.datetime.utcnow()
+        for key in names:
+            cached = self.encoding_cache.get(key) if use_cache else None
+            if cached is None:
+                continue
+            age = (now - cached.analyzed_at).total_seconds()
+            if max_age is None or age <= max_age:
+                results[key] = cached
+        pending = sorted(set(names) - set(results))
+        if not pending:
+            return results
+
+        setup, teardown = wlm_statements(**self._wlm_settings(
+            'analyze_compression', wlm_query_group, wlm_slot_count))
+
+        def analyze(cursor, key):
+            statement = analyze_compression_statement(names[key], comprows)
+            with self._instrument('statement', 'analyze_compression',
+                                  statement):
+                for stmt in setup:
+                    cursor.execute(stmt)
+                try:
+                    cursor.execute(statement)
+                    rows = cursor.fetchall()
+                except Exception:
+                    if cursor.connection.autocommit:
+                        for stmt in teardown:
+                            cursor.execute(stmt)
+                    else:
+                        # The error aborted the transaction; the teardown
+                        # would fail in it and mask the error, while rolling
+                        # back undoes the setup just the same
+                        cursor.connection.rollback()
+                    raise
+                for stmt in teardown:
+                    cursor.execute(stmt)
+            return EncodingAnalysis(
+                key, dict((row[1], row[2]) for row in rows),
+                dict((row[1], row[3]) for row in rows),
+                comprows, datetime.datetime.utcnow())
+
+        errors = []
+
+        def store(key, analysis, error):
+            if error is not None:
+                errors.append((key, error))
+                return
+            self.encoding_cache[key] = analysis
+            results[key] = analysis
+
+        workers = min(workers, len(pending))
+        if workers <= 1:
+            with self.connection as conn:
+                with conn.cursor() as cur:
+                    for key in pending:
+                        try:
+                            store(key, analyze(cur, key), None)
+                        except Exception as e:
+                            store(key, None, e)
+        else:
+            connections = Queue()
+            opened = []
+            for _ in range(workers):
+                conn = self.create_connection()
+                conn.autocommit = True
+                opened.append(conn)
+                connections.put(conn)
+
+            def analyze_pooled(key):
+                conn = connections.get()
+                try:
+                    with conn.cursor() as cur:
+                        return key, analyze(cur, key), None
+                except Exception as e:
+                    return key, None, e
+                finally:
+                    connections.put(conn)
+
+            pool = ThreadPool(workers)
+            try:
+                for result in pool.imap_unordered(analyze_pooled, pending):
+                    store(*result)
+            finally:
+                pool.close()
+                pool.join()
+                for conn in opened:
+                    conn.close()
+
+        if errors:
+            errors.sort(key=lambda error: error[0])
+            for key, error in errors:
+                print("Failed to analyze %s: %s" % (key, str(error).strip()))
+            raise errors[0][1]
+        return results
@@ -0,0 +1,363 @@
+"""
+Mixin classes for planning and running table maintenance
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+from collections import namedtuple
+import datetime
+from multiprocessing.pool import ThreadPool
+import time
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+from shiftmanager import queries
+
+# Maintenance actions a plan can recommend
+VACUUM_SORT_ONLY = 'vacuum_sort_only'
+VACUUM_FULL = 'vacuum_full'
+DEEP_COPY = 'deep_copy'
+
+# Relative cost of each action per MB of table processed, with a deep copy
+# (one sequential rewrite of the visible rows plus an in-memory sort) as
+# the unit. VACUUM merges the unsorted region into the sorted one in
+# several passes and is markedly slower per MB touched, while reclaiming
+# deleted rows rewrites every block that contains one; since deletes are
+# usually scattered, a small deleted fraction already touches many blocks.
+DEEP_COPY_COST_PER_MB = 1.0
+VACUUM_SORT_COST_PER_MB = 2.5
+VACUUM_DELETE_COST_PER_MB = 1.5
+DELETED_BLOCKS_PER_DELETED_ROW = 10
+
+# Fraction of the cluster's disk that `deep_copy_tables` keeps free,
+# on top of a second copy of every table being copied
+MIN_FREE_DISK_FRACTION = 0.2
+
+# A row from queries.table_maintenance_stats
+TableStats = namedtuple('TableStats', [
+    'schema', 'table', 'table_id', 'size_mb', 'tbl_rows',
+    'estimated_visible_rows', 'unsorted', 'stats_off', 'skew_rows',
+    'sortkey1'])
+
+# A single recommendation in a maintenance plan
+MaintenanceTask = namedtuple('MaintenanceTask', [
+    'schema', 'table', 'action', 'cost', 'benefit', 'score', 'stats'])
+
+# The outcome of one deep copy run by `deep_copy_tables`; *elapsed* is in
+# seconds and *error* is the exception that failed the copy, if any
+DeepCopyResult = namedtuple('DeepCopyResult', [
+    'table', 'size_mb', 'slot_count', 'started_at', 'elapsed', 'error'])
+
+
+def deleted_fraction(stats):
+    """Return the fraction of *stats.tbl_rows* marked for deletion."""
+    if not stats.tbl_rows or stats.estimated_visible_rows is None:
+        return 0.0
+    visible = min(stats.estimated_visible_rows, stats.tbl_rows)
+    return 1.0 - visible / stats.tbl_rows
+
+
+def estimate_costs(stats):
+    """Return a dict of estimated cost and benefit for each action.
+
+    Costs are in units of MB deep-copied (see `DEEP_COPY_COST_PER_MB`);
+    benefits are the MB of wasted scanning each action removes.
+
+    >>> stats = TableStats('public', 'events', 1, 1000, 100, 50, 40.0,
+    ...                    0.0, 1.0, 'created')
+    >>> costs = estimate_costs(stats)
+    >>> costs['deep_copy']
+    (500.0, 900.0)
+    >>> costs['vacuum_sort_only']
+    (1000.0, 400.0)
+    """
+    size = float(stats.size_mb or 0)
+    unsorted = (stats.unsorted or 0) / 100.0 if stats.sortkey1 else 0.0
+    deleted = deleted_fraction(stats)
+    sort_cost = size * unsorted * VACUUM_SORT_COST_PER_MB
+    delete_cost = (size * min(1.0, deleted * DELETED_BLOCKS_PER_DELETED_ROW) *
+                   VACUUM_DELETE_COST_PER_MB)
+    costs = {
+        VACUUM_FULL: (sort_cost + delete_cost, size * (unsorted + deleted)),
+        DEEP_COPY: (size * (1 - deleted) * DEEP_COPY_COST_PER_MB,
+                    size * (unsorted + deleted)),
+    }
+    if unsorted:
+        costs[VACUUM_SORT_ONLY] = (sort_cost, size * unsorted)
+    return costs
+
+
+class MaintenanceMixin(object):
+    """Maintenance planning base class for `Redshift`."""
+
+    def table_stats(self, schema=None):
+        """Return `TableStats` rows from ``svv_table_info``.
+
+        Parameters
+        ----------
+        schema : `str` or list of `str`
+            The schema (or schemas) to inspect; defaults to ``'public'``
+        """
+        if schema is None:
+            schema = ['public']
+        elif not isinstance(schema, (list, tuple, set)):
+            schema = [schema]
+        result = self.engine.execute(queries.table_maintenance_stats,
+                                     {'schemas': tuple(schema)})
+        return [TableStats(*row) for row in result]
+
+    def maintenance_plan(self, schema=None, min_fraction=0.05,
+                         allow_deep_copy=True, stats=None):
+        """Return a ranked list of `MaintenanceTask` for tables in *schema*.
+
+        For each table whose unsorted or deleted fraction exceeds
+        *min_fraction*, the costs of VACUUM SORT ONLY, VACUUM FULL and
+        `deep_copy` are estimated from ``svv_table_info`` (see
+        `estimate_costs`) and the action with the best ratio of
+        benefit (MB of wasted scanning removed) to cost is chosen.
+        Tasks are ordered by that ratio, so the first tasks give the
+        most speedup per unit of maintenance time.
+
+        Parameters
+        ----------
+        schema : `str` or list of `str`
+            The schema (or schemas) to plan for; defaults to ``'public'``
+        min_fraction : `float`
+            Skip tables with less than this fraction of unsorted
+            and deleted rows
+        allow_deep_copy : `bool`
+            Consider deep copies, which need enough free disk for
+            a second copy of the table
+        stats : list of `TableStats`
+            Use these stats rather than querying ``svv_table_info``
+        """
+        if stats is None:
+            stats = self.table_stats(schema)
+        plan = []
+        for table_stats in stats:
+            unsorted = (table_stats.unsorted or 0) / 100.0
+            if not table_stats.sortkey1:
+                unsorted = 0.0
+            if unsorted + deleted_fraction(table_stats) < min_fraction:
+                continue
+            candidates = []
+            for action, (cost, benefit) in estimate_costs(table_stats).items():
+                if action == DEEP_COPY and not allow_deep_copy:
+                    continue
+                if benefit <= 0:
+                    continue
+                score = benefit / cost if cost else float('inf')
+                candidates.append((score, -cost, action, cost, benefit))
+            if not candidates:
+                continue
+            score, _, action, cost, benefit = max(candidates)
+            plan.append(MaintenanceTask(table_stats.schema, table_stats.table,
+                                        action, cost, benefit, score,
+                                        table_stats))
+        plan.sort(key=lambda task: (-task.score, -task.benefit))
+        return plan
+
+    def maintenance_batches(self, task, analyze=True, **kwargs):
+        """Return the SQL batches carrying out a `MaintenanceTask`.
+
+        Each batch must be executed on its own with
+        ``execute(batch, autocommit=True)``, since VACUUM cannot run
+        inside a transaction block.
+
+        Parameters
+        ----------
+        task : `MaintenanceTask`
+            A task from `maintenance_plan`
+        analyze : `bool`
+            Follow a VACUUM with ANALYZE
+        kwargs :
+            Additional keyword arguments are passed to `deep_copy`
+        """
+        if task.action == DEEP_COPY:
+            return [self.deep_copy(task.table, schema=task.schema,
+                                   analyze=analyze, **kwargs)]
+        table = self.preparer.quote_schema(task.schema) + '.' + \
+            self.preparer.quote(task.table)
+        command = 'SORT ONLY' if task.action == VACUUM_SORT_ONLY else 'FULL'
+        batches = [self.mogrify('VACUUM %s %s' % (command, table))]
+        if analyze:
+            batches.append(self.mogrify('ANALYZE %s' % table))
+        return batches
+
+    def run_maintenance(self, plan, limit=None, **kwargs):
+        """Execute the tasks of *plan* in order.
+
+        Parameters
+        ----------
+        plan : list of `MaintenanceTask`
+            A plan from `maintenance_plan`
+        limit : `int`
+            Stop after this many tasks
+        kwargs :
+            Additional keyword arguments are passed to
+            `maintenance_batches`
+        """
+        for task in plan[:limit]:
+            print("Running %s on %s.%s..." % (task.action, task.schema,
+                                              task.table))
+            for batch in self.maintenance_batches(task, **kwargs):
+                self.execute(batch, autocommit=True)
+
+    def disk_space(self):
+        """Return the ``(capacity, free)`` disk space of the cluster in MB,
+        from ``stv_partitions`` (which is only visible to superusers)."""
+        capacity, used = self.engine.execute(
+            queries.cluster_disk_space).fetchone()
+        capacity = capacity or 0
+        return capacity, capacity - (used or 0)
+
+    def deep_copy_tables(self, tables, schema=None, options=None, workers=4,
+                         slot_budget=None,
+                         min_free_fraction=MIN_FREE_DISK_FRACTION,
+                         retry=None, **kwargs):
+        """Deep copy *tables* several at a time, each on its own connection.
+
+        A `deep_copy` batch is generated for every table up front, then
+        the copies are started in order as capacity allows: at most
+        *workers* run at once, together they claim at most *slot_budget*
+        WLM slots (see `wlm_policy`), and before each start the free disk
+        reported by ``stv_partitions`` must hold a second copy of the
+        table and of every table already being copied, while still
+        leaving *min_free_fraction* of the cluster's disk free.
+        A table that doesn't fit even with nothing else running is
+        skipped with an error rather than started.
+
+        Each copy runs in its own transaction, so a failure only affects
+        its own table; it is reported in the results rather than raised.
+
+        Parameters
+        ----------
+        tables : list of `str` or `sqlalchemy.schema.Table`
+            The tables to copy
+        schema : `str`
+            The database schema in which to look for *tables*
+            (only used for str names); defaults to ``'public'``
+        options : dict
+            Maps ``'schema.table'`` keys to dicts of `deep_copy` keyword
+            arguments for that table, overriding *kwargs*
+        workers : `int`
+            Maximum number of copies to run concurrently
+        slot_budget : `int`
+            Maximum number of WLM slots claimed by running copies;
+            a single copy claiming more than this still runs on its own
+        min_free_fraction : `float`
+            Fraction of the cluster's disk to keep free
+        retry : `shiftmanager.retry.RetryPolicy`
+            Overrides `retry_policy` for each copy
+        kwargs :
+            Additional keyword arguments are passed to `deep_copy`
+            for every table
+
+        Returns
+        -------
+        list of `DeepCopyResult`
+            In the order of *tables*
+        """
+        options = options or {}
+        kwargs.pop('execute', None)
+        tasks = []
+        for table in tables:
+            if hasattr(table, 'key'):
+                table_schema, name = table.schema or 'public', table.name
+            else:
+                table_schema, name = schema or 'public', table
+            tasks.append((table_schema + '.' + name, table_schema, name,
+                          table))
+        sizes = dict(((stats.schema, stats.table), stats.size_mb or 0)
+                     for stats in self.table_stats(
+                         sorted(set(task[1] for task in tasks))))
+
+        results = {}
+        batches = {}
+        pending = []
+        for key, table_schema, name, table in tasks:
+            table_kwargs = dict(kwargs)
+            table_kwargs.update(options.get(key, {}))
+            settings = self._wlm_settings(
+                'deep_copy', table_kwargs.get('wlm_query_group'),
+                table_kwargs.get('wlm_slot_count'))
+            result = DeepCopyResult(key, sizes.get((table_schema, name), 0),
+                                    settings.get('slot_count') or 1,
+                                    None, None, None)
+            try:
+                batches[key] = self.deep_copy(table, schema=table_schema,
+                                              **table_kwargs)
+            except Exception as e:
+                results[key] = result._replace(error=e)
+                continue
+            pending.append(result)
+
+        finished = Queue()
+
+        def run(task):
+            def attempt():
+                conn = self.create_connection()
+                try:
+                    with self._instrument('statement', 'deep_copy',
+                                          batches[task.table]):
+                        with conn:
+                            with conn.cursor() as cur:
+                                cur.execute(batches[task.table])
+                finally:
+                    conn.close()
+
+            started_at = datetime.datetime.utcnow()
+            start = time.time()
+            error = None
+            try:
+                self._retry(retry).run(attempt)
+            except Exception as e:
+                error = e
+            finished.put(task._replace(started_at=started_at,
+                                       elapsed=time.time() - start,
+                                       error=error))
+
+        running = {}
+        pool = ThreadPool(max(1, min(workers, len(pending))))
+        try:
+            while pending or running:
+                while pending and len(running) < workers:
+                    task = pending[0]
+                    slots = sum(t.slot_count for t in running.values())
+                    if (running and slot_budget is not None and
+                            slots + task.slot_count > slot_budget):
+                        break
+                    capacity, free = self.disk_space()
+                    reserved = sum(t.size_mb for t in running.values())
+                    if (free - reserved - task.size_mb <
+                            capacity * min_free_fraction):
+                        if running:
+                            break
+                        pending.pop(0)
+                        results[task.table] = task._replace(error=ValueError(
+                            "Not enough free disk to copy %s (%d MB)"
+                            % (task.table, task.size_mb)))
+                        print("Skipped %s: not enough free disk" % task.table)
+                        continue
+                    pending.pop(0)
+                    print("Deep copying %s..." % task.table)
+                    running[task.table] = task
+                    pool.apply_async(run, (task,))
+                if running:
+                    result = finished.get()
+                    del running[result.table]
+                    results[result.table] = result
+                    if result.error is None:
+                        print("Copied %s in %.1f s" % (result.table,
+                                                       result.elapsed))
+                    else:
+                        print("Failed to copy %s: %s" % (result.table,
+                                                         result.error))
+        finally:
+            pool.close()
+            pool.join()
+        return [results[task[0]] for task in tasks]
@@ -0,0 +1,269 @@
+"""
+Mixin classes for migrating tables to a new definition
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+from collections import namedtuple
+
+import sqlalchemy
+from sqlalchemy.schema import AddConstraint
+
+from shiftmanager.mixins.reflection import (_group_catalog,
+                                            _table_from_catalog)
+
+# Kinds of change, from cheapest to most expensive
+METADATA_ONLY = 'metadata_only'
+IN_PLACE = 'in_place'
+DEEP_COPY = 'deep_copy'
+
+# Columns with these encodings can't have their type altered
+FIXED_TYPE_ENCODINGS = ('bytedict', 'runlength', 'text255', 'text32k')
+
+# A single difference between an existing table and its desired definition;
+# *statements* carry it out, unless *kind* is DEEP_COPY
+TableChange = namedtuple('TableChange', ['kind', 'description',
+                                         'statements'])
+
+
+def _names(columns):
+    """Return column names from a sort or distribution key option."""
+    if columns is None:
+        return ()
+    if isinstance(columns, (str, type(u''))) or hasattr(columns, 'name'):
+        columns = [columns]
+    return tuple(getattr(column, 'name', column) for column in columns)
+
+
+def _distribution(table):
+    """Return the ``(diststyle, distkey)`` of *table*; a distkey
+    implies DISTSTYLE KEY and no options mean DISTSTYLE AUTO."""
+    options = table.dialect_options['redshift']
+    distkey = _names(options['distkey'])
+    distkey = distkey[0] if distkey else None
+    diststyle = (options['diststyle'] or '').upper() or None
+    if distkey is not None:
+        diststyle = 'KEY'
+    return diststyle or 'AUTO', distkey
+
+
+def _default(column):
+    default = column.server_default
+    if default is None:
+        return None
+    return str(getattr(default.arg, 'text', default.arg))
+
+
+def _encoding(column):
+    return (column.info.get('encode') or 'raw').lower()
+
+
+def diff_tables(current, desired, dialect):
+    """Return a list of `TableChange` turning *current* into *desired*.
+
+    Each difference is classified as METADATA_ONLY (an ALTER TABLE that
+    rewrites no data: adding, dropping or widening columns and changing
+    the primary key), IN_PLACE (an ALTER TABLE that Redshift carries out
+    by rewriting the table in the background: distribution style and key,
+    compound sort key and column encodings), or DEEP_COPY (anything
+    ALTER TABLE can't do, like reordering columns, other type changes,
+    nullability or defaults, and interleaved sort keys).
+
+    Parameters
+    ----------
+    current : `sqlalchemy.schema.Table`
+        The table as it exists
+    desired : `sqlalchemy.schema.Table`
+        The table as it should be; its definition is taken as complete,
+        so no distribution options means DISTSTYLE AUTO and no sort key
+        means none
+    dialect : `sqlalchemy.engine.interfaces.Dialect`
+        The dialect used to render statements
+    """
+    preparer = dialect.identifier_preparer
+    ddl_compiler = dialect.ddl_compiler(dialect, None)
+    table_name = preparer.format_table(current)
+    alter = 'ALTER TABLE %s ' % table_name
+    changes = []
+
+    def change(kind, description, *statements):
+        changes.append(TableChange(kind, description, list(statements)))
+
+    current_columns = current.columns
+    desired_columns = desired.columns
+    kept = [c.name for c in desired_columns if c.name in current_columns]
+    dropped = [c for c in current_columns if c.name not in desired_columns]
+
+    if kept != [c.name for c in current_columns if c.name in kept]:
+        change(DEEP_COPY, "reorder columns")
+    # ADD COLUMN can only append columns
+    last_kept = max([i for i, c in enumerate(desired_columns)
+                     if c.name in current_columns] or [-1])
+    for position, column in enumerate(desired_columns):
+        if column.name in current_columns:
+            continue
+        if column.server_default is None and not column.nullable:
+            raise ValueError("New column %s is NOT NULL without a default"
+                             % column.name)
+        description = "add column %s" % column.name
+        if position < last_kept:
+            change(DEEP_COPY, description + " before existing columns")
+        else:
+            change(METADATA_ONLY, description, alter + 'ADD COLUMN ' +
+                   ddl_compiler.get_column_specification(column))
+
+    current_style, current_distkey = _distribution(current)
+    desired_style, desired_distkey = _distribution(desired)
+    current_options = current.dialect_options['redshift']
+    desired_options = desired.dialect_options['redshift']
+    current_interleaved = _names(current_options['interleaved_sortkey'])
+    desired_interleaved = _names(desired_options['interleaved_sortkey'])
+    current_sortkey = _names(current_options['sortkey'])
+    desired_sortkey = _names(desired_options['sortkey'])
+
+    for name in kept:
+        old, new = current_columns[name], desired_columns[name]
+        quoted = preparer.quote(name)
+        old_type = old.type.compile(dialect=dialect)
+        new_type = new.type.compile(dialect=dialect)
+        if old_type != new_type:
+            description = "change type of %s from %s to %s" % (
+                name, old_type, new_type)
+            widened = (isinstance(old.type, sqlalchemy.String) and
+                       isinstance(new.type, sqlalchemy.String) and
+                       old_type.startswith('VARCHAR') and
+                       new_type.startswith('VARCHAR') and
+                       (new.type.length or 0) > (old.type.length or 0))
+            if widened and _encoding(old) not in FIXED_TYPE_ENCODINGS:
+                change(METADATA_ONLY, description, alter +
+                       'ALTER COLUMN %s TYPE %s' % (quoted, new_type))
+            else:
+                change(DEEP_COPY, description)
+        if old.nullable != new.nullable:
+            change(DEEP_COPY, "change nullability of %s" % name)
+        if _default(old) != _default(new):
+            change(DEEP_COPY, "change default of %s" % name)
+        if ('encode' in new.info and
+                _encoding(old) != _encoding(new)):
+            description = "change encoding of %s to %s" % (
+                name, _encoding(new))
+            if current_interleaved or desired_interleaved:
+                change(DEEP_COPY, description + " with interleaved sort key")
+            else:
+                change(IN_PLACE, description, alter +
+                       'ALTER COLUMN %s ENCODE %s' % (quoted, _encoding(new)))
+
+    if (current_style, current_distkey) != (desired_style, desired_distkey):
+        statement = alter + 'ALTER DISTSTYLE %s' % desired_style
+        if desired_distkey is not None:
+            statement += ' DISTKEY %s' % preparer.quote(desired_distkey)
+        change(IN_PLACE, "change distribution to %s%s" % (
+            desired_style, '(%s)' % desired_distkey if desired_distkey
+            else ''), statement)
+
+    if current_interleaved != desired_interleaved:
+        change(DEEP_COPY, "change interleaved sort key")
+    elif current_sortkey != desired_sortkey:
+        if desired_sortkey:
+            statement = alter + 'ALTER SORTKEY (%s)' % ', '.join(
+                preparer.quote(name) for name in desired_sortkey)
+        else:
+            statement = alter + 'ALTER SORTKEY NONE'
+        change(IN_PLACE, "change sort key to (%s)" % ', '.join(
+            desired_sortkey), statement)
+
+    current_pk = tuple(c.name for c in current.primary_key.columns)
+    desired_pk = tuple(c.name for c in desired.primary_key.columns)
+    if current_pk != desired_pk:
+        statements = []
+        if current_pk:
+            if current.primary_key.name is None:
+                change(DEEP_COPY, "drop unnamed primary key")
+            else:
+                statements.append(alter + 'DROP CONSTRAINT %s' %
+                                  preparer.quote(current.primary_key.name))
+        if desired_pk:
+            statements.append(str(AddConstraint(desired.primary_key)
+                                  .compile(dialect=dialect)))
+        change(METADATA_ONLY, "change primary key to (%s)" % ', '.join(
+            desired_pk), *statements)
+
+    for column in dropped:
+        # Dropped after any change of the keys they may belong to
+        change(METADATA_ONLY, "drop column %s" % column.name,
+               alter + 'DROP COLUMN %s' % preparer.quote(column.name))
+
+    return changes
+
+
+class MigrationMixin(object):
+    """Table migration base class for `Redshift`."""
+
+    def table_changes(self, desired, current=None):
+        """Return a list of `TableChange` needed to turn the existing
+        table into *desired*; see `shiftmanager.mixins.migration.diff_tables`.
+
+        Parameters
+        ----------
+        desired : `sqlalchemy.schema.Table`
+            The desired definition, like a `reflected_table` with
+            overrides; its name and schema identify the existing table
+        current : `sqlalchemy.schema.Table`
+            The existing definition; by default it is reflected afresh,
+            outside of `meta`, so that overrides applied to *desired*
+            can't leak into it
+        """
+        if current is None:
+            current = self._current_table(desired)
+        return diff_tables(current, desired, self.engine.dialect)
+
+    def _current_table(self, desired):
+        """Reflect the existing table named like *desired* into a
+        throwaway `sqlalchemy.schema.MetaData`."""
+        schema = desired.schema or 'public'
+        entries = _group_catalog(*self._fetch_catalog([schema],
+                                                      [desired.name]))
+        if (schema, desired.name) not in entries:
+            raise ValueError("Table %s does not exist" % desired.key)
+        relation, columns, constraints, _ = entries[(schema, desired.name)]
+        return _table_from_catalog(sqlalchemy.MetaData(bind=self.engine),
+                                   relation, columns, constraints)
+
+    def migration_batches(self, desired, current=None, execute=False,
+                          **kwargs):
+        """Return the cheapest SQL batches migrating a table to *desired*.
+
+        If every change (see `table_changes`) can be made with ALTER TABLE,
+        each statement is returned as its own batch, since several of
+        them can't run inside a transaction block; otherwise a single
+        `deep_copy` batch copies the columns common to both definitions
+        into the new one. Batches should be executed in order with
+        ``execute(batch, autocommit=True)``.
+
+        Parameters
+        ----------
+        desired : `sqlalchemy.schema.Table`
+            The desired definition
+        current : `sqlalchemy.schema.Table`
+            The existing definition; reflected by default
+        execute : `bool`
+            Execute the batches in addition to returning them
+        kwargs :
+            Additional keyword arguments are passed to `deep_copy`
+        """
+        if current is None:
+            current = self._current_table(desired)
+        changes = self.table_changes(desired, current)
+        if any(change.kind == DEEP_COPY for change in changes):
+            columns = [c.name for c in desired.columns
+                       if c.name in current.columns]
+            batches = [self.deep_copy(desired, columns=columns, **kwargs)]
+        else:
+            batches = [self.mogrify(statement)
+                       for change in changes
+                       for statement in change.statements]
+        if execute:
+            for batch in batches:
+                self.execute(batch, autocommit=True)
+        return batches
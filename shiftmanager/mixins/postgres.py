@@ -12,9 +12,17 @@ import json
 import os
 
 import psycopg2
+import sqlalchemy
 
+from shiftmanager import queries
+from shiftmanager.copy_options import CSV_COPY_OPTIONS
+from shiftmanager.inference import (DEFAULT_HEADROOM, SchemaInferrer,
+                                    build_table, is_measured,
+                                    redshift_type_for_postgres)
 from shiftmanager.memoized_property import memoized_property
+from shiftmanager.mixins.reflection import _get_schema_and_relation
 from shiftmanager.mixins.s3 import S3Mixin
+from shiftmanager.wlm import wrap_batch
 
 
 class PostgresMixin(S3Mixin):
@@ -109,6 +117,104 @@ libpq-connect.html#LIBPQ-PARAMKEYWORDS
 
         return row_count
 
+    def pg_column_names(self, pg_table_name=None, pg_select_statement=None):
+        """
+        Return the names of the columns of a Postgres table or the result
+        of a select statement, in order.
+
+        Parameters
+        ----------
+        pg_table_name: str
+            Postgres table name
+        pg_select_statement: str
+            Select statement, if not a table
+
+        Returns
+        -------
+        list of str
+        """
+        source = pg_table_name
+        if pg_select_statement is not None:
+            source = pg_select_statement
+            if not (source.startswith("(") and source.endswith(")")):
+                source = "(" + source + ")"
+        with self.pg_connection as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT * FROM %s AS source LIMIT 0" % source)
+                return [column[0] for column in cur.description]
+
+    def pg_infer_table(self, pg_table_name, table_name=None, schema=None,
+                       headroom=DEFAULT_HEADROOM, **table_options):
+        """
+        Return a `sqlalchemy.schema.Table` for loading a Postgres table
+        into Redshift, with tight types based on the Postgres column types.
+
+        Columns without a Redshift equivalent, like text, become VARCHARs
+        sized by the widest value in the table (measured in bytes, as
+        Redshift does), and unconstrained numerics get the precision and
+        scale of their values. Both are measured in a single scan.
+
+        Parameters
+        ----------
+        pg_table_name: str
+            Postgres table name, optionally schema-qualified
+        table_name: str
+            Name of the Redshift table; defaults to that of the Postgres table
+        schema: str
+            Schema of the Redshift table
+        headroom: float
+            Fraction of the widest value to add to VARCHAR lengths
+        table_options:
+            Distribution and sort options (*distkey*, *sortkey*,
+            *diststyle*, *interleaved*) as accepted by
+            `shiftmanager.inference.SchemaInferrer.table`
+
+        Returns
+        -------
+        `sqlalchemy.schema.Table`
+        """
+        pg_schema, pg_relname = _get_schema_and_relation(pg_table_name)
+        with self.pg_connection as conn:
+            with conn.cursor() as cur:
+                cur.execute(queries.pg_table_columns,
+                            {'schema': (pg_schema or 'public').strip('"'),
+                             'table': pg_relname.strip('"')})
+                pg_columns = cur.fetchall()
+
+        measures = []
+        for name, data_type, precision, _ in pg_columns:
+            quoted = '"%s"' % name.replace('"', '""')
+            if data_type == 'numeric' and precision is None:
+                measures.append("MAX(SCALE(%s))" % quoted)
+                measures.append("MAX(LENGTH(TRUNC(ABS(%s))::text))" % quoted)
+            elif data_type == 'character':
+                # Casting to text strips the padding the CSV export keeps
+                measures.append("MAX(OCTET_LENGTH(%s))" % quoted)
+            elif is_measured(data_type):
+                measures.append("MAX(OCTET_LENGTH(%s::text))" % quoted)
+        measured = []
+        if measures:
+            with self.pg_connection as conn:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT %s FROM %s" % (', '.join(measures),
+                                                       pg_table_name))
+                    measured = list(cur.fetchone())
+
+        columns = []
+        for name, data_type, precision, scale in pg_columns:
+            width = None
+            if data_type == 'numeric' and precision is None:
+                scale, digits = measured.pop(0), measured.pop(0)
+                if scale is not None:
+                    precision = int(digits) + int(scale)
+            elif is_measured(data_type):
+                width = measured.pop(0)
+            column_type = redshift_type_for_postgres(
+                data_type, precision, scale, width, headroom)
+            columns.append(sqlalchemy.Column(name, column_type))
+        return build_table(table_name or pg_relname.strip('"'), columns,
+                           schema=schema, **table_options)
+
     def get_csv_chunk_generator(self, csv_file_path,
                                 chunk_max_bytes=134217728):
         """
@@ -155,7 +261,8 @@ libpq-connect.html#LIBPQ-PARAMKEYWORDS
             return template.format(key_id=key_id,
                                    secret_key_id=secret_key_id)
 
-    def _create_copy_statement(self, table_name, manifest_key_path):
+    def _create_copy_statement(self, table_name, manifest_key_path,
+                               copy_options=None):
         """Create Redshift copy statement for given table_name and
         the provided manifest_key_path.
 
@@ -165,25 +272,29 @@ libpq-connect.html#LIBPQ-PARAMKEYWORDS
             Redshift table name to COPY to
         manifest_key_path: str
             Complete S3 path to .manifest file
+        copy_options: `shiftmanager.copy_options.CopyOptions`
+            Options for CSV data; defaults to `CSV_COPY_OPTIONS`
 
         Returns
         -------
         str
         """
-        return """copy {table_name}
-                  from '{manifest_key_path}'
-                  credentials '{aws_credentials}'
-                  manifest
-                  csv
-                  gzip;""".format(table_name=table_name, 
-                                  manifest_key_path=manifest_key_path,
-                                  aws_credentials=self.aws_credentials)
+        copy_options = copy_options or CSV_COPY_OPTIONS
+        if copy_options.data_format != 'csv':
+            raise ValueError("Postgres tables are staged as CSV; "
+                             "copy_options must be for CSV data")
+        return copy_options.statement(table_name, manifest_key_path,
+                                      self.aws_credentials)
 
     def copy_table_to_redshift(self, redshift_table_name,
                                bucket_name, key_prefix, slices,
                                pg_table_name=None, pg_select_statement=None,
                                temp_file_dir=None, cleanup_s3=True,
-                               manifest_max_keys=64):
+                               manifest_max_keys=64, retry=None,
+                               wlm_query_group=None, wlm_slot_count=None,
+                               advisor=None, create_table=False,
+                               table_options=None, merge=False,
+                               primary_key=None, copy_options=None):
         """
         Write the contents of a Postgres table to Redshift.
         Write the table to the given bucket under the given
@@ -209,9 +320,48 @@ libpq-connect.html#LIBPQ-PARAMKEYWORDS
             Optional Specify location of temporary files
         cleanup_s3: bool
             Optional Clean up S3 location on failure. Defaults to True.
+        retry : `shiftmanager.retry.RetryPolicy`
+            Optional override of `retry_policy` for the uploads and COPYs
+        wlm_query_group : str
+            Optional WLM query group in which to run the COPYs
+        wlm_slot_count : int
+            Optional number of WLM slots to claim for the COPYs; defaults
+            to the ``'copy'`` entry of `wlm_policy`
+        advisor : `shiftmanager.encoding.EncodingAdvisor`
+            Optional advisor profiling the CSV rows as they are staged,
+            for compression encoding recommendations
+        create_table: bool
+            Optional Create the Redshift table if it does not exist, with
+            types reflected from *pg_table_name* (see `pg_infer_table`) or
+            inferred from the rows of *pg_select_statement* as they are
+            staged (see `shiftmanager.inference.SchemaInferrer`)
+        table_options: dict
+            Optional keyword arguments for creating the table, like
+            *distkey*, *sortkey* and *headroom*
+        merge: bool
+            Optional Replace rows sharing a key with the copied rows rather
+            than appending, all in one transaction (see `_merge_batch`)
+        primary_key: str or list of str
+            Optional columns identifying a row when merging; by default,
+            the primary key of the Redshift table is reflected
+        copy_options: `shiftmanager.copy_options.CopyOptions`
+            Optional options for the COPYs, which must be for CSV data;
+            defaults to `CSV_COPY_OPTIONS`. When merging, the staging
+            table is loaded with COMPUPDATE and STATUPDATE off
         """
-        if not self.table_exists(redshift_table_name):
-            raise ValueError("This table_name does not exist in Redshift!")
+        copy_options = copy_options or CSV_COPY_OPTIONS
+        schema, relname = _get_schema_and_relation(redshift_table_name)
+        table = inferrer = None
+        if not self.table_exists(relname):
+            if not create_table:
+                raise ValueError("This table_name does not exist in Redshift!")
+            table_options = table_options or {}
+            if pg_table_name is not None:
+                table = self.pg_infer_table(pg_table_name, relname,
+                                            schema=schema, **table_options)
+            else:
+                inferrer = SchemaInferrer(self.pg_column_names(
+                    pg_select_statement=pg_select_statement))
 
         bucket = self.get_bucket(bucket_name)
         # All keys written to S3 in the event cleanup is needed
@@ -229,29 +379,41 @@ libpq-connect.html#LIBPQ-PARAMKEYWORDS
             use_existing = answer == 'n' or answer == 'no'
 
         if not use_existing:
-            self.pg_copy_table_to_csv(
-                csv_temp_path, pg_table_name=pg_table_name,
-                pg_select_statement=pg_select_statement)
+            with self._instrument('phase', 'dump') as event:
+                event.rowcount = self.pg_copy_table_to_csv(
+                    csv_temp_path, pg_table_name=pg_table_name,
+                    pg_select_statement=pg_select_statement)
+                event.bytes_compressed = os.path.getsize(csv_temp_path)
         chunk_generator = self.get_csv_chunk_generator(csv_temp_path)
         backfill_timestamp = datetime.utcnow().strftime(
             "%Y-%m-%d_%H-%M-%S")
 
         manifest_entries = []
         for count, chunk in enumerate(chunk_generator):
+            if advisor is not None:
+                advisor.observe_csv(chunk)
+            if inferrer is not None:
+                inferrer.observe_csv(chunk)
             chunk_name = "_".join([backfill_timestamp, "chunk",
                                    str(count)])
             # write the chunk gzip compressed to the local filesystem
             compressed_chunk_path = os.path.join(temp_file_dir,
                                                  chunk_name + '.gz')
-            with gzip.open(compressed_chunk_path, 'wt', encoding='utf-8') as ccf:
-                ccf.write(chunk)
+            with self._instrument('phase', 'compress') as event:
+                with gzip.open(compressed_chunk_path, 'wt',
+                               encoding='utf-8') as ccf:
+                    ccf.write(chunk)
+                event.bytes_serialized = len(chunk.encode('utf-8'))
+                event.bytes_compressed = os.path.getsize(compressed_chunk_path)
             complete_key_path = "".join([final_key_prefix,
                                          chunk_name, '.csv.gz'])
             # upload compressed chunk file to S3
             print('Writing {} to S3 {} ...'.format(compressed_chunk_path,
                                                    complete_key_path))
-            self.write_file_to_s3(compressed_chunk_path, bucket,
-                                  complete_key_path)
+            with self._instrument('phase', 'upload') as event:
+                self.write_file_to_s3(compressed_chunk_path, bucket,
+                                      complete_key_path, retry=retry)
+                event.bytes_uploaded = os.path.getsize(compressed_chunk_path)
             # remove chunk file after uploaded to s3
             os.remove(compressed_chunk_path)
 
@@ -265,6 +427,13 @@ libpq-connect.html#LIBPQ-PARAMKEYWORDS
                 'mandatory': True
             })
 
+        if inferrer is not None:
+            table = inferrer.table(relname, schema=schema, **table_options)
+        if table is not None:
+            print("Creating table %s..." % redshift_table_name)
+            self.execute(self.table_definition(table, copy_privileges=False))
+
+        manifest_paths = []
         start_idx = 0
         num_entries = len(manifest_entries)
         while (start_idx < num_entries):
@@ -281,17 +450,36 @@ libpq-connect.html#LIBPQ-PARAMKEYWORDS
             all_s3_keys.append(manifest_key_path)
 
             print('Writing .manifest file to S3...')
-            manifest_key.set_contents_from_string(json.dumps(manifest),
-                                                  encrypt_key=True)
-            complete_manifest_path = "".join(['s3://', bucket.name,
-                                              manifest_key_path])
-            copy_statement = self._create_copy_statement(
-                redshift_table_name, complete_manifest_path)
+            self._retry(retry).run(
+                lambda: manifest_key.set_contents_from_string(
+                    json.dumps(manifest), encrypt_key=True))
+            manifest_paths.append("".join(['s3://', bucket.name,
+                                           manifest_key_path]))
+            start_idx = end_idx
+
+        if merge and table is None:
+            # Every manifest is staged so the merge is a single transaction
+            copy_statements = [self._merge_batch(
+                redshift_table_name,
+                lambda target: ';\n'.join(
+                    self._create_copy_statement(
+                        target, path, copy_options.staging()).strip()
+                    for path in manifest_paths),
+                primary_key)]
+        else:
+            copy_statements = [
+                self._create_copy_statement(redshift_table_name, path,
+                                            copy_options)
+                for path in manifest_paths]
+
+        for copy_statement in copy_statements:
+            copy_statement = wrap_batch(copy_statement, **self._wlm_settings(
+                'copy', wlm_query_group, wlm_slot_count))
 
             print('Copying from S3 to Redshift...')
             try:
-                self.execute(copy_statement)
-                start_idx = end_idx
+                with self._instrument('phase', 'copy'):
+                    self.execute(copy_statement, retry=retry)
             except:
                 # Clean up S3 bucket in the event of any exception
                 if cleanup_s3:
@@ -1,12 +1,27 @@
+from collections import namedtuple
+import codecs
+import datetime
+import decimal
+from multiprocessing.pool import ThreadPool
+import numbers
+import os
 import re
 
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
 import sqlalchemy
 from sqlalchemy.schema import CreateTable
 from sqlalchemy_views import CreateView
 
 from shiftmanager import queries
+from shiftmanager.cache import relation_fingerprint
 from shiftmanager.memoized_property import memoized_property
-from shiftmanager.privileges import grants_from_privileges
+from shiftmanager.privileges import grants_from_acl
+from shiftmanager.util import linspace, topological_sort
+from shiftmanager.wlm import wrap_batch
 
 # Redshift distribution styles
 DISTSTYLES_BY_INDEX = {
@@ -24,6 +39,41 @@ SQL_IDENTIFIER_RE = re.compile(r"""
 """, re.VERBOSE)
 
 
+# Rows returned by the bulk reflection queries
+RelationRow = namedtuple('RelationRow', [
+    'schema', 'rel_oid', 'relname', 'relkind', 'diststyle'])
+ColumnRow = namedtuple('ColumnRow', [
+    'schema', 'relname', 'attnum', 'attname', 'type', 'encoding',
+    'distkey', 'sortkey', 'notnull', 'default'])
+ConstraintRow = namedtuple('ConstraintRow', [
+    'schema', 'relname', 'conname', 'contype', 'condef'])
+ViewDefinitionRow = namedtuple('ViewDefinitionRow', [
+    'schema', 'relname', 'definition'])
+ViewDependencyRow = namedtuple('ViewDependencyRow', [
+    'schema', 'relname', 'dependency_schema', 'dependency_relname'])
+ViewRow = namedtuple('ViewRow', [
+    'schema', 'relname', 'definition', 'dependency_schema',
+    'dependency_relname'])
+
+# Rows returned by `queries.scoped_privileges`
+PrivilegeRow = namedtuple('PrivilegeRow', [
+    'relkind', 'schema_oid', 'schema', 'rel_oid', 'relname', 'owner_id',
+    'owner_name', 'privileges', 'type', 'visible'])
+
+# Output of pg_catalog.format_type, like 'numeric(18,4)' or
+# 'timestamp without time zone'
+FORMAT_TYPE_RE = re.compile(r"""
+    ^(?P<name>[^(]+?)                    # base type name
+    (?:\((?P<args>[^)]*)\))?             # optional (length) or (prec,scale)
+    (?P<suffix>\ with(?:out)?\ time\ zone)?$
+""", re.VERBOSE)
+
+# Constraint definitions, as returned by pg_get_constraintdef
+CONSTRAINT_COLUMNS_RE = re.compile(r'^(?:PRIMARY KEY|UNIQUE) \((.*)\)$')
+FOREIGN_KEY_RE = re.compile(
+    r'^FOREIGN KEY \((.*)\) REFERENCES (.*)\((.*)\)$')
+
+
 def _get_relation_key(name, schema):
     if schema is None:
         return name
@@ -42,6 +92,258 @@ def _get_schema_and_relation(key):
     raise ValueError("%s does not look like a valid relation identifier")
 
 
+def _split_identifiers(text):
+    """
+    >>> [str(i) for i in _split_identifiers('a, "B c"')]
+    ['a', 'B c']
+    """
+    return [identifier.strip('"')
+            for identifier in SQL_IDENTIFIER_RE.findall(text)]
+
+
+def _column_type(format_type, ischema_names):
+    """Return a SQLAlchemy type instance for a *format_type* string.
+
+    >>> from sqlalchemy.dialects.postgresql.base import ischema_names
+    >>> _column_type('character varying(256)', ischema_names)
+    VARCHAR(length=256)
+    >>> _column_type('numeric(18,4)', ischema_names)
+    NUMERIC(precision=18, scale=4)
+    >>> _column_type('timestamp without time zone', ischema_names)
+    TIMESTAMP()
+    """
+    match = FORMAT_TYPE_RE.match(format_type)
+    if not match:
+        return sqlalchemy.types.NULLTYPE
+    name = match.group('name')
+    suffix = match.group('suffix') or ''
+    type_class = (ischema_names.get(name + suffix) or
+                  ischema_names.get(name))
+    if type_class is None:
+        return sqlalchemy.types.NULLTYPE
+    kwargs = {}
+    if suffix == ' with time zone':
+        kwargs['timezone'] = True
+    args = []
+    if match.group('args'):
+        args = [int(arg) for arg in match.group('args').split(',')]
+    try:
+        return type_class(*args, **kwargs)
+    except TypeError:
+        return type_class()
+
+
+def _catalog_params(schemas, relnames):
+    """Return parameters and a filter clause for the bulk catalog queries.
+    """
+    params = {'schemas': tuple(schemas)}
+    relname_filter = ''
+    if relnames:
+        params['relnames'] = tuple(relnames)
+        relname_filter = 'AND c.relname IN %(relnames)s'
+    return params, relname_filter
+
+
+def _privilege_params(schemas=None, relations=None, oids=None):
+    """Return parameters and a filter clause for `queries.scoped_privileges`.
+
+    *relations* is a sequence of ``(schema, relname)`` pairs, where a schema
+    of None matches any relation visible on the search path.
+
+    >>> params, clause = _privilege_params(schemas=['s'], oids=[1])
+    >>> print(clause)
+    n.nspname IN %(schemas)s OR c.oid IN %(oids)s
+    """
+    params, clauses = {}, []
+    if schemas:
+        params['schemas'] = tuple(schemas)
+        clauses.append('n.nspname IN %(schemas)s')
+    if oids:
+        params['oids'] = tuple(oids)
+        clauses.append('c.oid IN %(oids)s')
+    for i, (schema, relname) in enumerate(relations or ()):
+        params['relname_%d' % i] = relname
+        if schema is None:
+            clauses.append('(pg_catalog.pg_table_is_visible(c.oid) AND '
+                           'c.relname = %%(relname_%d)s)' % i)
+        else:
+            params['schema_%d' % i] = schema
+            clauses.append('(n.nspname = %%(schema_%d)s AND '
+                           'c.relname = %%(relname_%d)s)' % (i, i))
+    return params, ' OR '.join(clauses) or 'TRUE'
+
+
+def _resolve_names(schema, names):
+    """Return ``(schemas, relnames, wanted)`` for the bulk catalog queries.
+
+    *schema* defaults to ``'public'``; *names* may be qualified like
+    ``'schema.table'``, otherwise each schema in *schema* is assumed.
+    *wanted* is a set of ``(schema, relname)`` pairs, or None if
+    *names* is None.
+
+    >>> _resolve_names(None, None)
+    (['public'], None, None)
+    """
+    if schema is None:
+        schemas = ['public']
+    elif isinstance(schema, (list, tuple, set)):
+        schemas = list(schema)
+    else:
+        schemas = [schema]
+    wanted = None
+    relnames = None
+    if names is not None:
+        wanted = set()
+        for name in names:
+            name_schema, relname = _get_schema_and_relation(name)
+            for s in ([name_schema] if name_schema else schemas):
+                wanted.add((s.strip('"'), relname.strip('"')))
+        schemas = sorted(set(s for s, _ in wanted))
+        relnames = sorted(set(r for _, r in wanted))
+    return schemas, relnames, wanted
+
+
+def _sort_columns(table):
+    """Return the names of *table*'s sort key (or, failing that,
+    distkey) columns, as set through ``redshift_*`` table options.
+    """
+    options = table.dialect_options['redshift']
+    for option in ('sortkey', 'interleaved_sortkey', 'distkey'):
+        value = options.get(option)
+        if not value:
+            continue
+        if not isinstance(value, (list, tuple)):
+            value = [value]
+        return tuple(getattr(col, 'name', col) for col in value)
+    return ()
+
+
+def _interpolate(low, high, chunks):
+    """Return up to *chunks* - 1 boundaries evenly splitting
+    [*low*, *high*], or None if the values can't be interpolated.
+
+    >>> _interpolate(0, 100, 4)
+    [25, 50, 75]
+    >>> _interpolate(datetime.date(2016, 1, 1), datetime.date(2016, 1, 3), 2)
+    [datetime.date(2016, 1, 2)]
+    """
+    if low is None or high is None or low >= high:
+        return []
+    if isinstance(low, bool):
+        return None
+    if isinstance(low, numbers.Integral):
+        points = linspace(low, high, chunks)[1:]
+    elif isinstance(low, (float, decimal.Decimal)):
+        step = (high - low) / chunks
+        points = [low + step * i for i in range(1, chunks)]
+    elif isinstance(low, (datetime.date, datetime.datetime)):
+        step = (high - low) // chunks
+        points = [low + step * i for i in range(1, chunks)]
+    else:
+        return None
+    return sorted(set(p for p in points if low < p <= high))
+
+
+def _group_catalog(relations, columns, constraints, view_definitions):
+    """Group bulk catalog rows by (schema, relname).
+
+    Returns a dict of ``(relation, columns, constraints, definition)``
+    tuples, where *definition* is None for tables.
+    """
+    grouped = dict(((rel.schema, rel.relname), (rel, [], [], None))
+                   for rel in relations)
+    for col in columns:
+        entry = grouped.get((col.schema, col.relname))
+        if entry is not None:
+            entry[1].append(col)
+    for con in constraints:
+        entry = grouped.get((con.schema, con.relname))
+        if entry is not None:
+            entry[2].append(con)
+    for view in view_definitions:
+        key = (view.schema, view.relname)
+        if key in grouped:
+            grouped[key] = grouped[key][:3] + (view.definition,)
+    return grouped
+
+
+def _table_from_catalog(meta, relation, columns, constraints):
+    """Add a `sqlalchemy.schema.Table` to *meta* built from catalog rows.
+
+    *relation* is a row from `queries.bulk_relations`, while *columns*
+    and *constraints* are lists of rows from `queries.bulk_columns` and
+    `queries.bulk_constraints` belonging to that relation.
+    """
+    ischema_names = meta.bind.dialect.ischema_names
+    key = _get_relation_key(relation.relname, relation.schema)
+    if key in meta.tables:
+        meta.remove(meta.tables[key])
+
+    table_args = []
+    distkey = None
+    sortkeys = []
+    for col in columns:
+        kw = {'nullable': not col.notnull, 'info': {}}
+        if col.default is not None:
+            kw['server_default'] = sqlalchemy.schema.DefaultClause(
+                sqlalchemy.text(col.default))
+        if col.encoding and col.encoding != 'none':
+            kw['info']['encode'] = col.encoding
+        table_args.append(sqlalchemy.Column(
+            col.attname, _column_type(col.type, ischema_names), **kw))
+        if col.distkey:
+            distkey = col.attname
+        if col.sortkey:
+            sortkeys.append((abs(col.sortkey), col.sortkey < 0, col.attname))
+
+    for con in constraints:
+        condef = con.condef
+        if con.contype in ('p', 'u'):
+            match = CONSTRAINT_COLUMNS_RE.match(condef)
+            if not match:
+                continue
+            names = _split_identifiers(match.group(1))
+            constraint_class = (sqlalchemy.PrimaryKeyConstraint
+                                if con.contype == 'p'
+                                else sqlalchemy.UniqueConstraint)
+            table_args.append(constraint_class(*names, name=con.conname))
+        else:
+            match = FOREIGN_KEY_RE.match(condef)
+            if not match:
+                continue
+            local = _split_identifiers(match.group(1))
+            ref_schema, ref_name = _get_schema_and_relation(
+                match.group(2).strip())
+            if ref_schema is None:
+                ref_schema = relation.schema
+            ref_table = _get_relation_key(ref_name.strip('"'),
+                                          ref_schema.strip('"'))
+            remote = ['%s.%s' % (ref_table, col)
+                      for col in _split_identifiers(match.group(3))]
+            table_args.append(sqlalchemy.ForeignKeyConstraint(
+                local, remote, name=con.conname))
+
+    table_kwargs = {}
+    if relation.relkind == 'r':
+        diststyle = DISTSTYLES_BY_INDEX.get(relation.diststyle)
+        if diststyle:
+            table_kwargs['redshift_diststyle'] = diststyle
+        if distkey:
+            table_kwargs['redshift_distkey'] = distkey
+        if sortkeys:
+            sortkeys.sort()
+            names = tuple(name for _, _, name in sortkeys)
+            if sortkeys[0][1]:
+                table_kwargs['redshift_interleaved_sortkey'] = names
+            else:
+                table_kwargs['redshift_sortkey'] = names
+
+    table = sqlalchemy.Table(relation.relname, meta, *table_args,
+                             schema=relation.schema, **table_kwargs)
+    table.info['bulk_reflected'] = True
+    return table
+
+
 class ReflectionMixin(object):
     """The database reflection base class for `Redshift`."""
 
@@ -88,6 +390,8 @@ class ReflectionMixin(object):
         existing table.
 
         *extend_existing* is set to True by default.
+        With ``analyze_compression=True``, column encodings are taken from
+        results cached by `analyze_compression`, or set to RAW otherwise.
 
         Notes
         -----
@@ -97,16 +401,134 @@ class ReflectionMixin(object):
         <http://redshift-sqlalchemy.readthedocs.org/en/latest/ddl-compiler.html>`_
         """
         kw = kwargs.copy()
-        analyze_compression = kwargs.pop('analyze_compression', None)
-        kw['autoload'] = True
+        analyze_compression = kw.pop('analyze_compression', None)
+        existing = self._bulk_reflected(name, kwargs.get('schema'))
+        if existing is None:
+            kw['autoload'] = True
+        else:
+            kw['schema'] = existing.schema
         kw['extend_existing'] = kw.get('extend_existing', True)
         table = sqlalchemy.Table(name, self.meta, *args, **kw)
         if analyze_compression:
+            analysis = self.encoding_cache.get(table.key)
             for col in table.columns:
-                # Initialize this field
-                col.info['encode'] = 'raw'
+                # Initialize this field, from earlier analysis if available
+                col.info['encode'] = (analysis.encodings.get(col.key, 'raw')
+                                      if analysis else 'raw')
         return table
 
+    def reflected_tables(self, schema=None, names=None, use_cache=True):
+        """Reflect many tables and views at once from a few catalog queries.
+
+        Where `reflected_table` makes several catalog round trips
+        per table, this method issues a handful of set-based queries
+        (relations, columns, constraints, and view definitions) and builds
+        every `sqlalchemy.schema.Table` in `meta` from the results.
+        Subsequent calls to methods like `table_definition` or
+        `deep_copy` that are passed one of these relations by name
+        reuse the bulk-reflected table rather than reflecting it again;
+        a name without a schema matches a relation in ``public``.
+
+        If this instance has a `reflection_cache`, only relations whose
+        catalog fingerprint has changed since they were cached are fetched;
+        the fingerprint query also refreshes privileges for the
+        requested relations.
+
+        Parameters
+        ----------
+        schema : `str` or list of `str`
+            The schema (or schemas) to reflect;
+            defaults to ``'public'``
+        names : list of `str`
+            Restrict reflection to these tables or views; names may be
+            qualified like ``'schema.table'``, otherwise *schema* is assumed
+        use_cache : `bool`
+            Consult `reflection_cache`, if one is configured
+
+        Returns
+        -------
+        list of `sqlalchemy.schema.Table`
+        """
+        schemas, relnames, wanted = _resolve_names(schema, names)
+        if wanted is not None and not wanted:
+            return []
+
+        cache = getattr(self, 'reflection_cache', None) if use_cache else None
+        if cache is None:
+            entries = _group_catalog(*self._fetch_catalog(schemas, relnames))
+        else:
+            entries = self._fetch_cached_catalog(cache, schemas, relnames)
+
+        tables = []
+        for key in sorted(entries):
+            if wanted is not None and key not in wanted:
+                continue
+            relation, columns, constraints, definition = entries[key]
+            table = _table_from_catalog(self.meta, relation, columns,
+                                        constraints)
+            if definition is not None:
+                table.info['view_definition'] = definition
+            tables.append(table)
+
+        # Foreign keys may point outside the reflected set
+        for table in tables:
+            for fk in table.foreign_keys:
+                target = fk.target_fullname.rsplit('.', 1)[0]
+                if target not in self.meta.tables:
+                    target_schema, target_name = \
+                        _get_schema_and_relation(target)
+                    self.reflected_table(target_name, schema=target_schema)
+        return tables
+
+    def _fetch_catalog(self, schemas, relnames=None):
+        """Return relation, column, constraint, and view definition rows
+        for bulk reflection.
+        """
+        params, relname_filter = _catalog_params(schemas, relnames)
+        results = []
+        for query, row_class in ((queries.bulk_relations, RelationRow),
+                                 (queries.bulk_columns, ColumnRow),
+                                 (queries.bulk_constraints, ConstraintRow),
+                                 (queries.bulk_view_definitions,
+                                  ViewDefinitionRow)):
+            statement = query.format(relname_filter=relname_filter)
+            results.append([row_class(*row) for row in
+                            self.engine.execute(statement, params)])
+        return results
+
+    def _fetch_cached_catalog(self, cache, schemas, relnames=None):
+        """Like `_fetch_catalog` grouped by relation, but consulting *cache*
+        and only querying full catalog information for stale relations.
+        """
+        namespace = '%s:%s/%s' % (self.host, self.port, self.database)
+        params, relname_filter = _catalog_params(schemas, relnames)
+        statement = queries.relation_fingerprints.format(
+            relname_filter=relname_filter)
+        entries, stale = {}, {}
+        for row in self.engine.execute(statement, params):
+            key = (row.schema, row.relname)
+            # Fingerprint rows double as privilege rows
+            self.privilege_cache.add(
+                row, [_get_relation_key(row.relname, row.schema)])
+            entry = cache.get(namespace, row.rel_oid, 'relation',
+                              relation_fingerprint(row))
+            if entry is None:
+                stale[key] = row
+            else:
+                entries[key] = entry
+        if stale:
+            fetched = _group_catalog(*self._fetch_catalog(
+                sorted(set(s for s, _ in stale)),
+                sorted(set(r for _, r in stale))))
+            for key, row in stale.items():
+                if key not in fetched:
+                    # Dropped since we checked the fingerprint
+                    continue
+                entries[key] = fetched[key]
+                cache.put(namespace, row.rel_oid, 'relation',
+                          relation_fingerprint(row), fetched[key])
+        return entries
+
     def reflected_privileges(self, relation, schema=None, use_cache=True):
         """Return a SQL str which recreates all privileges for *relation*.
 
@@ -124,7 +546,8 @@ class ReflectionMixin(object):
 
     def table_definition(self, table, schema=None,
                          copy_privileges=True, use_cache=True,
-                         analyze_compression=False):
+                         analyze_compression=False,
+                         wlm_query_group=None, wlm_slot_count=None):
         """
         Return a str containing the necessary SQL statements
         to recreate *table*.
@@ -141,14 +564,23 @@ class ReflectionMixin(object):
             and include them in the return value
         use_cache : `bool`
             Use cached results for the privilege query, if available
+        analyze_compression : `bool`
+            Update the column compression encodings based on results of an
+            ANALYZE COMPRESSION statement on the table, reusing results
+            cached by `analyze_compression` if available
+        wlm_query_group : `str`
+            WLM query group in which to run ANALYZE COMPRESSION
+        wlm_slot_count : `int`
+            Number of WLM slots to claim for ANALYZE COMPRESSION;
+            defaults to the ``'analyze_compression'`` entry of `wlm_policy`
         """
         table = self._pass_or_reflect(table, schema=schema)
-        table_name = self.preparer.format_table(table)
         if analyze_compression:
-            result = self.engine.execute("ANALYZE COMPRESSION %s" % table_name)
-            encodings = dict((r.Column, r.Encoding) for r in result)
+            analysis = self.analyze_compression(
+                [table], wlm_query_group=wlm_query_group,
+                wlm_slot_count=wlm_slot_count)[table.key]
             for col in table.columns:
-                col.info['encode'] = encodings[col.key]
+                col.info['encode'] = analysis.encodings[col.key]
         batch = str(CreateTable(table).compile(self.engine)).strip()
         if copy_privileges:
             batch += ';\n'
@@ -183,8 +615,17 @@ class ReflectionMixin(object):
             :meth:`~sqlalchemy_redshift.dialect.RedshiftDialect.get_view_definition`
         """
         view = self._pass_or_reflect(view, schema)
-        definition = self.engine.dialect.get_view_definition(
-            self.engine, view.name, view.schema, **kwargs)
+        batch = self._view_batch(view, copy_privileges, use_cache, **kwargs)
+        return self.mogrify(batch, None, execute)
+
+    def _view_batch(self, view, copy_privileges, use_cache, **kwargs):
+        """Compile `view_definition` output for a reflected *view*."""
+        definition = view.info.get('view_definition')
+        if definition is None:
+            definition = self.engine.dialect.get_view_definition(
+                self.engine, view.name, view.schema, **kwargs)
+        if not hasattr(definition, '_compiler_dispatch'):
+            definition = sqlalchemy.text(definition)
         create_statement = str(CreateView(view, definition)
                                .compile(self.engine))
         batch = create_statement.strip()
@@ -193,15 +634,262 @@ class ReflectionMixin(object):
             if priv_statements:
                 batch += ';\n\n'
                 batch += ';\n'.join(priv_statements)
+        return batch
+
+    def view_definitions(self, schema=None, names=None,
+                         copy_privileges=True, use_cache=True,
+                         execute=False):
+        """Return a SQL str defining many views, ordered by dependency.
+
+        Definitions and dependencies for all requested views are fetched
+        in a single catalog query and compiled locally, so views that
+        depend on others are always created after them.
+        Unlike `view_definition`, views are not reflected, so the
+        resulting CREATE VIEW statements carry no explicit column list.
+
+        Parameters
+        ----------
+        schema : `str` or list of `str`
+            The schema (or schemas) in which to look for views;
+            defaults to ``'public'``
+        names : list of `str`
+            Restrict output to these views; names may be qualified like
+            ``'schema.view'``, otherwise *schema* is assumed
+        copy_privileges : `bool`
+            Reflect ownership and grants on the existing views
+            and include them in the return value
+        use_cache : `bool`
+            Use cached results for the privilege query, if available
+        execute : `bool`
+            Execute the command in addition to returning it
+        """
+        schemas, relnames, wanted = _resolve_names(schema, names)
+        if wanted is not None and not wanted:
+            return ''
+        batches = self._view_batches(schemas, relnames, wanted,
+                                     copy_privileges, use_cache)
+        batch = '\n\n'.join(b for _, b in batches)
         return self.mogrify(batch, None, execute)
 
+    def _view_batches(self, schemas, relnames=None, wanted=None,
+                      copy_privileges=True, use_cache=True):
+        """Return ``(key, batch)`` pairs recreating views in *schemas*,
+        in dependency order.
+        """
+        params, relname_filter = _catalog_params(schemas, relnames)
+        statement = queries.views_with_dependencies.format(
+            relname_filter=relname_filter)
+        definitions, dependencies = {}, {}
+        for row in self.engine.execute(statement, params):
+            row = ViewRow(*row)
+            if wanted is not None and (row.schema, row.relname) not in wanted:
+                continue
+            key = _get_relation_key(row.relname, row.schema)
+            definitions[key] = row
+            deps = dependencies.setdefault(key, set())
+            if row.dependency_relname is not None:
+                deps.add(_get_relation_key(row.dependency_relname,
+                                           row.dependency_schema))
+        ordered = topological_sort(dependencies)
+        if copy_privileges and ordered:
+            missing = [key for key in ordered if not use_cache or
+                       self.privilege_cache.get(key) is None]
+            if missing:
+                self.refresh_privileges(relations=missing)
+
+        meta = sqlalchemy.MetaData()
+        batches = []
+        for key in ordered:
+            row = definitions[key]
+            view = sqlalchemy.Table(row.relname, meta, schema=row.schema)
+            batch = str(CreateView(view, sqlalchemy.text(row.definition))
+                        .compile(self.engine)).strip()
+            if copy_privileges:
+                batch += ';\n'
+                batch += ';\n'.join(self._privilege_statements(view, True))
+            batches.append((key, batch + ';'))
+        return batches
+
+    def dump_schema(self, schema, directory=None, filename=None,
+                    copy_privileges=True, use_cache=True, workers=4):
+        """Return a SQL str recreating every table and view in *schema*.
+
+        All relations are reflected up front with `reflected_tables`.
+        The relations are then split among a pool of *workers* threads,
+        each of which fetches privileges for its share on its own
+        connection from `create_connection` and compiles
+        `table_definition` and `view_definition` output.
+        Tables are ordered so that foreign key targets come first,
+        followed by views ordered by their dependencies.
+
+        Parameters
+        ----------
+        schema : `str` or list of `str`
+            The schema (or schemas) to dump
+        directory : `str`
+            If given, also write one ``<schema>.<relation>.sql`` file
+            per relation into this directory, creating it if needed
+        filename : `str`
+            If given, also write the combined script to this file
+        copy_privileges : `bool`
+            Include ownership and grants for each relation
+        use_cache : `bool`
+            Consult `reflection_cache`, if one is configured, and reuse
+            privileges already in `privilege_cache`
+        workers : `int`
+            Number of relations to fetch privileges for and compile
+            concurrently, each on its own connection
+
+        Returns
+        -------
+        `str`
+        """
+        relations = self.reflected_tables(schema, use_cache=use_cache)
+        schemas = sorted(set(r.schema for r in relations))
+
+        by_key = dict((r.key, r) for r in relations)
+        table_deps, view_deps = {}, {}
+        for relation in relations:
+            if 'view_definition' in relation.info:
+                view_deps[relation.key] = set()
+            else:
+                table_deps[relation.key] = set(
+                    fk.target_fullname.rsplit('.', 1)[0]
+                    for fk in relation.foreign_keys)
+        if view_deps:
+            for key, deps in self._view_dependencies(schemas).items():
+                if key in view_deps:
+                    view_deps[key] = deps
+        ordered = [by_key[key] for key in
+                   topological_sort(table_deps) + topological_sort(view_deps)]
+
+        def dump(cursor, chunk):
+            if copy_privileges:
+                missing = [r for r in chunk if not use_cache or
+                           self.privilege_cache.get(r.key) is None]
+                if missing:
+                    self._fetch_privileges(cursor, missing)
+            definitions = {}
+            for relation in chunk:
+                if 'view_definition' in relation.info:
+                    batch = self._view_batch(relation, copy_privileges, True)
+                else:
+                    batch = self.table_definition(
+                        relation, copy_privileges=copy_privileges)
+                definitions[relation.key] = batch.strip().rstrip(';') + ';'
+            return definitions
+
+        workers = max(1, min(workers, len(ordered)))
+        chunks = [ordered[i::workers] for i in range(workers)]
+        definitions = {}
+        if workers == 1:
+            with self.connection as conn:
+                with conn.cursor() as cur:
+                    definitions.update(dump(cur, chunks[0]))
+        else:
+            connections = Queue()
+            opened = []
+            for _ in range(workers):
+                conn = self.create_connection()
+                conn.autocommit = True
+                opened.append(conn)
+                connections.put(conn)
+
+            def dump_pooled(chunk):
+                conn = connections.get()
+                try:
+                    with conn.cursor() as cur:
+                        return dump(cur, chunk)
+                finally:
+                    connections.put(conn)
+
+            pool = ThreadPool(workers)
+            try:
+                for result in pool.map(dump_pooled, chunks):
+                    definitions.update(result)
+            finally:
+                pool.close()
+                pool.join()
+                for conn in opened:
+                    conn.close()
+        batches = [definitions[relation.key] for relation in ordered]
+
+        if directory is not None:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            for relation, batch in zip(ordered, batches):
+                path = os.path.join(directory, relation.key + '.sql')
+                with codecs.open(path, 'w', encoding='utf-8') as f:
+                    f.write(batch + '\n')
+        script = '\n\n'.join(batches)
+        if filename is not None:
+            with codecs.open(filename, 'w', encoding='utf-8') as f:
+                f.write(script + '\n')
+        return script
+
+    def _view_dependencies(self, schemas, relnames=None):
+        """Return a dict mapping view keys in *schemas* to the set of
+        relation keys each view directly references.
+        """
+        params, relname_filter = _catalog_params(schemas, relnames)
+        statement = queries.view_dependencies.format(
+            relname_filter=relname_filter)
+        dependencies = {}
+        for row in self.engine.execute(statement, params):
+            row = ViewDependencyRow(*row)
+            key = _get_relation_key(row.relname, row.schema)
+            dependencies.setdefault(key, set()).add(_get_relation_key(
+                row.dependency_relname, row.dependency_schema))
+        return dependencies
+
+    def dependent_views(self, table, schema=None):
+        """Return keys of all views that depend on *table*, directly or
+        through other views, ordered so that each view follows the views
+        it selects from.
+
+        Parameters
+        ----------
+        table : `str` or `sqlalchemy.schema.Table`
+            The relation whose dependents to find
+        schema : `str`
+            The database schema of *table* (only used if *table* is str);
+            defaults to ``'public'``
+
+        Returns
+        -------
+        list of `str`
+        """
+        if hasattr(table, 'schema'):
+            schema, table = table.schema, table.name
+        key = _get_relation_key(table, schema or 'public')
+        dependencies, dependents = {}, {}
+        for row in self.engine.execute(queries.all_view_dependencies):
+            row = ViewDependencyRow(*row)
+            view = _get_relation_key(row.relname, row.schema)
+            dependency = _get_relation_key(row.dependency_relname,
+                                           row.dependency_schema)
+            dependencies.setdefault(view, set()).add(dependency)
+            dependents.setdefault(dependency, set()).add(view)
+        found = set()
+        pending = [key]
+        while pending:
+            for view in dependents.get(pending.pop(), ()):
+                if view not in found:
+                    found.add(view)
+                    pending.append(view)
+        return topological_sort(dict((view, dependencies[view])
+                                     for view in found))
+
     def deep_copy(self, table, schema=None,
                   copy_privileges=True, use_cache=True,
-                  cascade=False, distinct=False,
+                  cascade=False, rebuild_views=False, distinct=False,
                   analyze_compression=False,
                   analyze=True,
                   deduplicate_partition_by=None,
                   deduplicate_order_by=None,
+                  columns=None,
+                  wlm_query_group=None,
+                  wlm_slot_count=None,
                   execute=False,
                   **kwargs):
         """Return a SQL str defining a deep copy of *table*.
@@ -226,6 +914,11 @@ class ReflectionMixin(object):
             Use cached results for the privilege query, if available
         cascade : `bool`
             Drop any dependent views when dropping the source table
+        rebuild_views : `bool`
+            Capture the definitions of all views that transitively depend
+            on *table* (see `dependent_views`), drop them along with the
+            source table and recreate them, with their privileges if
+            *copy_privileges* is set, in the same batch; implies *cascade*
         distinct : `bool`
             Deduplicate the table by adding DISTINCT to the SELECT statement;
             also see *deduplicate_partition_by* for more control
@@ -246,6 +939,17 @@ class ReflectionMixin(object):
             passed to the 'PARTITION BY' clause for deduplication, with
             the first row in sort order being the one retained;
             will be ignored if *deduplicate_partition_by* is not also set
+        columns : list of `str`
+            Copy only these columns, which must exist in both the existing
+            table and *table*; other columns of *table* get their defaults.
+            Use this when *table* adds, drops or reorders columns.
+            By default, every column is copied by position
+        wlm_query_group : `str`
+            WLM query group in which to run the copy
+        wlm_slot_count : `int`
+            Number of WLM slots to claim for the copy, giving the INSERT
+            more memory to sort in; defaults to the ``'deep_copy'`` entry
+            of `wlm_policy`
         execute : `bool`
             Execute the command in addition to returning it.
         kwargs :
@@ -257,13 +961,18 @@ class ReflectionMixin(object):
         outgoing_name = table_name + '$outgoing'
         outgoing_name_simple = table.name + '$outgoing'
         table_definition = '\n' + self.table_definition(
-            table, None, copy_privileges, use_cache, analyze_compression)
+            table, None, copy_privileges, use_cache, analyze_compression,
+            wlm_query_group, wlm_slot_count)
         insert_statement = "\nINSERT INTO {table_name} SELECT "
+        if columns is not None:
+            insert_statement = ("\nINSERT INTO {table_name} (%s)\nSELECT " %
+                                ', '.join('"%s"' % colname
+                                          for colname in columns))
         if distinct:
             insert_statement += "DISTINCT "
         if deduplicate_partition_by:
             col_str = ',\n\t'.join('"%s"' % colname for colname in
-                                   table.columns.keys())
+                                   (columns or table.columns.keys()))
             inner = "\tSELECT *, ROW_NUMBER() \n"
             inner += "\tOVER (PARTITION BY {deduplicate_partition_by}"
             if deduplicate_order_by:
@@ -271,8 +980,17 @@ class ReflectionMixin(object):
             inner += ")\n\tFROM {outgoing_name}\n"
             insert_statement += ("\n\t" + col_str + "\nFROM (\n" +
                                  inner + ") WHERE row_number = 1")
+        elif columns is not None:
+            insert_statement += (', '.join('"%s"' % colname
+                                           for colname in columns) +
+                                 " FROM {outgoing_name}")
         else:
             insert_statement += "* FROM {outgoing_name}"
+        view_batches = []
+        if rebuild_views:
+            view_batches = self._dependent_view_batches(
+                table, copy_privileges, use_cache)
+            cascade = True
         drop_statement = "\nDROP TABLE {outgoing_name}"
         if cascade:
             drop_statement += " CASCADE"
@@ -283,34 +1001,518 @@ class ReflectionMixin(object):
             insert_statement,
             drop_statement,
         ]
-        if analyze:
-            statements.append("ANALYZE {table_name}")
         batch = ';\n'.join(statements).format(
             table_name=table_name, outgoing_name=outgoing_name,
             outgoing_name_simple=outgoing_name_simple,
             deduplicate_partition_by=deduplicate_partition_by,
             deduplicate_order_by=deduplicate_order_by,
         ) + ';'
+        for _, view_batch in view_batches:
+            # Views are recreated from definitions captured before the swap
+            batch += '\n\n' + view_batch
+        if analyze:
+            batch += '\nANALYZE %s;' % table_name
+        batch = wrap_batch(batch, **self._wlm_settings(
+            'deep_copy', wlm_query_group, wlm_slot_count))
         return self.mogrify(batch, None, execute)
 
-    def _cache_privileges(self):
-        result = self.engine.execute(queries.all_privileges)
-        self._all_privileges = {}
-        for r in result:
-            key = _get_relation_key(r.relname, r.schema)
-            self._all_privileges[key] = r
+    def chunked_deep_copy(self, table, schema=None, chunks=10, column=None,
+                          shadow=False, copy_privileges=True, use_cache=True,
+                          rebuild_views=False, analyze=True,
+                          wlm_query_group=None, wlm_slot_count=None,
+                          execute=False, **kwargs):
+        """Return a list of SQL batches deep copying *table* in ranges.
+
+        Where `deep_copy` copies the whole table with a single INSERT
+        inside one long transaction, this splits the copy into *chunks*
+        ranges of *column*, each inserted in sort key order by its own
+        batch. Sort space and the time any single transaction holds locks
+        then scale with the chunk rather than the table, and appending
+        ranges in sort key order keeps the new table sorted.
+
+        By default, the first batch renames *table* away and creates the
+        new structure under the original name, so writers continue into
+        the new table while the ranges are copied, but readers see it
+        partially filled until the copy completes.
+
+        With ``shadow=True``, the new structure is instead built under
+        a ``$incoming`` name while *table* stays online. The final batch
+        locks *table*, recopies the last range (and NULLs) to catch up
+        on rows appended during the copy, and swaps the two tables.
+        This assumes new rows arrive at the top of the *column* range,
+        as with timestamps or sequence ids; updates and deletes
+        elsewhere in the table during the copy are not carried over.
+
+        Parameters
+        ----------
+        table : `str` or `sqlalchemy.schema.Table`
+            The table to reflect
+        schema : `str`
+            The database schema in which to look for *table*
+            (only used if *table* is str)
+        chunks : `int`
+            Number of ranges to copy
+        column : `str`
+            Column whose range is split; defaults to the first sort key
+            column (or the distkey). Ranges are interpolated between the
+            minimum and maximum for numeric and date/time columns, and
+            taken from NTILE quantiles otherwise.
+        shadow : `bool`
+            Copy into a shadow table without locking *table*,
+            then catch up and swap
+        copy_privileges : `bool`
+            Reflect ownership and grants on the existing table
+            and include them in the return value
+        use_cache : `bool`
+            Use cached results for the privilege query, if available
+        rebuild_views : `bool`
+            Recreate views depending on *table*, as with `deep_copy`
+        analyze : `bool`
+            End with an ANALYZE of the new table
+        wlm_query_group : `str`
+            WLM query group in which to run each batch
+        wlm_slot_count : `int`
+            Number of WLM slots to claim for each batch; defaults to the
+            ``'deep_copy'`` entry of `wlm_policy`
+        execute : `bool`
+            Execute the batches, in order, in addition to returning them
+        kwargs :
+            Additional keyword arguments will be passed unchanged to the
+            `reflected_table` method.
+
+        Returns
+        -------
+        list of `str`
+        """
+        table = self._pass_or_reflect(table, schema=schema, **kwargs)
+        table_name = self.preparer.format_table(table)
+        sort_columns = _sort_columns(table)
+        column = column or (sort_columns[0] if sort_columns else None)
+        if column is None:
+            raise ValueError("%s has no sort key or distkey; "
+                             "pass a column to split on" % table_name)
+        order_by = ', '.join(self.preparer.quote(c)
+                             for c in (sort_columns or (column,)))
+        ranges = self._chunk_ranges(table_name, column, chunks)
+
+        view_batches = []
+        if rebuild_views:
+            view_batches = self._dependent_view_batches(
+                table, copy_privileges, use_cache)
+        drop_statement = 'DROP TABLE %s$outgoing'
+        if view_batches:
+            drop_statement += ' CASCADE'
+
+        insert = 'INSERT INTO %s SELECT * FROM %s WHERE %s ORDER BY %s'
+        if shadow:
+            target = table_name + '$incoming'
+            source = table_name
+            setup = [self._shadow_definition(table, table.name + '$incoming')]
+        else:
+            target = table_name
+            source = table_name + '$outgoing'
+            setup = [
+                'LOCK TABLE %s' % table_name,
+                'ALTER TABLE %s RENAME TO %s' % (
+                    table_name, self.preparer.quote(table.name + '$outgoing')),
+                self.table_definition(table, None, copy_privileges,
+                                      use_cache),
+            ]
+        batches = [';\n'.join(setup) + ';']
+        for predicate in ranges:
+            batches.append(insert % (target, source, predicate, order_by) +
+                           ';')
+
+        if shadow:
+            # Catch up on rows appended during the copy, then swap
+            tail = ranges[-2:] if len(ranges) > 1 else ranges
+            final = ['LOCK TABLE %s' % table_name]
+            for predicate in tail:
+                final.append('DELETE FROM %s WHERE %s' % (target, predicate))
+                final.append(insert % (target, source, predicate, order_by))
+            final += [
+                'ALTER TABLE %s RENAME TO %s' % (
+                    table_name, self.preparer.quote(table.name + '$outgoing')),
+                'ALTER TABLE %s RENAME TO %s' % (
+                    target, self.preparer.quote(table.name)),
+            ]
+            if copy_privileges:
+                final += self._privilege_statements(table, use_cache)
+            final.append(drop_statement % table_name)
+        else:
+            final = [drop_statement % table_name]
+        final_batch = ';\n'.join(final) + ';'
+        for _, view_batch in view_batches:
+            final_batch += '\n\n' + view_batch
+        if analyze:
+            final_batch += '\nANALYZE %s;' % table_name
+        batches.append(final_batch)
+
+        wlm_settings = self._wlm_settings(
+            'deep_copy', wlm_query_group, wlm_slot_count)
+        batches = [self.mogrify(wrap_batch(batch, **wlm_settings))
+                   for batch in batches]
+        if execute:
+            for batch in batches:
+                self.execute(batch)
+        return batches
+
+    def shadow_deep_copy(self, table, column, schema=None,
+                         catch_up_passes=1, use_append=False,
+                         copy_privileges=True, use_cache=True,
+                         rebuild_views=False, analyze=True,
+                         wlm_query_group=None, wlm_slot_count=None,
+                         execute=False, **kwargs):
+        """Return a list of SQL batches deep copying *table* while it
+        stays online, locking it only to swap in the copy.
+
+        The new structure is built and filled under a ``$incoming`` name
+        without locking *table*. Rows that arrive during the copy are then
+        caught up in *catch_up_passes* unlocked passes, each copying rows
+        whose *column* exceeds the largest value already copied. The final
+        batch takes the exclusive lock just long enough to copy any
+        remaining rows, rename the tables, restore privileges and
+        recreate dependent views.
+
+        *column* must increase with every write, like a load timestamp or
+        sequence id; updates and deletes of existing rows during the copy
+        are not carried over.
+
+        Run each batch with ``execute(batch, autocommit=True)``; the
+        ``ALTER TABLE APPEND`` used with *use_append* cannot run inside
+        an explicit transaction.
+
+        Parameters
+        ----------
+        table : `str` or `sqlalchemy.schema.Table`
+            The table to reflect
+        column : `str`
+            An ever-increasing column identifying newly written rows
+        schema : `str`
+            The database schema in which to look for *table*
+            (only used if *table* is str)
+        catch_up_passes : `int`
+            Number of unlocked passes copying newly written rows
+        use_append : `bool`
+            Stage each catch-up pass in a ``$delta`` table and move its
+            blocks into the copy with ``ALTER TABLE APPEND``, rather than
+            inserting directly into the copy
+        copy_privileges : `bool`
+            Reflect ownership and grants on the existing table
+            and apply them to the copy
+        use_cache : `bool`
+            Use cached results for the privilege query, if available
+        rebuild_views : `bool`
+            Recreate views depending on *table*, as with `deep_copy`
+        analyze : `bool`
+            End with an ANALYZE of the new table
+        wlm_query_group : `str`
+            WLM query group in which to run each batch
+        wlm_slot_count : `int`
+            Number of WLM slots to claim for each batch; defaults to the
+            ``'deep_copy'`` entry of `wlm_policy`
+        execute : `bool`
+            Execute the batches, in order, in addition to returning them
+        kwargs :
+            Additional keyword arguments will be passed unchanged to the
+            `reflected_table` method.
+
+        Returns
+        -------
+        list of `str`
+        """
+        table = self._pass_or_reflect(table, schema=schema, **kwargs)
+        table_name = self.preparer.format_table(table)
+        shadow = table_name + '$incoming'
+        delta = table_name + '$delta'
+        order_by = ', '.join(self.preparer.quote(c) for c in
+                             (_sort_columns(table) or (column,)))
+        # While the copy is still empty (as when *table* was empty at the
+        # initial copy) its MAX is NULL, and every row is new
+        new_rows = ('INSERT INTO {target} SELECT * FROM {source} '
+                    'WHERE {column} > (SELECT MAX({column}) FROM {shadow}) '
+                    'OR (SELECT MAX({column}) FROM {shadow}) IS NULL '
+                    'ORDER BY {order_by}')
+
+        def catch_up(target):
+            return new_rows.format(target=target, source=table_name,
+                                   column=self.preparer.quote(column),
+                                   shadow=shadow, order_by=order_by)
+
+        wlm_settings = self._wlm_settings(
+            'deep_copy', wlm_query_group, wlm_slot_count)
+        batches = [
+            self._shadow_definition(table, table.name + '$incoming') + ';',
+            wrap_batch('INSERT INTO %s SELECT * FROM %s ORDER BY %s;'
+                       % (shadow, table_name, order_by), **wlm_settings),
+        ]
+        for _ in range(catch_up_passes):
+            if use_append:
+                batches += [
+                    'CREATE TABLE %s (LIKE %s);\n%s;'
+                    % (delta, shadow, catch_up(delta)),
+                    'ALTER TABLE %s APPEND FROM %s;' % (shadow, delta),
+                    'DROP TABLE %s;' % delta,
+                ]
+            else:
+                batches.append(catch_up(shadow) + ';')
+
+        view_batches = []
+        if rebuild_views:
+            view_batches = self._dependent_view_batches(
+                table, copy_privileges, use_cache)
+        final = [
+            'LOCK TABLE %s' % table_name,
+            catch_up(shadow),
+            'ALTER TABLE %s RENAME TO %s' % (
+                table_name, self.preparer.quote(table.name + '$outgoing')),
+            'ALTER TABLE %s RENAME TO %s' % (
+                shadow, self.preparer.quote(table.name)),
+        ]
+        if copy_privileges:
+            final += self._privilege_statements(table, use_cache)
+        drop_statement = 'DROP TABLE %s$outgoing' % table_name
+        if view_batches:
+            drop_statement += ' CASCADE'
+        final.append(drop_statement)
+        final_batch = ';\n'.join(final) + ';'
+        for _, view_batch in view_batches:
+            final_batch += '\n\n' + view_batch
+        batches.append(final_batch)
+        if analyze:
+            batches.append('ANALYZE %s;' % table_name)
+
+        batches = [self.mogrify(batch) for batch in batches]
+        if execute:
+            for batch in batches:
+                self.execute(batch, autocommit=True)
+        return batches
+
+    def incremental_deduplicate(self, table, partition_by, window_column,
+                                since, schema=None, order_by=None,
+                                wlm_query_group=None, wlm_slot_count=None,
+                                execute=False, **kwargs):
+        """Return a SQL str removing duplicates among recently loaded rows
+        of *table*, without rewriting the rest of it.
+
+        Where `deep_copy` with *deduplicate_partition_by* ranks every row
+        of the table, this only looks at rows whose *window_column* is at
+        least *since*. Keys duplicated within that window are found with
+        a GROUP BY (a hash aggregate) into a temporary table, the first
+        row for each of them is set aside, and all of their rows in the
+        window are deleted before the retained rows are inserted back,
+        in a single transaction holding the table lock. Work scales with
+        the window rather than with the table.
+
+        Duplicates are only detected when all of their rows fall inside
+        the window, so it should reach back as far as data can be
+        reloaded. Rows with a NULL in *partition_by* are left alone.
+
+        Parameters
+        ----------
+        table : `str` or `sqlalchemy.schema.Table`
+            The table to reflect
+        partition_by : `str` or list of `str`
+            The columns identifying a row, like ``'col1, col2'``
+        window_column : `str`
+            A load timestamp or batch id column bounding the window
+        since : object
+            The lowest *window_column* value in the window, bound as
+            a query parameter
+        schema : `str`
+            The database schema in which to look for *table*
+            (only used if *table* is str)
+        order_by : `str`
+            A string like ``'col3 DESC NULLS LAST'`` ordering the rows of
+            each key, with the first row in sort order being the one
+            retained; by default an arbitrary row is retained
+        wlm_query_group : `str`
+            WLM query group in which to run the batch
+        wlm_slot_count : `int`
+            Number of WLM slots to claim for the batch; defaults to the
+            ``'deduplicate'`` entry of `wlm_policy`
+        execute : `bool`
+            Execute the command in addition to returning it.
+        kwargs :
+            Additional keyword arguments will be passed unchanged to the
+            `reflected_table` method.
+        """
+        table = self._pass_or_reflect(table, schema=schema, **kwargs)
+        table_name = self.preparer.format_table(table)
+        if not isinstance(partition_by, (list, tuple)):
+            partition_by = _split_identifiers(partition_by)
+        keys = [self.preparer.quote(key) for key in partition_by]
+        columns = ', '.join(self.preparer.quote(column.name)
+                            for column in table.columns)
+        duplicates = self.preparer.quote(table.name + '$duplicates')
+        retained = self.preparer.quote(table.name + '$retained')
+        window = '%s >= %%(since)s' % self.preparer.quote(window_column)
+        matches = ' AND '.join('%s.%s = %s.%s' % (table_name, key,
+                                                  duplicates, key)
+                               for key in keys)
+        over = 'PARTITION BY %s' % ', '.join(
+            '%s.%s' % (table_name, key) for key in keys)
+        if order_by:
+            over += ' ORDER BY %s' % order_by
+        statements = [
+            'LOCK TABLE %s' % table_name,
+            'CREATE TEMP TABLE %s AS\n'
+            'SELECT %s FROM %s WHERE %s\n'
+            'GROUP BY %s HAVING COUNT(*) > 1' % (
+                duplicates, ', '.join(keys), table_name, window,
+                ', '.join(keys)),
+            'CREATE TEMP TABLE %s AS\n'
+            'SELECT %s FROM (\n'
+            '\tSELECT %s.*, ROW_NUMBER() OVER (%s) AS "row_number"\n'
+            '\tFROM %s JOIN %s ON %s\n'
+            '\tWHERE %s.%s\n'
+            ') WHERE "row_number" = 1' % (
+                retained, columns, table_name, over, table_name,
+                duplicates, matches, table_name, window),
+            'DELETE FROM %s USING %s\nWHERE %s AND %s.%s' % (
+                table_name, duplicates, matches, table_name, window),
+            'INSERT INTO %s (%s)\nSELECT %s FROM %s' % (
+                table_name, columns, columns, retained),
+            'DROP TABLE %s' % retained,
+            'DROP TABLE %s' % duplicates,
+        ]
+        batch = wrap_batch(';\n'.join(statements) + ';',
+                           **self._wlm_settings('deduplicate',
+                                                wlm_query_group,
+                                                wlm_slot_count))
+        return self.mogrify(batch, {'since': since}, execute)
+
+    def _chunk_ranges(self, table_name, column, chunks):
+        """Return WHERE predicates splitting *table_name* into about
+        *chunks* ranges of *column*, with NULLs in a range of their own.
+        """
+        quoted = self.preparer.quote(column)
+        low, high = self.engine.execute(
+            'SELECT MIN(%s), MAX(%s) FROM %s'
+            % (quoted, quoted, table_name)).fetchone()
+        boundaries = _interpolate(low, high, chunks)
+        if boundaries is None:
+            result = self.engine.execute(
+                'SELECT MIN(value) FROM ('
+                'SELECT {0} AS value, NTILE({1}) OVER (ORDER BY {0}) AS chunk '
+                'FROM {2} WHERE {0} IS NOT NULL) GROUP BY chunk ORDER BY 1'
+                .format(quoted, int(chunks), table_name))
+            boundaries = [row[0] for row in result][1:]
+        literals = [self.mogrify('%s', (value,)) for value in boundaries]
+        if not literals:
+            ranges = ['%s IS NOT NULL' % quoted]
+        else:
+            ranges = ['%s < %s' % (quoted, literals[0])]
+            for start, end in zip(literals, literals[1:]):
+                ranges.append('%s >= %s AND %s < %s'
+                              % (quoted, start, quoted, end))
+            ranges.append('%s >= %s' % (quoted, literals[-1]))
+        ranges.append('%s IS NULL' % quoted)
+        return ranges
+
+    def _shadow_definition(self, table, name):
+        """Return a CREATE TABLE statement for *table* under *name*."""
+        table_name = self.preparer.format_table(table)
+        statement = str(CreateTable(table).compile(self.engine)).strip()
+        prefix = 'CREATE TABLE %s ' % table_name
+        shadow_name = self.preparer.quote(name)
+        if table.schema:
+            shadow_name = (self.preparer.quote_schema(table.schema) + '.' +
+                           shadow_name)
+        return statement.replace(prefix, 'CREATE TABLE %s ' % shadow_name, 1)
+
+    def _dependent_view_batches(self, table, copy_privileges, use_cache):
+        """Return ``(key, batch)`` pairs recreating views which depend on
+        *table*, in dependency order.
+        """
+        views = self.dependent_views(table)
+        if not views:
+            return []
+        pairs = [_get_schema_and_relation(key) for key in views]
+        return self._view_batches(
+            sorted(set(s for s, _ in pairs)),
+            sorted(set(r for _, r in pairs)),
+            set((s, r) for s, r in pairs),
+            copy_privileges, use_cache)
+
+    def refresh_privileges(self, schema=None, relations=None, oids=None):
+        """Fetch ownership and privileges into `privilege_cache`.
+
+        Only the requested relations are queried and replaced;
+        with no arguments, all relations on the search path are refreshed.
+
+        Parameters
+        ----------
+        schema : `str` or `list` of `str`
+            Refresh every relation in these schemas
+        relations : `list`
+            Relation keys like ``'schema.table'`` or `sqlalchemy.schema.Table`
+            objects; unqualified names match relations on the search path
+        oids : `list` of `int`
+            Refresh relations with these oids
+
+        Returns
+        -------
+        `int`
+            The number of relations fetched
+        """
+        if schema is not None and not isinstance(schema, (list, tuple, set)):
+            schema = [schema]
+        pairs = []
+        for relation in relations or ():
+            if hasattr(relation, 'schema'):
+                pairs.append((relation.schema, relation.name))
+            else:
+                pairs.append(_get_schema_and_relation(relation))
+        if schema or pairs or oids:
+            params, relation_filter = _privilege_params(schema, pairs, oids)
+            unqualified = set(name for s, name in pairs if s is None)
+        else:
+            params = {}
+            relation_filter = 'pg_catalog.pg_table_is_visible(c.oid)'
+            unqualified = None
+        statement = queries.scoped_privileges.format(
+            relation_filter=relation_filter)
+        return self._cache_privileges(
+            self.engine.execute(statement, params), unqualified)
+
+    def _fetch_privileges(self, cursor, relations):
+        """Like `refresh_privileges` for reflected *relations*, but
+        querying through *cursor*, so it can run on another connection.
+        """
+        params, relation_filter = _privilege_params(
+            relations=[(r.schema, r.name) for r in relations])
+        cursor.execute(queries.scoped_privileges.format(
+            relation_filter=relation_filter), params)
+        return self._cache_privileges(
+            (PrivilegeRow(*row) for row in cursor.fetchall()), set())
+
+    def _cache_privileges(self, rows, unqualified):
+        count = 0
+        for row in rows:
+            keys = [_get_relation_key(row.relname, row.schema)]
+            if row.visible and (unqualified is None or
+                                row.relname in unqualified):
+                keys.append(row.relname)
+            self.privilege_cache.add(row, keys)
+            count += 1
+        return count
 
     def _privilege_statements(self, relation, use_cache):
-        if not use_cache or not self._all_privileges:
-            self._cache_privileges()
-        priv_info = self._all_privileges[relation.key]
+        priv_info = None
+        if use_cache:
+            priv_info = self.privilege_cache.get(relation.key)
+        if priv_info is None:
+            self.refresh_privileges(relations=[relation])
+            priv_info = self.privilege_cache.get(relation.key)
+        if priv_info is None:
+            raise ValueError("Could not find privileges for %s" % relation.key)
         relation_name = self.preparer.format_table(relation)
         statements = [("ALTER {type} {relation_name} OWNER TO {owner}"
                        .format(type=priv_info.type.upper(),
                                relation_name=relation_name,
                                owner=priv_info.owner_name))]
-        statements += grants_from_privileges(priv_info.privileges,
-                                             relation.key)
+        statements += grants_from_acl(priv_info.acl, relation.key)
         return statements
 
     def _pass_or_reflect(self, table, schema, **kwargs):
@@ -318,5 +1520,21 @@ class ReflectionMixin(object):
             # This is already a sqlalchemy.Table object; return it unchanged.
             CreateTable(table)
         except AttributeError:
+            existing = self._bulk_reflected(table, schema)
+            if not kwargs and existing is not None:
+                return existing
             table = self.reflected_table(table, schema=schema, **kwargs)
         return table
+
+    def _bulk_reflected(self, name, schema):
+        """Return the table in `meta` from `reflected_tables` for *name*,
+        or None. Without a *schema*, a table from ``public`` matches.
+        """
+        keys = [_get_relation_key(name, schema)]
+        if schema is None:
+            keys.append(_get_relation_key(name, 'public'))
+        for key in keys:
+            existing = self.meta.tables.get(key)
+            if existing is not None and existing.info.get('bulk_reflected'):
+                return existing
+        return None
@@ -14,7 +14,13 @@ from functools import wraps
 from boto.s3.connection import S3Connection
 from boto.s3.connection import OrdinaryCallingFormat
 
-from shiftmanager import util, queries
+from shiftmanager import util
+from shiftmanager.copy_options import JSON_COPY_OPTIONS
+from shiftmanager.inference import SchemaInferrer
+from shiftmanager.instrumentation import instrumented
+from shiftmanager.mixins.reflection import (_get_schema_and_relation,
+                                            _split_identifiers)
+from shiftmanager.wlm import wrap_batch
 
 
 def check_s3_connection(f):
@@ -112,7 +118,7 @@ class S3Mixin(object):
 
         return s3_conn
 
-    def write_dict_to_key(self, data, key, close=False):
+    def write_dict_to_key(self, data, key, close=False, retry=None):
         """
         Given a Boto S3 Key, write a given dict to that key as JSON.
 
@@ -122,16 +128,21 @@ class S3Mixin(object):
         key : boto.s3.Key
         close : bool, default False
             Close key after write
+        retry : `shiftmanager.retry.RetryPolicy`
+            Overrides `retry_policy` for this call
         """
-        fp = StringIO()
-        fp.write(json.dumps(data, ensure_ascii=False))
-        fp.seek(0)
-        key.set_contents_from_file(fp)
+        def attempt():
+            fp = StringIO()
+            fp.write(json.dumps(data, ensure_ascii=False))
+            fp.seek(0)
+            key.set_contents_from_file(fp)
+
+        self._retry(retry).run(attempt)
         if close:
             key.close()
         return key
 
-    def write_string_to_s3(self, chunk, bucket, s3_key_path):
+    def write_string_to_s3(self, chunk, bucket, s3_key_path, retry=None):
         """
         Given a string chunk that represents a piece of a CSV file, write
         the chunk to an S3 key.
@@ -144,11 +155,14 @@ class S3Mixin(object):
             The bucket to be written to
         s3_key_path: str
             The key path to write the chunk to
+        retry : `shiftmanager.retry.RetryPolicy`
+            Overrides `retry_policy` for this call
         """
         boto_key = bucket.new_key(s3_key_path)
-        boto_key.set_contents_from_string(chunk, encrypt_key=True)
+        self._retry(retry).run(
+            lambda: boto_key.set_contents_from_string(chunk, encrypt_key=True))
 
-    def write_file_to_s3(self, path, bucket, s3_key_path):
+    def write_file_to_s3(self, path, bucket, s3_key_path, retry=None):
         """
         Given a path to a file, write it to an S3 key.
 
@@ -160,9 +174,13 @@ class S3Mixin(object):
             The bucket to be written to
         s3_key_path: str
             The key path to write the chunk to
+        retry : `shiftmanager.retry.RetryPolicy`
+            Overrides `retry_policy` for this call
         """
         boto_key = bucket.new_key(s3_key_path)
-        boto_key.set_contents_from_filename(path, encrypt_key=True)
+        self._retry(retry).run(
+            lambda: boto_key.set_contents_from_filename(path,
+                                                        encrypt_key=True))
 
     @check_s3_connection
     def get_bucket(self, bucket_name):
@@ -196,7 +214,8 @@ class S3Mixin(object):
 
     @staticmethod
     @contextmanager
-    def chunked_json_slices(data, slices, directory=None, clean_on_exit=True):
+    def chunked_json_slices(data, slices, directory=None, clean_on_exit=True,
+                            listeners=None, advisor=None):
         """
         Given an iterator of dicts, chunk them into *slices* and write to
         temp files on disk. Clean up when leaving scope.
@@ -211,6 +230,10 @@ class S3Mixin(object):
             Dir to write chunks to. Will default to $HOME/.shiftmanager/tmp/
         clean_on_exit : bool, default True
             Clean up chunks on disk when context exits
+        listeners : list of callables
+            Instrumentation listeners to receive a ``'serialize'`` phase event
+        advisor : `shiftmanager.encoding.EncodingAdvisor`
+            Profile each dict for compression encoding recommendations
 
         Returns
         -------
@@ -221,41 +244,51 @@ class S3Mixin(object):
         """
 
         # Ensure that files get cleaned up even on raised exception
+        chunk_files = []
         try:
-            num_data = len(data)
-            chunk_range_start = util.linspace(0, num_data, slices)
-            chunk_range_end = chunk_range_start[1:]
-            chunk_range_end.append(None)
-            stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S%f")
-
-            if not directory:
-                user_home = os.path.expanduser("~")
-                directory = os.path.join(user_home, ".shiftmanager", "tmp")
-
-            if not os.path.exists(directory):
-                os.makedirs(directory)
-
-            chunk_files = []
-            range_zipper = list(zip(chunk_range_start, chunk_range_end))
-            for i, (inclusive, exclusive) in enumerate(range_zipper):
-
-                # Get either a inc/excl slice,
-                # or the slice to the end of the range
-                if exclusive is not None:
-                    sliced = data[inclusive:exclusive]
-                else:
-                    sliced = data[inclusive:]
-
-                newlined = ""
-                for doc in sliced:
-                    newlined = "{}{}\n".format(newlined, json.dumps(doc))
-
-                filepath = "{}.gz".format("-".join([stamp, str(i)]))
-                write_path = os.path.join(directory, filepath)
-                current_fp = gzip.open(write_path, 'wb')
-                current_fp.write(newlined.encode("utf-8"))
-                current_fp.close()
-                chunk_files.append(write_path)
+            with instrumented(listeners or [], 'phase', 'serialize') as event:
+                num_data = len(data)
+                chunk_range_start = util.linspace(0, num_data, slices)
+                chunk_range_end = chunk_range_start[1:]
+                chunk_range_end.append(None)
+                stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S%f")
+
+                if not directory:
+                    user_home = os.path.expanduser("~")
+                    directory = os.path.join(user_home, ".shiftmanager",
+                                             "tmp")
+
+                if not os.path.exists(directory):
+                    os.makedirs(directory)
+
+                event.rowcount = num_data
+                event.bytes_serialized = 0
+                event.bytes_compressed = 0
+                range_zipper = list(zip(chunk_range_start, chunk_range_end))
+                for i, (inclusive, exclusive) in enumerate(range_zipper):
+
+                    # Get either a inc/excl slice,
+                    # or the slice to the end of the range
+                    if exclusive is not None:
+                        sliced = data[inclusive:exclusive]
+                    else:
+                        sliced = data[inclusive:]
+
+                    newlined = ""
+                    for doc in sliced:
+                        newlined = "{}{}\n".format(newlined, json.dumps(doc))
+                        if advisor is not None:
+                            advisor.observe(doc)
+
+                    filepath = "{}.gz".format("-".join([stamp, str(i)]))
+                    write_path = os.path.join(directory, filepath)
+                    encoded = newlined.encode("utf-8")
+                    current_fp = gzip.open(write_path, 'wb')
+                    current_fp.write(encoded)
+                    current_fp.close()
+                    chunk_files.append(write_path)
+                    event.bytes_serialized += len(encoded)
+                    event.bytes_compressed += os.path.getsize(write_path)
 
             yield stamp, chunk_files
 
@@ -296,10 +329,65 @@ class S3Mixin(object):
         paths_list.sort()
         return {"jsonpaths": paths_list}
 
+    def _merge_batch(self, table, copy_statement, primary_key=None):
+        """Return a SQL batch upserting COPYed rows into *table*.
+
+        The rows are COPYed into a temporary staging table created
+        ``LIKE`` *table*, then rows of *table* sharing a key with
+        a staged row are then deleted and the staged rows inserted.
+        Of staged rows sharing a key, only one is inserted.
+        Executed as one batch, this all happens in a single transaction.
+
+        Parameters
+        ----------
+        table : str
+            The table to merge into
+        copy_statement : callable
+            Called with the name of the staging table, returns the COPY
+            statement (or several, separated by semicolons) loading it,
+            ideally with `CopyOptions.staging`
+        primary_key : str or list of str
+            The columns identifying a row, like ``'col1, col2'``;
+            by default, the primary key of *table* is reflected
+        """
+        schema, relname = _get_schema_and_relation(table)
+        reflected = self.reflected_table(relname, schema=schema)
+        if primary_key is None:
+            primary_key = [c.name for c in reflected.primary_key.columns]
+            if not primary_key:
+                raise ValueError("%s has no primary key; pass the columns "
+                                 "identifying a row as primary_key" % table)
+        elif not isinstance(primary_key, (list, tuple)):
+            primary_key = _split_identifiers(primary_key)
+        staging = self.preparer.quote(relname + '$staging')
+        copy = copy_statement(staging).strip().rstrip(';')
+        keys = [self.preparer.quote(key) for key in primary_key]
+        matches = ' AND '.join(
+            '{0}.{1} = {2}.{1}'.format(table, key, staging) for key in keys)
+        columns = ', '.join(self.preparer.quote(c.name)
+                            for c in reflected.columns)
+        statements = [
+            'CREATE TEMP TABLE %s (LIKE %s)' % (staging, table),
+            copy,
+            'DELETE FROM %s USING %s\nWHERE %s' % (table, staging, matches),
+            'INSERT INTO %s (%s)\n'
+            'SELECT %s FROM (\n'
+            '  SELECT *, ROW_NUMBER() OVER (PARTITION BY %s) AS "$row"\n'
+            '  FROM %s) AS ranked\n'
+            'WHERE "$row" = 1' % (table, columns, columns, ', '.join(keys),
+                                  staging),
+            'DROP TABLE %s' % staging,
+        ]
+        return ';\n'.join(statements) + ';'
+
     @check_s3_connection
     def copy_json_to_table(self, bucket, keypath, data, jsonpaths, table,
                            slices=32, clean_up_s3=True, local_path=None,
-                           clean_up_local=True):
+                           clean_up_local=True, retry=None,
+                           wlm_query_group=None, wlm_slot_count=None,
+                           advisor=None, create_table=False,
+                           table_options=None, merge=False,
+                           primary_key=None, copy_options=None):
         """
         Given a list of JSON-able dicts, COPY them to the given *table_name*
 
@@ -330,7 +418,53 @@ class S3Mixin(object):
             $HOME/.shiftmanager/tmp/
         clean_up_local : bool
             Clean up local chunked JSON after COPY completes.
+        retry : `shiftmanager.retry.RetryPolicy`
+            Overrides `retry_policy` for the uploads and COPY
+        wlm_query_group : str
+            WLM query group in which to run the COPY
+        wlm_slot_count : int
+            Number of WLM slots to claim for the COPY; defaults to the
+            ``'copy'`` entry of `wlm_policy`
+        advisor : `shiftmanager.encoding.EncodingAdvisor`
+            Profile the dicts as they are staged, for compression encoding
+            recommendations
+        create_table : bool
+            Create *table* if it does not exist, with column types inferred
+            from *data* (see `shiftmanager.inference.SchemaInferrer`).
+            Nested dicts become columns named by their joined keys; if
+            *jsonpaths* is None, a matching jsonpaths file is generated
+        table_options : dict
+            Keyword arguments for creating the table, like *distkey*,
+            *sortkey* and *headroom*
+        merge : bool
+            Replace rows of *table* sharing a key with the loaded rows
+            rather than appending (see `_merge_batch`), so that updating
+            a table costs in proportion to the update
+        primary_key : str or list of str
+            The columns identifying a row when merging; by default, the
+            primary key of *table* is reflected
+        copy_options : `shiftmanager.copy_options.CopyOptions`
+            Options for the COPY, which must be for JSON data; defaults
+            to `JSON_COPY_OPTIONS`. When merging, the staging table is
+            loaded with COMPUPDATE and STATUPDATE off
         """
+        copy_options = copy_options or JSON_COPY_OPTIONS
+        if copy_options.data_format != 'json':
+            raise ValueError("copy_json_to_table needs JSON copy_options")
+        create_statement = None
+        if create_table:
+            schema, relname = _get_schema_and_relation(table)
+            if not self.table_exists(relname):
+                inferrer = SchemaInferrer()
+                for doc in data:
+                    inferrer.observe(doc)
+                if jsonpaths is None:
+                    jsonpaths = inferrer.jsonpaths()
+                inferred = inferrer.table(relname, schema=schema,
+                                          jsonpaths=jsonpaths,
+                                          **(table_options or {}))
+                create_statement = self.table_definition(
+                    inferred, copy_privileges=False)
 
         print("Fetching S3 bucket {}...".format(bucket))
         bukkit = self.get_bucket(bucket)
@@ -341,31 +475,39 @@ class S3Mixin(object):
         # Ensure S3 cleanup on failure
         try:
             with self.chunked_json_slices(data, slices, local_path,
-                                          clean_up_local) \
+                                          clean_up_local, self.listeners,
+                                          advisor) \
                     as (stamp, file_paths):
 
                 manifest = {"entries": []}
 
                 print("Writing chunks...")
-                for path in file_paths:
-                    filename = os.path.basename(path)
-                    # Strip leading slash
-                    if keypath[0] == "/":
-                        keypath = keypath[1:]
-
-                    data_keypath = os.path.join(keypath, filename)
-                    data_key = bukkit.new_key(data_keypath)
-                    s3_sweep.append(data_keypath)
-
-                    with open(path, 'rb') as f:
-                        data_key.set_contents_from_file(f)
-
-                    manifest_entry = {
-                        "url": "s3://{}/{}".format(bukkit.name, data_keypath),
-                        "mandatory": True
-                    }
-                    manifest["entries"].append(manifest_entry)
-                    data_key.close()
+                with self._instrument('phase', 'upload') as event:
+                    event.bytes_uploaded = 0
+                    for path in file_paths:
+                        filename = os.path.basename(path)
+                        # Strip leading slash
+                        if keypath[0] == "/":
+                            keypath = keypath[1:]
+
+                        data_keypath = os.path.join(keypath, filename)
+                        data_key = bukkit.new_key(data_keypath)
+                        s3_sweep.append(data_keypath)
+
+                        def upload(path=path, data_key=data_key):
+                            with open(path, 'rb') as f:
+                                data_key.set_contents_from_file(f)
+
+                        self._retry(retry).run(upload)
+                        event.bytes_uploaded += os.path.getsize(path)
+
+                        manifest_entry = {
+                            "url": "s3://{}/{}".format(bukkit.name,
+                                                       data_keypath),
+                            "mandatory": True
+                        }
+                        manifest["entries"].append(manifest_entry)
+                        data_key.close()
 
                 stamped_path = os.path.join(keypath, stamp)
 
@@ -373,7 +515,8 @@ class S3Mixin(object):
                     kpath = "".join([stamped_path, ext])
                     complete_path = "s3://{}/{}".format(bukkit.name, kpath)
                     key = bukkit.new_key(kpath)
-                    self.write_dict_to_key(single_data, key, close=True)
+                    self.write_dict_to_key(single_data, key, close=True,
+                                           retry=retry)
                     s3_sweep.append(kpath)
                     return complete_path
 
@@ -389,12 +532,27 @@ class S3Mixin(object):
             if self.security_token:
                 creds += ';token={}'.format(self.security_token)
 
-            statement = queries.copy_from_s3.format(
-                table=table, manifest_key=mfest_complete_path,
-                creds=creds, jpaths_key=jpaths_complete_path)
+            # A table created by this load has no rows to merge with
+            if merge and create_statement is None:
+                statement = self._merge_batch(
+                    table, lambda target: copy_options.staging().statement(
+                        target, mfest_complete_path, creds,
+                        jpaths_complete_path),
+                    primary_key)
+            else:
+                statement = copy_options.statement(
+                    table, mfest_complete_path, creds, jpaths_complete_path)
+            statement = wrap_batch(statement, **self._wlm_settings(
+                'copy', wlm_query_group, wlm_slot_count))
+
+            if create_statement is not None:
+                print("Creating table {}...".format(table))
+                self.execute(create_statement)
 
             print("Performing COPY...")
-            self.execute(statement)
+            with self._instrument('phase', 'copy') as event:
+                event.rowcount = len(data)
+                self.execute(statement, retry=retry)
 
         finally:
             if clean_up_s3:
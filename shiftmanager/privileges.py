@@ -31,7 +31,9 @@ The entries shown by \z are interpreted thus ::
 """
 
 
+from collections import namedtuple
 import re
+import time
 
 
 RELACL_CHARS_TO_WORDS = {
@@ -50,16 +52,53 @@ RELACL_CHARS_TO_WORDS = {
 
 WITH_GRANT_OPTION_RE = re.compile(r'[arwdRxtXUCT]\*')
 
+# A single parsed entry of an access privilege list
+AclEntry = namedtuple('AclEntry', ['grantee', 'words',
+                                   'words_with_grant_option'])
+
+# Ownership and parsed access privileges for a single relation
+Privilege = namedtuple('Privilege', ['schema', 'relname', 'rel_oid', 'type',
+                                     'owner_name', 'acl', 'fetched_at'])
+
 
 def grants_from_privileges(privileges, relation):
     """
     >>> grants_from_privileges('=r/ops\\nimporter=arwdRxt/ops', 'foo')
     ['GRANT SELECT ON foo TO PUBLIC', 'GRANT ALL ON foo TO importer']
     """
+    return grants_from_acl(parse_acl(privileges), relation)
+
+
+def parse_acl(privileges):
+    """
+    >>> acl = parse_acl('=r/ops\\ngroup finance=ar*/ops')
+    >>> [entry.grantee for entry in acl]
+    ['PUBLIC', 'GROUP finance']
+    >>> acl[1].words, acl[1].words_with_grant_option
+    (('INSERT',), ('SELECT',))
+    """
+    if not privileges:
+        return ()
+    return tuple(parse_acl_entry(entry) for entry in privileges.split('\n'))
+
+
+def parse_acl_entry(entry):
+    """
+    >>> parse_acl_entry('importer=arwdRxt/ops').words
+    ('ALL',)
+    """
+    grantee, _, rest = entry.partition('=')
+    grantee = grantee.replace('group', 'GROUP') or 'PUBLIC'
+    chars, _, grantor = rest.partition('/')
+    words, words_with_grant_option = words_from_relacl_chars(chars)
+    return AclEntry(grantee, tuple(words), tuple(words_with_grant_option))
+
+
+def grants_from_acl(acl, relation):
+    """Return GRANT statements on *relation* for parsed *acl* entries."""
     grants = []
-    if privileges:
-        for entry in privileges.split('\n'):
-            grants += grants_from_entry(entry, relation)
+    for acl_entry in acl:
+        grants += grants_from_acl_entry(acl_entry, relation)
     return grants
 
 
@@ -80,11 +119,12 @@ def grants_from_entry(entry, relation):
     >>> grants_from_entry('group finance=r/importer', 'foo')
     ['GRANT SELECT ON foo TO GROUP finance']
     """
-    grantee, _, rest = entry.partition('=')
-    grantee = grantee.replace('group', 'GROUP') or 'PUBLIC'
-    chars, _, grantor = rest.partition('/')
+    return grants_from_acl_entry(parse_acl_entry(entry), relation)
+
+
+def grants_from_acl_entry(acl_entry, relation):
+    grantee, words, words_with_grant_option = acl_entry
     grants = []
-    words, words_with_grant_option = words_from_relacl_chars(chars)
     if words:
         grant = "GRANT %s ON %s TO %s" % (', '.join(words), relation, grantee)
         grants.append(grant)
@@ -122,3 +162,53 @@ def words_from_relacl_chars(chars):
         word = RELACL_CHARS_TO_WORDS[char]
         words.append(word)
     return (words, words_with_grant_option)
+
+
+class PrivilegeCache(object):
+    """Ownership and access privileges for relations, with optional expiry.
+
+    Entries are `Privilege` tuples keyed by relation key
+    (``'schema.relation'``, or just ``'relation'`` for relations looked up
+    by an unqualified name). Populate the cache with `add`.
+
+    Parameters
+    ----------
+    ttl : float or None
+        Seconds after which an entry is considered stale;
+        None means entries never expire
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self._entries = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Return the `Privilege` for *key*, or None if missing or expired.
+
+        >>> cache = PrivilegeCache(ttl=60)
+        >>> cache.get('public.foo') is None
+        True
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if self.ttl is not None and time.time() - entry.fetched_at > self.ttl:
+            self._entries.pop(key, None)
+            return None
+        return entry
+
+    def add(self, row, keys):
+        """Store a row from a privileges query under each of *keys*."""
+        entry = Privilege(row.schema, row.relname, row.rel_oid, row.type,
+                          row.owner_name, parse_acl(row.privileges),
+                          time.time())
+        for key in keys:
+            self._entries[key] = entry
+        return entry
+
+    def clear(self):
+        """Discard all entries."""
+        self._entries = {}
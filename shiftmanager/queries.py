@@ -2,15 +2,10 @@
 Query templates for use by the Redshift class.
 """
 
-copy_from_s3 = """\
-COPY {table}
-FROM '{manifest_key}'
-CREDENTIALS '{creds}'
-JSON '{jpaths_key}'
-MANIFEST GZIP TIMEFORMAT 'auto'
-"""
-
-all_privileges = """\
+# Ownership and privileges of the relations matching a {relation_filter}
+# built from schemas, relation oids or (schema, relname) pairs; "visible"
+# marks relations which can be referred to without a schema.
+scoped_privileges = """\
 SELECT
   c.relkind,
   n.oid as "schema_oid",
@@ -20,11 +15,312 @@ SELECT
   c.relowner AS "owner_id",
   u.usename AS "owner_name",
   pg_catalog.array_to_string(c.relacl, '\n') AS "privileges",
-  CASE c.relkind WHEN 'r' THEN 'table' WHEN 'v' THEN 'view' END AS "type"
+  CASE c.relkind WHEN 'r' THEN 'table' WHEN 'v' THEN 'view' END AS "type",
+  pg_catalog.pg_table_is_visible(c.oid) AS "visible"
 FROM pg_catalog.pg_class c
      LEFT JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
      JOIN pg_catalog.pg_user u ON u.usesysid = c.relowner
 WHERE c.relkind IN ('r', 'v', 'm', 'S', 'f')
-  AND n.nspname !~ '^pg_' AND pg_catalog.pg_table_is_visible(c.oid)
+  AND n.nspname !~ '^pg_' AND ({relation_filter})
 ORDER BY c.relkind, n.oid, n.nspname;
 """
+
+# The following templates accept a {relname_filter} which is either empty
+# or restricts results to ``c.relname IN %(relnames)s``.
+
+bulk_relations = """\
+SELECT
+  n.nspname AS "schema",
+  c.oid AS "rel_oid",
+  c.relname,
+  c.relkind,
+  c.reldiststyle AS "diststyle"
+FROM pg_catalog.pg_class c
+     JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+WHERE c.relkind IN ('r', 'v')
+  AND n.nspname IN %(schemas)s
+  {relname_filter}
+ORDER BY n.nspname, c.relname;
+"""
+
+bulk_columns = """\
+SELECT
+  n.nspname AS "schema",
+  c.relname,
+  a.attnum,
+  a.attname,
+  pg_catalog.format_type(a.atttypid, a.atttypmod) AS "type",
+  format_encoding(a.attencodingtype::integer) AS "encoding",
+  a.attisdistkey AS "distkey",
+  a.attsortkeyord AS "sortkey",
+  a.attnotnull AS "notnull",
+  pg_catalog.pg_get_expr(ad.adbin, ad.adrelid) AS "default"
+FROM pg_catalog.pg_attribute a
+     JOIN pg_catalog.pg_class c ON c.oid = a.attrelid
+     JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+     LEFT JOIN pg_catalog.pg_attrdef ad
+       ON ad.adrelid = a.attrelid AND ad.adnum = a.attnum
+WHERE a.attnum > 0 AND NOT a.attisdropped
+  AND c.relkind IN ('r', 'v')
+  AND n.nspname IN %(schemas)s
+  {relname_filter}
+ORDER BY n.nspname, c.relname, a.attnum;
+"""
+
+bulk_constraints = """\
+SELECT
+  n.nspname AS "schema",
+  c.relname,
+  t.conname,
+  t.contype,
+  pg_catalog.pg_get_constraintdef(t.oid, true) AS "condef"
+FROM pg_catalog.pg_constraint t
+     JOIN pg_catalog.pg_class c ON c.oid = t.conrelid
+     JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+WHERE t.contype IN ('p', 'u', 'f')
+  AND n.nspname IN %(schemas)s
+  {relname_filter}
+ORDER BY n.nspname, c.relname, t.conname;
+"""
+
+bulk_view_definitions = """\
+SELECT
+  n.nspname AS "schema",
+  c.relname,
+  TRIM(TRAILING ';' FROM pg_catalog.pg_get_viewdef(c.oid, true))
+    AS "definition"
+FROM pg_catalog.pg_class c
+     JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+WHERE c.relkind = 'v'
+  AND n.nspname IN %(schemas)s
+  {relname_filter}
+ORDER BY n.nspname, c.relname;
+"""
+
+# Relations referenced by each view, via the view's rewrite rule
+view_dependencies = """\
+SELECT DISTINCT
+  vn.nspname AS "schema",
+  c.relname,
+  dn.nspname AS "dependency_schema",
+  d.relname AS "dependency_relname"
+FROM pg_catalog.pg_depend dep
+     JOIN pg_catalog.pg_rewrite r ON r.oid = dep.objid
+     JOIN pg_catalog.pg_class c ON c.oid = r.ev_class
+     JOIN pg_catalog.pg_namespace vn ON vn.oid = c.relnamespace
+     JOIN pg_catalog.pg_class d ON d.oid = dep.refobjid
+     JOIN pg_catalog.pg_namespace dn ON dn.oid = d.relnamespace
+WHERE dep.classid = 'pg_catalog.pg_rewrite'::regclass
+  AND dep.refclassid = 'pg_catalog.pg_class'::regclass
+  AND c.relkind = 'v'
+  AND d.oid <> c.oid
+  AND vn.nspname IN %(schemas)s
+  {relname_filter}
+ORDER BY 1, 2, 3, 4;
+"""
+
+# Every view-to-relation dependency in the database, for finding
+# views that transitively depend on a table
+all_view_dependencies = """\
+SELECT DISTINCT
+  vn.nspname AS "schema",
+  c.relname,
+  dn.nspname AS "dependency_schema",
+  d.relname AS "dependency_relname"
+FROM pg_catalog.pg_depend dep
+     JOIN pg_catalog.pg_rewrite r ON r.oid = dep.objid
+     JOIN pg_catalog.pg_class c ON c.oid = r.ev_class
+     JOIN pg_catalog.pg_namespace vn ON vn.oid = c.relnamespace
+     JOIN pg_catalog.pg_class d ON d.oid = dep.refobjid
+     JOIN pg_catalog.pg_namespace dn ON dn.oid = d.relnamespace
+WHERE dep.classid = 'pg_catalog.pg_rewrite'::regclass
+  AND dep.refclassid = 'pg_catalog.pg_class'::regclass
+  AND c.relkind = 'v'
+  AND d.oid <> c.oid
+  AND vn.nspname !~ '^pg_'
+ORDER BY 1, 2, 3, 4;
+"""
+
+# View definitions along with the relations each view references;
+# views without dependencies have a single row with NULL dependency columns
+views_with_dependencies = """\
+SELECT DISTINCT
+  n.nspname AS "schema",
+  c.relname,
+  TRIM(TRAILING ';' FROM pg_catalog.pg_get_viewdef(c.oid, true))
+    AS "definition",
+  dn.nspname AS "dependency_schema",
+  d.relname AS "dependency_relname"
+FROM pg_catalog.pg_class c
+     JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+     LEFT JOIN pg_catalog.pg_rewrite r ON r.ev_class = c.oid
+     LEFT JOIN pg_catalog.pg_depend dep
+       ON dep.objid = r.oid
+      AND dep.classid = 'pg_catalog.pg_rewrite'::regclass
+      AND dep.refclassid = 'pg_catalog.pg_class'::regclass
+      AND dep.refobjid <> c.oid
+     LEFT JOIN pg_catalog.pg_class d ON d.oid = dep.refobjid
+     LEFT JOIN pg_catalog.pg_namespace dn ON dn.oid = d.relnamespace
+WHERE c.relkind = 'v'
+  AND n.nspname IN %(schemas)s
+  {relname_filter}
+ORDER BY 1, 2, 4, 5;
+"""
+
+# Cheap per-relation attributes for validating cached reflection results,
+# including a digest of each column's name, type, encoding and keys;
+# the leading columns match those of scoped_privileges, so that rows
+# double as privilege rows
+relation_fingerprints = """\
+SELECT
+  c.relkind,
+  n.oid as "schema_oid",
+  n.nspname as "schema",
+  c.oid as "rel_oid",
+  c.relname,
+  c.relowner AS "owner_id",
+  u.usename AS "owner_name",
+  pg_catalog.array_to_string(c.relacl, '\n') AS "privileges",
+  CASE c.relkind WHEN 'r' THEN 'table' WHEN 'v' THEN 'view' END AS "type",
+  c.relnatts,
+  c.reldiststyle AS "diststyle",
+  pg_catalog.md5(pg_catalog.array_to_string(ARRAY(
+    SELECT a.attname || ' ' ||
+      pg_catalog.format_type(a.atttypid, a.atttypmod) || ' ' ||
+      CAST(a.attencodingtype AS VARCHAR) || ' ' ||
+      CASE WHEN a.attisdistkey THEN 'distkey' ELSE '' END || ' ' ||
+      CAST(a.attsortkeyord AS VARCHAR)
+    FROM pg_catalog.pg_attribute a
+    WHERE a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+    ORDER BY a.attnum), '\n')) AS "columns"
+FROM pg_catalog.pg_class c
+     JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+     JOIN pg_catalog.pg_user u ON u.usesysid = c.relowner
+WHERE c.relkind IN ('r', 'v')
+  AND n.nspname IN %(schemas)s
+  {relname_filter}
+ORDER BY n.nspname, c.relname;
+"""
+
+# Per-table health from svv_table_info, for planning maintenance
+table_maintenance_stats = """\
+SELECT
+  "schema",
+  "table",
+  table_id,
+  size AS "size_mb",
+  tbl_rows,
+  estimated_visible_rows,
+  COALESCE(unsorted, 0) AS "unsorted",
+  COALESCE(stats_off, 0) AS "stats_off",
+  COALESCE(skew_rows, 1) AS "skew_rows",
+  sortkey1
+FROM svv_table_info
+WHERE "schema" IN %(schemas)s
+ORDER BY "schema", "table";
+"""
+
+# Columns of a Postgres table, for inferring Redshift types
+pg_table_columns = """\
+SELECT column_name, data_type, numeric_precision, numeric_scale
+FROM information_schema.columns
+WHERE table_schema = %(schema)s
+  AND table_name = %(table)s
+ORDER BY ordinal_position;
+"""
+
+# Distribution and size of every user table, for the key advisor
+table_key_stats = """\
+SELECT
+  "schema",
+  "table",
+  table_id,
+  diststyle,
+  sortkey1,
+  size AS "size_mb",
+  tbl_rows,
+  COALESCE(skew_rows, 1) AS "skew_rows"
+FROM svv_table_info
+ORDER BY "schema", "table";
+"""
+
+# Columns of the ordinary tables in a set of schemas
+table_columns = """\
+SELECT n.nspname AS "schema", c.relname, a.attname
+FROM pg_catalog.pg_attribute a
+JOIN pg_catalog.pg_class c ON c.oid = a.attrelid
+JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+WHERE n.nspname IN %(schemas)s
+  AND c.relkind = 'r'
+  AND a.attnum > 0
+  AND NOT a.attisdropped;
+"""
+
+# Plan nodes of recent user queries
+workload_explain = """\
+SELECT e.query, e.nodeid, e.parentid, TRIM(e.plannode), TRIM(e.info)
+FROM stl_explain e
+JOIN stl_query q ON q.query = e.query
+WHERE q.userid > 1
+  AND q.starttime >= DATEADD(day, -%(days)s, GETDATE())
+ORDER BY e.query, e.nodeid;
+"""
+
+# Rows read from each user table by recent queries, before and after
+# filtering
+workload_scans = """\
+SELECT
+  s.query,
+  s.tbl,
+  TRIM(s.perm_table_name),
+  SUM(s.rows_pre_filter),
+  SUM(s.rows)
+FROM stl_scan s
+JOIN stl_query q ON q.query = s.query
+WHERE q.userid > 1
+  AND s.type = 2
+  AND q.starttime >= DATEADD(day, -%(days)s, GETDATE())
+GROUP BY s.query, s.tbl, TRIM(s.perm_table_name);
+"""
+
+# Bytes broadcast or redistributed between slices by recent queries
+workload_redistribution = """\
+SELECT s.query, SUM(s.bytes)
+FROM svl_query_summary s
+JOIN stl_query q ON q.query = s.query
+WHERE q.userid > 1
+  AND (s.label LIKE 'bcast%%' OR s.label LIKE 'dist%%')
+  AND q.starttime >= DATEADD(day, -%(days)s, GETDATE())
+GROUP BY s.query;
+"""
+
+# Number of 1 MB blocks each slice stores for a set of tables
+slice_blocks = """\
+SELECT tbl, slice, COUNT(*)
+FROM stv_blocklist
+WHERE tbl IN %(table_ids)s
+GROUP BY tbl, slice;
+"""
+
+# Number of slices in the cluster
+slice_count = """\
+SELECT COUNT(*) FROM stv_slices;
+"""
+
+# Disk capacity and usage across the cluster, in 1 MB blocks
+cluster_disk_space = """\
+SELECT SUM(capacity), SUM(used)
+FROM stv_partitions
+WHERE part_begin = 0 AND failed = 0;
+"""
+
+# Users and groups, with their settings and members, in one round trip
+users_and_groups = """\
+SELECT 'user', usename, usesysid, usecreatedb, usesuper, valuntil,
+  pg_catalog.array_to_string(useconfig, '\n')
+FROM pg_catalog.pg_user
+UNION ALL
+SELECT 'group', groname, grosysid, NULL, NULL, NULL,
+  pg_catalog.array_to_string(grolist, ',')
+FROM pg_catalog.pg_group;
+"""
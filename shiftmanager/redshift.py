@@ -6,16 +6,39 @@ and utility functions for managing that database.
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
+from collections import OrderedDict
+from contextlib import contextmanager
 import os
+import uuid
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
 
 import psycopg2
 
-from shiftmanager.mixins import (AdminMixin, ReflectionMixin, PostgresMixin,
-                                 S3Mixin)
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from shiftmanager.instrumentation import instrumented
+from shiftmanager.mixins import (AdminMixin, AdvisorMixin,
+                                 CompressionMixin, MaintenanceMixin,
+                                 MigrationMixin, ReflectionMixin,
+                                 PostgresMixin, S3Mixin)
 from shiftmanager.memoized_property import memoized_property
+from shiftmanager.privileges import PrivilegeCache
+from shiftmanager.retry import RetryPolicy, is_connection_error
+from shiftmanager.wlm import wlm_statements
 
+# Redshift rejects any single statement larger than 16 MB
+MAX_STATEMENT_BYTES = 16 * 1024 * 1024
 
-class Redshift(AdminMixin, ReflectionMixin, PostgresMixin, S3Mixin):
+
+class Redshift(AdminMixin, AdvisorMixin, CompressionMixin, MaintenanceMixin,
+               MigrationMixin, ReflectionMixin, PostgresMixin, S3Mixin):
     """Interface to Redshift.
 
     This class will default to environment params for all arguments.
@@ -42,6 +65,19 @@ class Redshift(AdminMixin, ReflectionMixin, PostgresMixin, S3Mixin):
         envvar equivalent: AWS_SECRET_ACCESS_KEY
     security_token : str
         envvar equivalent: AWS_SECURITY_TOKEN or AWS_SESSION_TOKEN
+    retry_policy : `shiftmanager.retry.RetryPolicy`
+        Default policy for retrying transient Redshift and S3 failures;
+        individual calls can override it with a *retry* argument
+    wlm_policy : dict
+        Maps operation names (``'deep_copy'``, ``'copy'``,
+        ``'analyze_compression'``) to default WLM settings like
+        ``{'slot_count': 3, 'query_group': 'maintenance'}``;
+        see `shiftmanager.wlm.DEFAULT_WLM_POLICY`
+    reflection_cache : `shiftmanager.cache.ReflectionCache`
+        Persistent cache consulted by `reflected_tables`
+    privilege_ttl : float
+        Seconds after which cached ownership and privileges are refetched;
+        by default they are kept until `refresh_privileges` is called
     """
 
     @memoized_property
@@ -50,6 +86,12 @@ class Redshift(AdminMixin, ReflectionMixin, PostgresMixin, S3Mixin):
 
         Instantiation is delayed until the object is first used.
         """
+        return self.create_connection()
+
+    def create_connection(self):
+        """Return a new `psycopg2.connect` connection to Redshift,
+        separate from `connection`, for work done in parallel.
+        """
         print("Connecting to %s..." % self.host)
         return psycopg2.connect(user=self.user,
                                 host=self.host,
@@ -61,7 +103,11 @@ class Redshift(AdminMixin, ReflectionMixin, PostgresMixin, S3Mixin):
                  port=5439,
                  aws_access_key_id=None,
                  aws_secret_access_key=None,
-                 security_token=None):
+                 security_token=None,
+                 retry_policy=None,
+                 wlm_policy=None,
+                 reflection_cache=None,
+                 privilege_ttl=None):
 
         self.set_aws_credentials(aws_access_key_id, aws_secret_access_key,
                                  security_token)
@@ -72,15 +118,110 @@ class Redshift(AdminMixin, ReflectionMixin, PostgresMixin, S3Mixin):
         self.database = database or os.environ.get('PGDATABASE')
         self.password = password or os.environ.get('PGPASSWORD')
 
-        self._all_privileges = None
+        self.privilege_cache = PrivilegeCache(ttl=privilege_ttl)
+        self.encoding_cache = {}
+        self.workload_cache = {}
+        self.listeners = []
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.wlm_policy = wlm_policy or {}
+        self.reflection_cache = reflection_cache
 
         S3Mixin.__init__(self)
 
-    def execute(self, batch, parameters=None):
+    def add_listener(self, listener):
+        """
+        Register *listener* to receive instrumentation events.
+
+        Parameters
+        ----------
+        listener : callable
+            Called with a `shiftmanager.instrumentation.Event` after
+            each statement and each loader phase completes;
+            see `shiftmanager.instrumentation` for ready-made listeners.
+        """
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        """Stop sending instrumentation events to *listener*."""
+        self.listeners.remove(listener)
+
+    def _instrument(self, kind, name, statement=None):
+        return instrumented(self.listeners, kind, name, statement)
+
+    def _retry(self, retry):
+        return retry if retry is not None else self.retry_policy
+
+    def _reset_connection(self):
+        """Discard the memoized connection so the next use reconnects."""
+        conn = getattr(self, '_connection', None)
+        if conn is None:
+            return
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+        del self._connection
+        if hasattr(self, '_engine'):
+            self._engine.dispose()
+
+    def _ensure_connection(self):
+        conn = getattr(self, '_connection', None)
+        if conn is not None and conn.closed:
+            self._reset_connection()
+
+    def _on_retry(self, error, attempt):
+        if is_connection_error(error):
+            self._reset_connection()
+
+    @contextmanager
+    def wlm(self, query_group=None, slot_count=None):
+        """
+        Context manager applying WLM settings to this session.
+
+        The settings are reset when the context exits::
+
+            with redshift.wlm(query_group='maintenance', slot_count=5):
+                redshift.execute(batch)
+
+        Parameters
+        ----------
+        query_group : str
+            Query group label used to route queries to a WLM queue
+        slot_count : int
+            Number of WLM query slots to claim for each query
+        """
+        setup, teardown = wlm_statements(query_group, slot_count)
+        if setup:
+            self.execute(';\n'.join(setup))
+        try:
+            yield
+        finally:
+            if teardown:
+                self.execute(';\n'.join(teardown))
+
+    def _wlm_settings(self, operation, query_group=None, slot_count=None):
+        """Merge explicit WLM settings over the policy for *operation*."""
+        settings = dict(self.wlm_policy.get(operation, {}))
+        if query_group is not None:
+            settings['query_group'] = query_group
+        if slot_count is not None:
+            settings['slot_count'] = slot_count
+        return settings
+
+    def _record_query_id(self, cursor, event):
+        # Only pay for the extra query when someone is listening
+        if self.listeners:
+            cursor.execute("SELECT pg_last_query_id()")
+            row = cursor.fetchone()
+            event.query_id = row[0] if row else None
+
+    def execute(self, batch, parameters=None, retry=None, autocommit=False):
         """
         Execute a batch of SQL statements using this instance's connection.
 
-        Statements are executed within a transaction.
+        Statements are executed within a transaction. If the transaction
+        fails with a transient error, it is retried in full, reconnecting
+        first if the connection was lost.
 
         Parameters
         ----------
@@ -88,10 +229,100 @@ class Redshift(AdminMixin, ReflectionMixin, PostgresMixin, S3Mixin):
             The batch of SQL statements to execute.
         parameters : list or dict
             Values to bind to the batch, passed to `cursor.execute`
+        retry : `shiftmanager.retry.RetryPolicy`
+            Overrides `retry_policy` for this call;
+            pass `shiftmanager.retry.NO_RETRY` to disable retries
+        autocommit : bool
+            Send the batch with the connection in autocommit mode rather
+            than inside an explicit transaction, as required by commands
+            like VACUUM and ALTER TABLE APPEND. Such commands must be
+            the only statement in *batch*.
         """
-        with self.connection as conn:
+        def run(conn, event):
             with conn.cursor() as cur:
                 cur.execute(batch, parameters)
+                event.rowcount = cur.rowcount
+                self._record_query_id(cur, event)
+
+        def attempt():
+            self._ensure_connection()
+            with self._instrument('statement', 'execute', batch) as event:
+                if autocommit:
+                    conn = self.connection
+                    conn.autocommit = True
+                    try:
+                        run(conn, event)
+                    finally:
+                        conn.autocommit = False
+                else:
+                    with self.connection as conn:
+                        run(conn, event)
+
+        self._retry(retry).run(attempt, on_retry=self._on_retry)
+
+    def execute_values(self, statement, argslist, template=None,
+                       page_size=1000,
+                       max_statement_bytes=MAX_STATEMENT_BYTES,
+                       retry=None):
+        """
+        Execute *statement* once per page of parameter sets in *argslist*.
+
+        Rather than one round trip per parameter set, rows are rendered
+        locally and grouped into multi-row ``VALUES`` lists, in the manner
+        of `psycopg2.extras.execute_values`. All pages are executed within
+        a single transaction.
+
+        Parameters
+        ----------
+        statement : str
+            A statement containing a single ``%s`` placeholder where the
+            ``VALUES`` list belongs, like
+            ``'INSERT INTO my_table (a, b) VALUES %s'``.
+        argslist : iterable of sequences or dicts
+            Parameter sets to be rendered into *template*.
+        template : str
+            A template for a single row, like ``'(%s, %s)'`` or
+            ``'(%(a)s, %(b)s)'``. Defaults to one positional placeholder
+            per item in the first parameter set; required for dicts.
+        page_size : int
+            Maximum number of rows in a single statement.
+        max_statement_bytes : int
+            Maximum size of a single rendered statement; pages are cut
+            short rather than exceed Redshift's statement size limit.
+        retry : `shiftmanager.retry.RetryPolicy`
+            Overrides `retry_policy` for this call. A retry reruns the
+            whole transaction, so an *argslist* that isn't a list or tuple
+            is first read into a list.
+
+        Returns
+        -------
+        int
+            Total number of rows affected
+        """
+        # A one-shot iterator would be exhausted by a failed attempt
+        if not isinstance(argslist, (list, tuple)):
+            argslist = list(argslist)
+        if template is None and argslist:
+            template = _default_template(argslist[0])
+
+        def attempt():
+            self._ensure_connection()
+            rowcount = 0
+            with self.connection as conn:
+                with conn.cursor() as cur:
+                    for page in _values_pages(cur, statement, argslist,
+                                              template, page_size,
+                                              max_statement_bytes):
+                        with self._instrument('statement', 'execute_values',
+                                              statement) as event:
+                            cur.execute(page)
+                            event.rowcount = cur.rowcount
+                            event.bytes_serialized = len(page)
+                            self._record_query_id(cur, event)
+                        rowcount += max(event.rowcount, 0)
+            return rowcount
+
+        return self._retry(retry).run(attempt, on_retry=self._on_retry)
 
     def mogrify(self, batch, parameters=None, execute=False):
         if execute:
@@ -101,6 +332,69 @@ class Redshift(AdminMixin, ReflectionMixin, PostgresMixin, S3Mixin):
                 mogrified = cur.mogrify(batch, parameters)
         return mogrified.decode('utf-8')
 
+    def iter_query(self, sql, parameters=None, batch_size=10000,
+                   columnar=False, use_numpy=None):
+        """
+        Yield the results of *sql* without loading them all into memory.
+
+        Results are read through a named (server-side) cursor, so only
+        *batch_size* rows are held on the client at any time. The cursor
+        lives inside a transaction on its own connection from
+        `create_connection`, so other calls on this object can be made
+        while the results are consumed; the connection is closed once
+        the generator is exhausted or discarded.
+
+        Parameters
+        ----------
+        sql : str
+            The query to run.
+        parameters : list or dict
+            Values to bind to the query, passed to `cursor.execute`
+        batch_size : int
+            Number of rows fetched from the server per network round trip.
+        columnar : bool
+            If True, yield one `OrderedDict` per batch mapping column names
+            to that batch's values rather than yielding individual rows.
+        use_numpy : bool or None
+            Convert columnar batches to NumPy arrays. Defaults to True
+            when NumPy is installed; ignored unless *columnar* is True.
+
+        Yields
+        ------
+        tuple, or `OrderedDict` of lists or arrays if *columnar* is True
+        """
+        if use_numpy is None:
+            use_numpy = np is not None
+        if use_numpy and np is None:
+            raise ImportError("use_numpy=True requires NumPy to be installed")
+        cursor_name = 'shiftmanager_%s' % uuid.uuid4().hex
+        # Committing the shared connection would invalidate the cursor
+        conn = self.create_connection()
+        try:
+            with conn:
+                with conn.cursor(cursor_name) as cur:
+                    cur.itersize = batch_size
+                    with self._instrument('statement', 'iter_query', sql):
+                        cur.execute(sql, parameters)
+                    while True:
+                        rows = cur.fetchmany(batch_size)
+                        if not rows:
+                            break
+                        if not columnar:
+                            for row in rows:
+                                yield row
+                            continue
+                        names = [col[0] for col in cur.description]
+                        batch = OrderedDict()
+                        for name, values in zip(names, zip(*rows)):
+                            if use_numpy:
+                                batch[name] = np.array(values)
+                            else:
+                                batch[name] = list(values)
+                        yield batch
+        finally:
+            conn.close()
+
     def table_exists(self, table_name):
         """
         Check Redshift for whether a table exists.
@@ -123,3 +417,42 @@ class Redshift(AdminMixin, ReflectionMixin, PostgresMixin, S3Mixin):
                 table_count = cur.fetchone()[0]
 
         return table_count == 1
+
+
+def _default_template(args):
+    """Return a row template with a placeholder per item of *args*.
+
+    >>> print(_default_template((1, 'a')))
+    (%s, %s)
+    """
+    if isinstance(args, Mapping):
+        # Key order needn't match the statement's column order
+        raise ValueError("Rows given as dicts need an explicit template, "
+                         "like '(%(a)s, %(b)s)'")
+    return '(%s)' % ', '.join(['%s'] * len(args))
+
+
+def _values_pages(cursor, statement, argslist, template,
+                  page_size, max_statement_bytes):
+    """Yield rendered statements, each holding a page of *argslist*."""
+    parts = statement.split('%s')
+    if len(parts) != 2:
+        raise ValueError("statement must contain exactly one '%s' "
+                         "placeholder for the VALUES list")
+    prefix, suffix = [part.encode('utf-8') for part in parts]
+    overhead = len(prefix) + len(suffix)
+    page, page_bytes = [], overhead
+    for args in argslist:
+        value = cursor.mogrify(template, args)
+        if overhead + len(value) > max_statement_bytes:
+            raise ValueError("A single row renders to more than "
+                             "max_statement_bytes")
+        # Account for the comma separating this value from the last
+        if page and (len(page) >= page_size or
+                     page_bytes + len(value) + 1 > max_statement_bytes):
+            yield prefix + b','.join(page) + suffix
+            page, page_bytes = [], overhead
+        page_bytes += len(value) + (1 if page else 0)
+        page.append(value)
+    if page:
+        yield prefix + b','.join(page) + suffix
@@ -0,0 +1,156 @@
+"""
+Retry transient Redshift and S3 failures with exponential backoff.
+
+Errors are classified as retriable when they indicate contention or
+a flaky network rather than a problem with the request itself:
+
+* dropped or refused connections to Redshift
+* serializable isolation violations (Redshift error 1023)
+* queries cancelled by WLM timeouts or queue rules
+* S3 throttling (503 SlowDown) and internal errors
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import random
+import socket
+import time
+
+from boto.exception import BotoServerError
+import psycopg2
+
+# Substrings of Redshift error messages which indicate a transient failure
+RETRIABLE_MESSAGES = (
+    'serializable isolation violation',
+    'server closed the connection unexpectedly',
+    'could not connect to server',
+    'connection already closed',
+    'terminating connection',
+    'ssl syscall error',
+    'cancelled by wlm',
+    'wlm timeout',
+    'query cancelled due to wlm',
+)
+
+# SQLSTATE codes which indicate a transient failure
+RETRIABLE_PGCODES = (
+    '40001',  # serialization_failure
+    '40P01',  # deadlock_detected
+    '57P01',  # admin_shutdown
+    '08000',  # connection_exception
+    '08003',  # connection_does_not_exist
+    '08006',  # connection_failure
+)
+
+# S3 status codes and error codes which indicate a transient failure
+RETRIABLE_S3_STATUSES = (500, 502, 503, 504)
+RETRIABLE_S3_CODES = ('SlowDown', 'InternalError', 'RequestTimeout',
+                      'ServiceUnavailable')
+
+
+def is_connection_error(error):
+    """Return True if *error* means the database connection is unusable."""
+    return isinstance(error, (psycopg2.OperationalError,
+                              psycopg2.InterfaceError))
+
+
+def is_retriable(error):
+    """Return True if *error* is likely to succeed when retried.
+
+    >>> is_retriable(psycopg2.InternalError(
+    ...     '1023 DETAIL: Serializable isolation violation on table'))
+    True
+    >>> is_retriable(psycopg2.ProgrammingError('syntax error at or near'))
+    False
+    """
+    if isinstance(error, BotoServerError):
+        return (error.status in RETRIABLE_S3_STATUSES or
+                error.error_code in RETRIABLE_S3_CODES)
+    if isinstance(error, socket.timeout):
+        return True
+    if isinstance(error, psycopg2.Error):
+        if getattr(error, 'pgcode', None) in RETRIABLE_PGCODES:
+            return True
+        message = str(error).lower()
+        if any(m in message for m in RETRIABLE_MESSAGES):
+            return True
+        # Anything that leaves us without a connection is worth a reconnect,
+        # but a statement timeout on a healthy connection is not transient.
+        if isinstance(error, psycopg2.extensions.QueryCanceledError):
+            return False
+        return is_connection_error(error)
+    return False
+
+
+class RetryPolicy(object):
+    """How many times, and how patiently, to retry transient failures.
+
+    Delays grow exponentially from *base_delay* up to *max_delay*.
+    With *jitter* enabled, each delay is drawn uniformly between zero
+    and that bound so that contending clients spread out their retries.
+
+    Parameters
+    ----------
+    max_attempts : int
+        Total number of attempts, including the first; 1 disables retries
+    base_delay : float
+        Seconds to wait (before jitter) after the first failure
+    max_delay : float
+        Upper bound in seconds on any single wait
+    jitter : bool
+        Randomize delays
+    classifier : callable
+        Takes an exception and returns True if it should be retried;
+        defaults to `is_retriable`
+    """
+
+    def __init__(self, max_attempts=4, base_delay=1.0, max_delay=60.0,
+                 jitter=True, classifier=None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.classifier = classifier or is_retriable
+
+    def backoff(self, attempt):
+        """Return the number of seconds to wait after failed *attempt*.
+
+        >>> policy = RetryPolicy(base_delay=1, max_delay=5, jitter=False)
+        >>> [policy.backoff(n) for n in range(1, 5)]
+        [1, 2, 4, 5]
+        """
+        bound = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        if self.jitter:
+            return random.uniform(0, bound)
+        return bound
+
+    def run(self, func, on_retry=None):
+        """Call *func* until it succeeds or a fatal error is raised.
+
+        Parameters
+        ----------
+        func : callable
+            Called with no arguments
+        on_retry : callable
+            Called with the exception and attempt number before each retry,
+            for example to reestablish a connection
+        """
+        attempt = 1
+        while True:
+            try:
+                return func()
+            except Exception as e:
+                if attempt >= self.max_attempts or not self.classifier(e):
+                    raise
+                delay = self.backoff(attempt)
+                print("Transient error on attempt %d, retrying in %.1fs: %s"
+                      % (attempt, delay, str(e).strip()))
+                if on_retry is not None:
+                    on_retry(e, attempt)
+                time.sleep(delay)
+                attempt += 1
+
+
+# Policy for callers who want exactly one attempt
+NO_RETRY = RetryPolicy(max_attempts=1)
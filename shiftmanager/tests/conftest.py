@@ -25,10 +25,15 @@ def mock_connection():
             self.statements = []
             self.return_rows = []
             self.cursor_position = 0
+            self.description = []
+            self.rowcount = -1
 
         def execute(self, statement, *args, **kwargs):
             self.statements.append(statement)
 
+        def mogrify(self, statement, parameters=None):
+            return mogrify(None, statement, parameters).encode('utf-8')
+
         def fetchone(self, *args, **kwargs):
             if self.cursor_position > len(self.return_rows) - 1:
                 return None
@@ -37,6 +42,14 @@ def mock_connection():
                 self.cursor_position += 1
                 return next_row
 
+        def fetchmany(self, size, *args, **kwargs):
+            start = self.cursor_position
+            self.cursor_position = min(start + size, len(self.return_rows))
+            return self.return_rows[start:self.cursor_position]
+
+        def fetchall(self, *args, **kwargs):
+            return self.fetchmany(len(self.return_rows))
+
         def __enter__(self, *args, **kwargs):
             return self
 
@@ -98,9 +111,9 @@ def mogrify(self, batch, parameters=None, execute=False):
             (key, psycopg2.extensions.adapt(val).getquoted().decode('utf-8'))
             for key, val in parameters.items()])
     elif isinstance(parameters, collections.Sequence):
-        parameters = [
-            psycopg2.extensions.adapt(val).getquoted()
-            for val in parameters]
+        parameters = tuple([
+            psycopg2.extensions.adapt(val).getquoted().decode('utf-8')
+            for val in parameters])
     if parameters:
         return batch % parameters
     return batch
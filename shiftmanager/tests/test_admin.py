@@ -37,3 +37,53 @@ def test_create_user(shift):
 def test_alter_user(shift):
     statement = shift.alter_user("swiper", password="swiperpass")
     assert statement == "ALTER USER swiper PASSWORD 'swiperpass'"
+
+
+def test_provisioning_batch(shift, monkeypatch):
+    from mock import Mock
+
+    rows = [
+        ('user', 'rdsdb', 1, True, True, 'infinity', None),
+        ('user', 'ann', 100, False, False, '2015-01-01 00:00:00+00',
+         'wlm_query_slot_count=2\nsearch_path=etl'),
+        ('user', 'carl', 101, False, False, None, None),
+        ('group', 'analysts', 10, None, None, None, '100,101'),
+        ('group', 'legacy', 11, None, None, None, ''),
+    ]
+    monkeypatch.setattr(shift.engine, 'execute', Mock(
+        return_value=Mock(fetchall=Mock(return_value=rows))))
+    batch = shift.provisioning_batch({
+        'ann': {'groups': ['analysts', 'etl'], 'wlm_query_slot_count': 3,
+                'search_path': 'etl',
+                'valid_until': datetime.datetime(2015, 1, 1)},
+        'bob': {'password': "it's", 'createdb': True, 'groups': ['etl'],
+                'valid_until': datetime.datetime(2020, 6, 1)},
+        'carl': {'groups': ['analysts'], 'createdb': False},
+    }, drop_users=True, drop_groups=True)
+    assert shift.engine.execute.call_count == 1
+    assert batch == (
+        "CREATE GROUP etl;\n"
+        "ALTER USER ann SET wlm_query_slot_count = 3;\n"
+        "CREATE USER bob CREATEDB PASSWORD 'it''s' "
+        "VALID UNTIL '2020-06-01 00:00:00';\n"
+        "ALTER GROUP etl ADD USER ann, bob;\n"
+        "DROP GROUP legacy;"
+    )
+
+    # Once in line with the spec, nothing is left to do
+    assert shift.provisioning_batch(
+        {'carl': {'groups': ['analysts']}},
+        current=({'carl': shift.user_state()[0]['carl']},
+                 {'analysts': set(['carl'])})) == ''
+
+
+def test_provisioning_batch_same_valid_until(shift):
+    from shiftmanager.mixins.admin import UserState
+
+    current = UserState('ann', False, False, '2018-01-01 00:00:00+00', {},
+                        set())
+    for valid_until in ('2018-01-01', '2018-01-01 00:00:00',
+                        datetime.datetime(2018, 1, 1)):
+        assert shift.provisioning_batch(
+            {'ann': {'valid_until': valid_until}},
+            current=({'ann': current}, {})) == ''
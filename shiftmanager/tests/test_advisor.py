@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for AdvisorMixin
+
+Test Runner: PyTest
+"""
+
+import datetime
+
+from mock import Mock
+import sqlalchemy as sa
+
+from shiftmanager import queries
+from shiftmanager.mixins.advisor import TableKeyStats, Workload
+
+MB = 1024 * 1024
+
+
+def workload():
+    tables = [
+        TableKeyStats('public', 'sales', 1, 'KEY(saleid)', None,
+                      10000, 100000000, 1.0),
+        TableKeyStats('public', 'listing', 2, 'EVEN', 'listid',
+                      100, 1000000, 1.0),
+    ]
+    columns = [('public', 'sales', name)
+               for name in ('saleid', 'listid', 'saletime', 'qtysold')]
+    columns += [('public', 'listing', 'listid'),
+                ('public', 'listing', 'price')]
+    explain = [
+        (100, 1, 0, 'XN Hash Join DS_BCAST_INNER  (cost=0.00..1.00)',
+         'Hash Cond: ("outer".listid = "inner".listid)'),
+        (100, 2, 1, 'XN Seq Scan on sales  (cost=0.00..1.00)',
+         "Filter: ((saletime >= '2008-01-01 00:00:00'::timestamp "
+         "without time zone) AND (qtysold = 2))"),
+        (100, 3, 1, 'XN Hash  (cost=0.00..1.00)', ''),
+        (100, 4, 3, 'XN Seq Scan on listing l  (cost=0.00..1.00)', ''),
+        (101, 1, 0, 'XN Hash Join DS_DIST_INNER  (cost=0.00..1.00)',
+         'Hash Cond: (("outer".listid)::bigint = ("inner".listid)::bigint)'),
+        (101, 2, 1, 'XN Seq Scan on sales s  (cost=0.00..1.00)', ''),
+        (101, 3, 1, 'XN Hash  (cost=0.00..1.00)', ''),
+        (101, 4, 3, 'XN Seq Scan on listing  (cost=0.00..1.00)', ''),
+    ]
+    scans = [
+        (100, 1, 'sales', 1000000, 100000),
+        (100, 2, 'listing', 1000, 1000),
+        (101, 1, 'sales', 1000000, 1000000),
+        (101, 2, 'listing', 1000, 1000),
+    ]
+    redistribution = {100: 200 * MB, 101: 1000 * MB}
+    return Workload(tables, columns, explain, scans, redistribution, 1,
+                    datetime.datetime.utcnow())
+
+
+def test_key_recommendations(shift):
+    plan = shift.key_recommendations(workload=workload())
+    assert [(r.table, r.diststyle, r.distkey, r.sortkey) for r in plan] == [
+        ('sales', 'KEY', 'listid', ['saletime', 'qtysold']),
+        ('listing', 'ALL', None, None),
+    ]
+    assert plan[0].dist_benefit == 1200
+    assert plan[0].sort_benefit == 90
+    assert plan[0].kwargs == {
+        'redshift_diststyle': 'KEY', 'redshift_distkey': 'listid',
+        'redshift_sortkey': ['saletime', 'qtysold'],
+        'redshift_interleaved_sortkey': None}
+
+    table = sa.Table('listing', shift.meta,
+                     sa.Column('listid', sa.INTEGER), schema='public')
+    table.info['bulk_reflected'] = True
+    batch, = shift.key_migration_batches(plan[1:], copy_privileges=False,
+                                         analyze=False)
+    assert 'CREATE TABLE public.listing (' in batch
+    assert ') DISTSTYLE ALL;' in batch
+
+
+def test_workload_cached(shift, monkeypatch):
+    rows = {
+        queries.table_key_stats: [
+            ('public', 'sales', 1, 'EVEN', None, 10, 100, 1.0)],
+        queries.table_columns: [('public', 'sales', 'id')],
+        queries.workload_explain: [],
+        queries.workload_scans: [],
+        queries.workload_redistribution: [(100, 5)],
+    }
+    execute = Mock(side_effect=lambda query, *args: rows[query])
+    monkeypatch.setattr(shift.engine, 'execute', execute)
+    first = shift.workload('public', days=2)
+    assert first.redistribution == {100: 5}
+    assert execute.call_count == 5
+    assert shift.workload('public', days=2) is first
+    assert execute.call_count == 5
+    shift.workload('public', days=2, max_age=-1)
+    assert execute.call_count == 10
+
+
+class Result(list):
+
+    def fetchone(self):
+        return self[0]
+
+
+def test_skewed_tables(shift, monkeypatch):
+    rows = {
+        queries.table_key_stats: [
+            ('public', 'events', 1, 'KEY(user_id)', None, 10000, 10 ** 8, 8.0),
+            ('public', 'lookup', 2, 'KEY(code)', None, 100, 1000, 5.0),
+            ('public', 'balanced', 3, 'EVEN', None, 1000, 10 ** 6, 1.05),
+            ('public', 'logs', 4, 'KEY(host)', None, 2000, 10 ** 7, 3.0),
+            ('public', 'dims', 5, 'ALL', None, 10, 100, 1.0),
+            ('other', 'ignored', 6, 'KEY(id)', None, 10000, 10 ** 8, 9.0),
+        ],
+        queries.slice_count: [(4,)],
+        queries.slice_blocks: [
+            (1, 0, 7000), (1, 1, 1000), (1, 2, 1000), (1, 3, 1000),
+            (2, 0, 70), (2, 1, 10), (2, 2, 10), (2, 3, 10),
+            (3, 0, 250), (3, 1, 250), (3, 2, 250), (3, 3, 250),
+            (4, 0, 1100), (4, 1, 300), (4, 2, 300), (4, 3, 300),
+            (5, 0, 10), (5, 4, 10),
+        ],
+        queries.table_columns: [
+            ('public', 'events', 'user_id'),
+            ('public', 'events', 'session_id'),
+            ('public', 'events', 'kind'),
+            ('public', 'logs', 'host'),
+            ('public', 'logs', 'message'),
+        ],
+        'SELECT COUNT(*), APPROXIMATE COUNT(DISTINCT session_id), '
+        'COUNT(session_id), APPROXIMATE COUNT(DISTINCT kind), COUNT(kind) '
+        'FROM public.events': [(10 ** 8, 5000000, 10 ** 8, 5, 10 ** 8)],
+        'SELECT COUNT(*), APPROXIMATE COUNT(DISTINCT message), '
+        'COUNT(message) FROM public.logs': [(10 ** 7, 10 ** 6, 5 * 10 ** 6)],
+    }
+    monkeypatch.setattr(shift.engine, 'execute', Mock(
+        side_effect=lambda query, *args: Result(rows[query])))
+    skewed = shift.skewed_tables('public')
+    assert [(t.table, t.excess_mb, t.diststyle, t.distkey)
+            for t in skewed] == [
+        ('events', 4500, 'KEY', 'session_id'),
+        ('logs', 600, 'EVEN', None),
+        ('lookup', 45, 'ALL', None),
+    ]
+    assert skewed[0].cardinality == {'session_id': (5000000, 0.0),
+                                     'kind': (5, 0.0)}
+
+    table = sa.Table('events', shift.meta,
+                     sa.Column('session_id', sa.INTEGER), schema='public',
+                     redshift_distkey='user_id')
+    table.info['bulk_reflected'] = True
+    batch, = shift.key_migration_batches(skewed[:1], copy_privileges=False)
+    assert ') DISTSTYLE KEY DISTKEY (session_id);' in batch
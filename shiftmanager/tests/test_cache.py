@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the persistent reflection cache.
+
+Test Runner: PyTest
+"""
+
+import collections
+import os
+
+from shiftmanager.cache import ReflectionCache, relation_fingerprint
+
+Fingerprint = collections.namedtuple(
+    'Fingerprint', ['relname', 'relkind', 'relnatts', 'diststyle',
+                    'columns'])
+
+
+def test_cache_invalidation(tmpdir):
+    path = os.path.join(str(tmpdir), 'cache.sqlite')
+    cache = ReflectionCache(path)
+    before = relation_fingerprint(Fingerprint('events', 'r', 3, 1, 'abc'))
+    after = relation_fingerprint(Fingerprint('events', 'r', 4, 1, 'abc'))
+
+    cache.put('host:5439/db', 100, 'relation', before, ('payload', [1, 2]))
+    assert cache.get('host:5439/db', 100, 'relation', before) == \
+        ('payload', [1, 2])
+    assert cache.get('host:5439/db', 100, 'relation', after) is None
+    assert cache.get('other:5439/db', 100, 'relation', before) is None
+
+    # Entries persist across instances
+    assert ReflectionCache(path).get('host:5439/db', 100, 'relation',
+                                     before) == ('payload', [1, 2])
+
+    cache.clear('host:5439/db')
+    assert cache.get('host:5439/db', 100, 'relation', before) is None
+
+
+FingerprintRow = collections.namedtuple('FingerprintRow', [
+    'relkind', 'schema_oid', 'schema', 'rel_oid', 'relname', 'owner_id',
+    'owner_name', 'privileges', 'type', 'relnatts', 'diststyle', 'columns'])
+
+
+def test_cached_catalog_refetches_altered_columns(shift, monkeypatch,
+                                                  tmpdir):
+    from mock import Mock
+
+    from shiftmanager.mixins.reflection import RelationRow
+
+    cache = ReflectionCache(os.path.join(str(tmpdir), 'cache.sqlite'))
+    fetch = Mock(return_value=([RelationRow('public', 100, 'events', 'r', 1)],
+                               [], [], []))
+    monkeypatch.setattr(shift, '_fetch_catalog', fetch)
+
+    def fingerprints(columns):
+        row = FingerprintRow('r', 1, 'public', 100, 'events', 10, 'chad',
+                             None, 'table', 3, 1, columns)
+        monkeypatch.setattr(shift.engine, 'execute', Mock(return_value=[row]))
+
+    fingerprints('digest of VARCHAR(10)')
+    shift._fetch_cached_catalog(cache, ['public'])
+    shift._fetch_cached_catalog(cache, ['public'])
+    assert fetch.call_count == 1
+
+    # ALTER COLUMN ... TYPE keeps the oid, name and column count
+    fingerprints('digest of VARCHAR(20)')
+    shift._fetch_cached_catalog(cache, ['public'])
+    assert fetch.call_count == 2
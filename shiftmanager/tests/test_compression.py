@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for CompressionMixin
+
+Test Runner: PyTest
+"""
+
+from mock import MagicMock
+import pytest
+
+
+def mock_connection(rows):
+    cursor = MagicMock()
+    cursor.__enter__.return_value = cursor
+    cursor.fetchall.return_value = rows
+    conn = MagicMock()
+    conn.cursor.return_value = cursor
+    return conn
+
+
+def test_analyze_compression_pooled(shift, monkeypatch):
+    rows = [('t', 'id', 'az64', '55.00'), ('t', 'name', 'zstd', '70.00')]
+    connections = []
+
+    def create_connection():
+        connections.append(mock_connection(rows))
+        return connections[-1]
+
+    monkeypatch.setattr(shift, 'create_connection', create_connection)
+    shift.wlm_policy = {'analyze_compression': {'slot_count': 2}}
+    results = shift.analyze_compression(['a', 'b', 'c'], schema='public',
+                                        comprows=20000, workers=2)
+    assert sorted(results) == ['public.a', 'public.b', 'public.c']
+    assert results['public.a'].encodings == {'id': 'az64', 'name': 'zstd'}
+    assert len(connections) == 2
+    statements = [c[0][0] for conn in connections
+                  for c in conn.cursor().execute.call_args_list]
+    assert 'ANALYZE COMPRESSION public.b COMPROWS 20000' in statements
+    assert 'SET wlm_query_slot_count TO 2' in statements
+    for conn in connections:
+        conn.close.assert_called_once_with()
+
+    # Cached results are reused rather than analyzed again
+    again = shift.analyze_compression(['a'], schema='public', workers=2)
+    assert again['public.a'] is results['public.a']
+    assert len(connections) == 2
+
+
+def test_analyze_compression_error(shift, monkeypatch):
+    import psycopg2
+    from mock import PropertyMock
+
+    conn = mock_connection([])
+    conn.__enter__.return_value = conn
+    conn.__exit__.return_value = False
+    conn.autocommit = False
+    cursor = conn.cursor()
+    cursor.connection = conn
+    aborted = []
+
+    def execute(statement):
+        if aborted:
+            raise psycopg2.InternalError("current transaction is aborted")
+        if statement.startswith('ANALYZE'):
+            aborted.append(statement)
+            raise psycopg2.ProgrammingError("permission denied")
+
+    cursor.execute.side_effect = execute
+    conn.rollback.side_effect = lambda: aborted.pop()
+    monkeypatch.setattr('shiftmanager.Redshift.connection',
+                        PropertyMock(return_value=conn))
+    shift.wlm_policy = {'analyze_compression': {'slot_count': 2}}
+    with pytest.raises(psycopg2.ProgrammingError):
+        shift.analyze_compression(['a'], schema='public', workers=1)
+    conn.rollback.assert_called_once_with()
+
+
+def test_analyze_compression_pooled_failure(shift, monkeypatch):
+    import psycopg2
+
+    rows = [('t', 'id', 'az64', '55.00')]
+    connections = []
+
+    def create_connection():
+        conn = mock_connection(rows)
+        conn.autocommit = True
+        cursor = conn.cursor()
+
+        def execute(statement):
+            if statement.startswith('ANALYZE COMPRESSION public.b'):
+                raise psycopg2.OperationalError("could not obtain lock")
+
+        cursor.execute.side_effect = execute
+        connections.append(conn)
+        return conn
+
+    monkeypatch.setattr(shift, 'create_connection', create_connection)
+    with pytest.raises(psycopg2.OperationalError):
+        shift.analyze_compression(['a', 'b', 'c'], schema='public',
+                                  workers=2)
+    # Analyses which finished are kept
+    assert sorted(shift.encoding_cache) == ['public.a', 'public.c']
+    for conn in connections:
+        conn.close.assert_called_once_with()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the client-side encoding advisor
+
+Test Runner: PyTest
+"""
+
+import datetime
+
+import sqlalchemy as sa
+
+from shiftmanager import encoding
+from shiftmanager.encoding import EncodingAdvisor
+
+
+def rows():
+    start = datetime.datetime(2016, 1, 1)
+    for i in range(1000):
+        yield {
+            'id': i,
+            'created': start + datetime.timedelta(days=i),
+            'status': ['new', 'open', 'closed'][i % 3],
+            'region': 'us-east-1' if i < 500 else 'us-west-2',
+            'note': 'note number %d' % i,
+            'amount': i * 1.5,
+        }
+
+
+def check_recommendations(advisor):
+    assert advisor.recommendations() == {
+        'id': 'delta',
+        'created': 'az64',
+        'status': 'bytedict',
+        'region': 'runlength',
+        'note': 'zstd',
+        'amount': 'zstd',
+    }
+
+
+def test_recommendations():
+    advisor = EncodingAdvisor()
+    for row in rows():
+        advisor.observe(row)
+    check_recommendations(advisor)
+
+
+def test_recommendations_without_numpy(monkeypatch):
+    monkeypatch.setattr(encoding, 'np', None)
+    advisor = EncodingAdvisor()
+    for row in rows():
+        advisor.observe(row)
+    check_recommendations(advisor)
+
+
+def test_observe_csv_and_apply():
+    advisor = EncodingAdvisor(sample_size=3)
+    advisor.observe_csv('"1","2016-01-01","a"\n"2","2016-01-02","b"\n'
+                        '"3","2016-01-03","a"\n"4","2016-01-04","c"\n')
+    assert advisor.rows_sampled == 3
+    table = sa.Table("t", sa.MetaData(),
+                     sa.Column("id", sa.INTEGER),
+                     sa.Column("day", sa.DATE),
+                     sa.Column("name", sa.VARCHAR(10)))
+    advisor.apply(table, raw_columns=['id'])
+    assert [c.info['encode'] for c in table.columns] == [
+        'raw', 'delta', 'bytedict']
+
+
+def test_observe_nested_json():
+    from shiftmanager.inference import SchemaInferrer
+
+    advisor = EncodingAdvisor()
+    inferrer = SchemaInferrer()
+    for i in range(3):
+        row = {'id': i, 'user': {'name': 'u%d' % i, 'tags': ['a', 'b']},
+               'empty': {}}
+        advisor.observe(row)
+        inferrer.observe(row)
+    assert sorted(advisor.profiles()) == sorted(inferrer._stats)
+    assert advisor._samples['user_tags'] == ['["a", "b"]'] * 3
+    assert advisor._samples['empty'] == [None] * 3
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for schema inference
+
+Test Runner: PyTest
+"""
+
+from collections import OrderedDict
+import datetime
+import decimal
+
+from shiftmanager.inference import SchemaInferrer
+
+
+def cleaned(statement):
+    return [line.strip() for line in statement.split('\n') if line.strip()]
+
+
+def test_infer_dict_rows(shift):
+    inferrer = SchemaInferrer()
+    start = datetime.datetime(2016, 1, 1)
+    for i in range(100):
+        inferrer.observe(OrderedDict([
+            ('id', i * 1000),
+            ('user', OrderedDict([('name', 'user %d' % i),
+                                  ('age', i % 90)])),
+            ('created', str(start + datetime.timedelta(hours=i))),
+            ('price', decimal.Decimal('%d.25' % i) if i % 2 else None),
+            ('tags', ['a', 'b']),
+            ('score', i / 3.0),
+            ('active', i % 2 == 0),
+        ]))
+    assert inferrer.jsonpaths()['jsonpaths'] == [
+        "$['id']", "$['user']['name']", "$['user']['age']", "$['created']",
+        "$['price']", "$['tags']", "$['score']", "$['active']"]
+    table = inferrer.table('events', schema='analytics', distkey='id',
+                           sortkey=['created'])
+    assert cleaned(shift.table_definition(table, copy_privileges=False)) == [
+        'CREATE TABLE analytics.events (',
+        'id INTEGER,',
+        'user_name VARCHAR(9),',
+        'user_age SMALLINT,',
+        'created TIMESTAMP WITHOUT TIME ZONE,',
+        'price NUMERIC(4, 2),',
+        'tags VARCHAR(13),',
+        'score DOUBLE PRECISION,',
+        'active BOOLEAN',
+        ') DISTKEY (id) SORTKEY (created)',
+    ]
+
+
+def test_infer_csv_rows():
+    inferrer = SchemaInferrer(columns=['id', 'day', 'name', 'big'])
+    inferrer.observe_csv(u'"1","2016-01-01","été","9000000000"\n'
+                         u'"2","2016-01-02","","-1"\n'
+                         u'"3","2016-01-03 10:00:00","abc","1"\n')
+    types = inferrer.column_types(headroom=0)
+    assert [repr(t) for t in types.values()] == [
+        'SMALLINT()', 'TIMESTAMP()', 'VARCHAR(length=5)', 'BIGINT()']
+
+
+def test_infer_with_jsonpaths():
+    inferrer = SchemaInferrer()
+    inferrer.observe(OrderedDict([('b', 'xyz'), ('a', 1)]))
+    jsonpaths = {'jsonpaths': ["$['a']", "$['c'][0]", "$['b']"]}
+    types = inferrer.column_types(jsonpaths=jsonpaths)
+    assert list(types) == ['a', 'c_0', 'b']
+    assert repr(types['c_0']) == 'VARCHAR(length=256)'
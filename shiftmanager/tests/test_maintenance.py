@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for MaintenanceMixin
+
+Test Runner: PyTest
+"""
+
+from shiftmanager.mixins.maintenance import (DEEP_COPY, VACUUM_FULL,
+                                             VACUUM_SORT_ONLY, TableStats)
+
+
+def stats():
+    return [
+        # Mostly unsorted, few deletes: sort the unsorted region
+        TableStats('public', 'events', 1, 10000, 1000, 990, 10.0,
+                   0.0, 1.0, 'created'),
+        # Half deleted: cheaper to rewrite the survivors
+        TableStats('public', 'sessions', 2, 1000, 1000, 500, 40.0,
+                   20.0, 1.0, 'id'),
+        # Healthy: skipped
+        TableStats('public', 'users', 3, 100, 100, 100, 1.0,
+                   0.0, 1.0, 'id'),
+        # No sort key and some deletes: a rewrite beats VACUUM FULL
+        TableStats('public', 'logs', 4, 500, 100, 80, None,
+                   0.0, 1.0, None),
+    ]
+
+
+def test_maintenance_plan(shift):
+    plan = shift.maintenance_plan(stats=stats())
+    assert [(t.table, t.action) for t in plan] == [
+        ('sessions', DEEP_COPY),
+        ('events', VACUUM_SORT_ONLY),
+        ('logs', DEEP_COPY),
+    ]
+    plan = shift.maintenance_plan(stats=stats(), allow_deep_copy=False)
+    assert [(t.table, t.action) for t in plan] == [
+        ('events', VACUUM_SORT_ONLY),
+        ('sessions', VACUUM_SORT_ONLY),
+        ('logs', VACUUM_FULL),
+    ]
+
+
+def test_maintenance_batches(shift):
+    plan = shift.maintenance_plan(stats=stats())
+    events = [t for t in plan if t.table == 'events'][0]
+    assert shift.maintenance_batches(events) == [
+        'VACUUM SORT ONLY public.events', 'ANALYZE public.events']
+    shift.run_maintenance([events], analyze=False)
+    shift.execute.assert_called_once_with('VACUUM SORT ONLY public.events',
+                                          autocommit=True)
+
+
+def test_deep_copy_tables(shift, monkeypatch):
+    import threading
+    import time
+
+    from mock import MagicMock
+    import sqlalchemy as sa
+
+    monkeypatch.setattr(shift, 'table_stats', lambda schemas: [
+        TableStats('public', name, i, size, 100, 100, 0.0, 0.0, 1.0, None)
+        for i, (name, size) in enumerate([('a', 100), ('b', 100),
+                                          ('c', 900)])])
+    monkeypatch.setattr(shift, 'disk_space', lambda: (1000, 700))
+    shift.wlm_policy = {'deep_copy': {'slot_count': 2}}
+    active, peak = [0], [0]
+    lock = threading.Lock()
+
+    def execute(batch):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.01)
+        with lock:
+            active[0] -= 1
+        if 'public.b' in batch:
+            raise ValueError('boom')
+
+    def create_connection():
+        conn = MagicMock()
+        conn.cursor.return_value.__enter__.return_value.execute = execute
+        return conn
+
+    monkeypatch.setattr(shift, 'create_connection', create_connection)
+    tables = [sa.Table(name, sa.MetaData(), sa.Column('id', sa.INTEGER),
+                       schema='public') for name in 'abc']
+    results = shift.deep_copy_tables(tables, workers=2, slot_budget=3,
+                                     copy_privileges=False, analyze=False)
+    assert [r.table for r in results] == ['public.a', 'public.b', 'public.c']
+    assert results[0].error is None and results[0].elapsed > 0
+    assert str(results[1].error) == 'boom'
+    # A second copy of c would leave less than 20% of the disk free
+    assert results[2].started_at is None
+    assert 'free disk' in str(results[2].error)
+    # Two slots each within a budget of three: one copy at a time
+    assert peak[0] == 1
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for MigrationMixin
+
+Test Runner: PyTest
+"""
+
+import pytest
+import sqlalchemy as sa
+
+from shiftmanager.mixins.migration import (DEEP_COPY, IN_PLACE,
+                                           METADATA_ONLY)
+
+
+def current_table():
+    return sa.Table(
+        'events', sa.MetaData(),
+        sa.Column('id', sa.INTEGER, nullable=False),
+        sa.Column('kind', sa.VARCHAR(10), info={'encode': 'lzo'}),
+        sa.Column('created', sa.TIMESTAMP),
+        sa.Column('legacy', sa.VARCHAR(5)),
+        sa.PrimaryKeyConstraint('id', name='events_pkey'),
+        schema='public', redshift_distkey='id',
+        redshift_sortkey=('created',))
+
+
+def test_table_changes_in_place(shift):
+    desired = sa.Table(
+        'events', sa.MetaData(),
+        sa.Column('id', sa.INTEGER, nullable=False),
+        sa.Column('kind', sa.VARCHAR(20), info={'encode': 'zstd'}),
+        sa.Column('created', sa.TIMESTAMP),
+        sa.Column('user_id', sa.BIGINT, info={'encode': 'az64'}),
+        sa.PrimaryKeyConstraint('id', name='events_pkey'),
+        schema='public', redshift_distkey='user_id',
+        redshift_sortkey=('created', 'id'))
+    changes = shift.table_changes(desired, current_table())
+    assert [(c.kind, c.description) for c in changes] == [
+        (METADATA_ONLY, 'add column user_id'),
+        (METADATA_ONLY, 'change type of kind from VARCHAR(10) to VARCHAR(20)'),
+        (IN_PLACE, 'change encoding of kind to zstd'),
+        (IN_PLACE, 'change distribution to KEY(user_id)'),
+        (IN_PLACE, 'change sort key to (created, id)'),
+        (METADATA_ONLY, 'drop column legacy'),
+    ]
+    assert shift.migration_batches(desired, current_table()) == [
+        'ALTER TABLE public.events ADD COLUMN user_id BIGINT ENCODE az64',
+        'ALTER TABLE public.events ALTER COLUMN kind TYPE VARCHAR(20)',
+        'ALTER TABLE public.events ALTER COLUMN kind ENCODE zstd',
+        'ALTER TABLE public.events ALTER DISTSTYLE KEY DISTKEY user_id',
+        'ALTER TABLE public.events ALTER SORTKEY (created, id)',
+        'ALTER TABLE public.events DROP COLUMN legacy',
+    ]
+
+
+def test_migration_batches_deep_copy(shift):
+    desired = sa.Table(
+        'events', sa.MetaData(),
+        sa.Column('id', sa.INTEGER, nullable=False),
+        sa.Column('note', sa.VARCHAR(100), server_default=sa.text("''"),
+                  nullable=False),
+        sa.Column('created', sa.TIMESTAMP),
+        sa.Column('kind', sa.VARCHAR(10), info={'encode': 'lzo'}),
+        sa.PrimaryKeyConstraint('id', name='events_pkey'),
+        schema='public', redshift_distkey='id',
+        redshift_interleaved_sortkey=('created', 'kind'))
+    changes = shift.table_changes(desired, current_table())
+    assert [(c.kind, c.description) for c in changes] == [
+        (DEEP_COPY, 'reorder columns'),
+        (DEEP_COPY, 'add column note before existing columns'),
+        (DEEP_COPY, 'change interleaved sort key'),
+        (METADATA_ONLY, 'drop column legacy'),
+    ]
+    batch, = shift.migration_batches(desired, current_table(),
+                                     copy_privileges=False, analyze=False)
+    assert 'INTERLEAVED SORTKEY (created, kind)' in batch
+    assert ('INSERT INTO public.events ("id", "created", "kind")\n'
+            'SELECT "id", "created", "kind" '
+            'FROM public.events$outgoing;') in batch
+
+
+def test_table_changes_not_null_without_default(shift):
+    desired = current_table()
+    desired.append_column(sa.Column('flag', sa.BOOLEAN, nullable=False))
+    with pytest.raises(ValueError):
+        shift.table_changes(desired, current_table())
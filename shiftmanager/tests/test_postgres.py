@@ -118,17 +118,39 @@ def test_copy_table_to_redshift(postgres, tmpdir):
 
     split_statement = [x.strip() for x in copy_statement.split("\n")]
 
-    assert split_statement[0] == "copy test_table"
+    assert split_statement[0] == "COPY test_table"
 
-    s3_start = "from 's3://com.simple.mock/tmp/backfill/"
+    s3_start = "FROM 's3://com.simple.mock/tmp/backfill/"
     s3_end = ".manifest'"
     assert (split_statement[1].startswith(s3_start) and
             split_statement[1].endswith(s3_end))
 
-    creds = "credentials 'aws_access_key_id=None;aws_secret_access_key=None'"
+    creds = "CREDENTIALS 'aws_access_key_id=None;aws_secret_access_key=None'"
     assert split_statement[2] == creds
-    assert split_statement[3] == "manifest"
-    assert split_statement[4] == "csv;"
+    assert split_statement[3] == "CSV"
+    assert split_statement[4] == "MANIFEST GZIP"
+
+
+@pytest.mark.postgrestest
+def test_copy_table_to_redshift_merge(postgres, monkeypatch, tmpdir):
+    import sqlalchemy as sa
+
+    cur = postgres.connection.cursor()
+    cur.return_rows = [(1,)]
+    monkeypatch.setattr(postgres, 'reflected_table', lambda name, schema: (
+        sa.Table(name, sa.MetaData(), sa.Column('id', sa.INTEGER,
+                                                primary_key=True))))
+
+    postgres.copy_table_to_redshift("test_table", 'com.simple.postgres.mock',
+                                    "/tmp/backfill/", 10, "test_table",
+                                    manifest_max_keys=3, merge=True)
+
+    # All four manifests are staged and merged in a single batch
+    batch = cur.statements[-1]
+    assert batch.count("COPY test_table$staging") == 4
+    assert batch.count("DELETE FROM test_table") == 1
+    assert not any(s.startswith("COPY test_table\n")
+                   for s in cur.statements)
 
 
 @pytest.mark.postgrestest
@@ -143,7 +165,7 @@ def test_aws_role_copy(postgres, tmpdir):
     copy_statement = cur.statements[-1]
     split_statement = [x.strip() for x in copy_statement.split("\n")]
 
-    creds = "credentials 'aws_iam_role=arn:aws:iam::000000:role/TestRole'"
+    creds = "CREDENTIALS 'aws_iam_role=arn:aws:iam::000000:role/TestRole'"
     assert split_statement[2] == creds
 
 
@@ -159,6 +181,41 @@ def test_aws_security_token(postgres, tmpdir):
     copy_statement = cur.statements[-1]
     split_statement = [x.strip() for x in copy_statement.split("\n")]
 
-    creds = ("credentials 'aws_access_key_id=access_key;"
+    creds = ("CREDENTIALS 'aws_access_key_id=access_key;"
              "aws_secret_access_key=secret_key;token=sec_token'")
     assert split_statement[2] == creds
+
+
+def test_pg_infer_table_measures_padded_char(shift):
+    from mock import MagicMock
+
+    cursor = MagicMock()
+    cursor.__enter__.return_value = cursor
+    cursor.fetchall.return_value = [('code', 'character', None, None),
+                                    ('name', 'text', None, None)]
+    # A char(10) holding 'ab' is exported with its padding
+    cursor.fetchone.return_value = (10, 4)
+    conn = MagicMock()
+    conn.__enter__.return_value = conn
+    conn.cursor.return_value = cursor
+    shift._pg_connection = conn
+
+    table = shift.pg_infer_table('codes')
+    measure = cursor.execute.call_args[0][0]
+    assert 'MAX(OCTET_LENGTH("code"))' in measure
+    assert 'MAX(OCTET_LENGTH("name"::text))' in measure
+    assert table.columns['code'].type.length >= 10
+
+
+@pytest.mark.postgrestest
+def test_pg_infer_table_char(postgres):
+    postgres.pg_execute_and_commit_single_statement(
+        "DROP TABLE IF EXISTS char_table; "
+        "CREATE TABLE char_table (code char(10)); "
+        "INSERT INTO char_table VALUES ('ab'), ('abc');")
+    try:
+        table = postgres.pg_infer_table('char_table')
+    finally:
+        postgres.pg_execute_and_commit_single_statement(
+            "DROP TABLE char_table;")
+    assert table.columns['code'].type.length >= 10
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the Redshift class.
+
+Test Runner: PyTest
+"""
+
+import pytest
+
+
+@pytest.fixture
+def iter_conn(shift, monkeypatch):
+    """Serve iter_query's own connection from the mock connection"""
+    conn = shift.connection
+    monkeypatch.setattr('shiftmanager.Redshift.connection', property(
+        lambda self: pytest.fail("iter_query used the shared connection")))
+    monkeypatch.setattr(shift, 'create_connection', lambda: conn)
+    return conn
+
+
+def test_iter_query_rows(shift, iter_conn):
+    cur = iter_conn.cursor()
+    cur.return_rows = [(i, 'name%d' % i) for i in range(5)]
+
+    rows = list(shift.iter_query("SELECT * FROM foo", batch_size=2))
+    assert rows == cur.return_rows
+    assert cur.statements == ["SELECT * FROM foo"]
+    assert cur.itersize == 2
+    iter_conn.close.assert_called_once_with()
+
+
+def test_iter_query_columnar(shift, iter_conn):
+    cur = iter_conn.cursor()
+    cur.return_rows = [(i, 'name%d' % i) for i in range(5)]
+    cur.description = [('id',), ('name',)]
+
+    batches = list(shift.iter_query("SELECT * FROM foo", batch_size=2,
+                                    columnar=True, use_numpy=False))
+    assert len(batches) == 3
+    assert list(batches[0].keys()) == ['id', 'name']
+    assert batches[0]['id'] == [0, 1]
+    assert batches[2]['name'] == ['name4']
+
+
+def test_execute_values_pages(shift):
+    cur = shift.connection.cursor()
+    argslist = [(i, 'name%d' % i) for i in range(5)]
+
+    shift.execute_values("INSERT INTO foo (id, name) VALUES %s", argslist,
+                         page_size=2)
+    assert cur.statements == [
+        b"INSERT INTO foo (id, name) VALUES (0, 'name0'),(1, 'name1')",
+        b"INSERT INTO foo (id, name) VALUES (2, 'name2'),(3, 'name3')",
+        b"INSERT INTO foo (id, name) VALUES (4, 'name4')",
+    ]
+
+
+def test_execute_values_statement_size(shift):
+    cur = shift.connection.cursor()
+    argslist = [(i,) for i in range(4)]
+
+    prefix = "INSERT INTO foo VALUES %s"
+    shift.execute_values(prefix, argslist, max_statement_bytes=30)
+    assert cur.statements == [
+        b"INSERT INTO foo VALUES (0),(1)",
+        b"INSERT INTO foo VALUES (2),(3)",
+    ]
+
+
+def test_execute_values_dict_rows(shift):
+    cur = shift.connection.cursor()
+    argslist = [{'id': i, 'name': 'name%d' % i} for i in range(2)]
+
+    with pytest.raises(ValueError):
+        shift.execute_values("INSERT INTO foo (name, id) VALUES %s", argslist)
+    shift.execute_values("INSERT INTO foo (name, id) VALUES %s", argslist,
+                         template='(%(name)s, %(id)s)')
+    assert cur.statements == [
+        b"INSERT INTO foo (name, id) VALUES ('name0', 0),('name1', 1)"]
+
+
+def test_execute_values_retries_generator(shift):
+    import psycopg2
+    from mock import Mock
+    from shiftmanager.retry import RetryPolicy
+
+    # Let the failure out of the connection context rather than swallow it
+    shift.connection.__exit__ = Mock(return_value=False)
+    cur = shift.connection.cursor()
+    execute = cur.execute
+    failures = [psycopg2.OperationalError("serializable isolation violation")]
+
+    def flaky(statement, *args, **kwargs):
+        if failures:
+            raise failures.pop()
+        execute(statement, *args, **kwargs)
+
+    cur.execute = flaky
+    shift.execute_values("INSERT INTO foo VALUES %s",
+                         ((i,) for i in range(3)),
+                         retry=RetryPolicy(max_attempts=2, base_delay=0))
+    assert cur.statements == [b"INSERT INTO foo VALUES (0),(1),(2)"]
+
+
+def test_retry_policy():
+    import psycopg2
+    from shiftmanager.retry import RetryPolicy
+
+    policy = RetryPolicy(max_attempts=3, base_delay=0)
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise psycopg2.OperationalError("server closed the connection "
+                                            "unexpectedly")
+        return 'done'
+
+    assert policy.run(flaky) == 'done'
+    assert len(attempts) == 3
+
+    def fatal():
+        attempts.append(1)
+        raise psycopg2.ProgrammingError("syntax error")
+
+    del attempts[:]
+    with pytest.raises(psycopg2.ProgrammingError):
+        policy.run(fatal)
+    assert len(attempts) == 1
+
+
+def test_instrument_without_listeners(shift, monkeypatch):
+    from mock import Mock
+    from shiftmanager import instrumentation
+
+    with monkeypatch.context() as patch:
+        patch.setattr(instrumentation, 'normalize_statement', Mock(
+            side_effect=AssertionError("normalized an unobserved statement")))
+        with shift._instrument('statement', 'execute', 'SELECT 1') as event:
+            event.rowcount = 1
+
+    # Listeners still see the normalized statement
+    events = []
+    shift.add_listener(events.append)
+    with shift._instrument('statement', 'execute', 'SELECT  1'):
+        pass
+    assert events[0].statement == 'SELECT ?'
+    assert events[0].fingerprint == instrumentation.fingerprint('SELECT 2')
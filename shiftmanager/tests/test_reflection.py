@@ -6,9 +6,16 @@ Tests for ReflectionMixin.
 Test Runner: PyTest
 """
 
+import collections
+import time
+
+from mock import Mock
+
 import sqlalchemy as sa
 import pytest
 
+from shiftmanager.mixins.reflection import PrivilegeRow, ViewDefinitionRow
+
 
 @pytest.fixture
 def table():
@@ -104,3 +111,400 @@ def test_deduplicate(shift, complex_table):
     DROP TABLE my_complex_table$outgoing;
     """
     assert(cleaned(statement) == cleaned(expected))
+
+
+def test_deep_copy_wlm(shift, table):
+    shift.wlm_policy = {'deep_copy': {'slot_count': 3}}
+    statement = shift.deep_copy(table, wlm_query_group='maintenance',
+                                copy_privileges=False, analyze=False)
+    expected = """
+    SET query_group TO 'maintenance';
+    SET wlm_query_slot_count TO 3;
+    LOCK TABLE my_table;
+    ALTER TABLE my_table RENAME TO my_table$outgoing;
+    CREATE TABLE my_table (
+    col1 INTEGER
+    );
+
+    INSERT INTO my_table SELECT * FROM my_table$outgoing;
+
+    DROP TABLE my_table$outgoing;
+    RESET wlm_query_slot_count;
+    RESET query_group;
+    """
+    assert(cleaned(statement) == cleaned(expected))
+
+
+Relation = collections.namedtuple(
+    'Relation', ['schema', 'rel_oid', 'relname', 'relkind', 'diststyle'])
+Column = collections.namedtuple(
+    'Column', ['schema', 'relname', 'attnum', 'attname', 'type', 'encoding',
+               'distkey', 'sortkey', 'notnull', 'default'])
+Constraint = collections.namedtuple(
+    'Constraint', ['schema', 'relname', 'conname', 'contype', 'condef'])
+
+
+@pytest.fixture
+def catalog():
+    relations = [Relation('public', 100, 'events', 'r', 1)]
+    columns = [
+        Column('public', 'events', 1, 'id', 'character(36)', 'lzo',
+               True, 0, True, None),
+        Column('public', 'events', 2, 'created', 'timestamp without time zone',
+               'delta', False, 1, False, None),
+        Column('public', 'events', 3, 'amount', 'numeric(18,4)', 'none',
+               False, 0, False, None),
+    ]
+    constraints = [
+        Constraint('public', 'events', 'events_pkey', 'p',
+                   'PRIMARY KEY (id)'),
+    ]
+    return relations, columns, constraints, []
+
+
+def test_reflected_tables(shift, monkeypatch, catalog):
+    monkeypatch.setattr(shift, '_fetch_catalog',
+                        lambda schemas, relnames=None: catalog)
+    tables = shift.reflected_tables('public')
+    assert [t.key for t in tables] == ['public.events']
+    statement = shift.table_definition('events', schema='public',
+                                       copy_privileges=False)
+    expected = """
+    CREATE TABLE public.events (
+    id CHAR(36) ENCODE lzo NOT NULL,
+    created TIMESTAMP WITHOUT TIME ZONE ENCODE delta,
+    amount NUMERIC(18, 4),
+    CONSTRAINT events_pkey PRIMARY KEY (id)
+    ) DISTSTYLE KEY DISTKEY (id) SORTKEY (created)
+    """
+    assert(cleaned(statement) == cleaned(expected))
+
+
+def test_reflected_tables_unqualified(shift, monkeypatch, catalog):
+    monkeypatch.setattr(shift, '_fetch_catalog',
+                        lambda schemas, relnames=None: catalog)
+    events, = shift.reflected_tables()
+    reflected_table = shift.reflected_table
+    monkeypatch.setattr(shift, 'reflected_table', Mock(
+        side_effect=AssertionError("reflected events again")))
+    statement = shift.table_definition('events', copy_privileges=False)
+    assert statement.startswith('CREATE TABLE public.events')
+
+    # Nor is a second, autoloaded copy added to meta
+    monkeypatch.setattr(sa.Table, '_autoload', Mock(
+        side_effect=AssertionError("autoloaded events")), raising=False)
+    assert reflected_table('events') is events
+    assert list(shift.meta.tables) == ['public.events']
+
+
+def test_refresh_privileges_scoped(shift, monkeypatch, table):
+    rows = [PrivilegeRow('r', 1, 'public', 100, 'my_table', 10, 'chad',
+                         'clarissa=arwdRxt/chad', 'table', True)]
+    execute = Mock(return_value=rows)
+    monkeypatch.setattr(shift.engine, 'execute', execute)
+    statement = shift.reflected_privileges(table)
+    expected = """
+    ALTER TABLE my_table OWNER TO chad;
+    GRANT ALL ON my_table TO clarissa
+    """
+    assert(cleaned(statement) == cleaned(expected))
+    query, params = execute.call_args[0]
+    assert 'c.relname = %(relname_0)s' in query
+    assert params == {'relname_0': 'my_table'}
+    assert shift.privilege_cache.get('public.my_table').owner_name == 'chad'
+
+    # A second lookup is answered from the cache
+    shift.reflected_privileges(table)
+    assert execute.call_count == 1
+
+    # Expired entries are refetched
+    shift.privilege_cache.ttl = 60
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 120)
+    shift.reflected_privileges(table)
+    assert execute.call_count == 2
+
+
+def patch_dump_catalog(shift, monkeypatch, catalog):
+    relations, columns, constraints, _ = catalog
+    relations = relations + [
+        Relation('public', 101, 'daily', 'v', 0),
+        Relation('public', 102, 'a_summary', 'v', 0)]
+    columns = columns + [
+        Column('public', 'daily', 1, 'id', 'character(36)', 'none',
+               False, 0, False, None),
+        Column('public', 'a_summary', 1, 'id', 'character(36)', 'none',
+               False, 0, False, None)]
+    views = [
+        ViewDefinitionRow('public', 'daily', 'SELECT id FROM public.events'),
+        ViewDefinitionRow('public', 'a_summary', 'SELECT id FROM daily')]
+    monkeypatch.setattr(
+        shift, '_fetch_catalog',
+        lambda schemas, relnames=None: (relations, columns, constraints,
+                                        views))
+    monkeypatch.setattr(
+        shift, '_view_dependencies',
+        lambda schemas, relnames=None: {
+            'public.daily': set(['public.events']),
+            'public.a_summary': set(['public.daily'])})
+
+
+def test_dump_schema(shift, monkeypatch, catalog, tmpdir):
+    patch_dump_catalog(shift, monkeypatch, catalog)
+    directory = tmpdir.join('ddl')
+    script = shift.dump_schema('public', directory=str(directory),
+                               copy_privileges=False, workers=1)
+    statements = [s.strip() for s in script.split(';') if s.strip()]
+    assert statements[0].startswith('CREATE TABLE public.events')
+    assert statements[1].startswith('CREATE VIEW public.daily')
+    assert statements[2].startswith('CREATE VIEW public.a_summary')
+    assert sorted(f.basename for f in directory.listdir()) == [
+        'public.a_summary.sql', 'public.daily.sql', 'public.events.sql']
+
+
+def test_dump_schema_workers(shift, monkeypatch, catalog):
+    from mock import MagicMock
+
+    patch_dump_catalog(shift, monkeypatch, catalog)
+    rows = [('r', 1, 'public', 100, 'events', 10, 'chad', '', 'table', True),
+            ('v', 1, 'public', 101, 'daily', 10, 'chad', '', 'view', True),
+            ('v', 1, 'public', 102, 'a_summary', 10, 'chad', '', 'view',
+             True)]
+    connections, fetched = [], []
+
+    def create_connection():
+        cursor = MagicMock()
+        cursor.__enter__.return_value = cursor
+        requested = []
+
+        def execute(query, params):
+            requested[:] = [v for k, v in params.items()
+                            if k.startswith('relname')]
+            fetched.extend(requested)
+
+        cursor.execute.side_effect = execute
+        cursor.fetchall.side_effect = lambda: [
+            row for row in rows if row[4] in requested]
+        conn = MagicMock()
+        conn.cursor.return_value = cursor
+        connections.append(conn)
+        return conn
+
+    monkeypatch.setattr(shift, 'create_connection', create_connection)
+    monkeypatch.setattr(shift.engine, 'execute', Mock(
+        side_effect=AssertionError("used the shared connection")))
+    script = shift.dump_schema('public', workers=2)
+    assert len(connections) == 2
+    assert sorted(fetched) == ['a_summary', 'daily', 'events']
+    for conn in connections:
+        conn.close.assert_called_once_with()
+    statements = [s.strip() for s in script.split(';') if s.strip()]
+    assert statements[0].startswith('CREATE TABLE public.events')
+    assert statements[1] == 'ALTER TABLE public.events OWNER TO chad'
+    assert statements[2].startswith('CREATE VIEW public.daily')
+    assert statements[3] == 'ALTER VIEW public.daily OWNER TO chad'
+    assert statements[4].startswith('CREATE VIEW public.a_summary')
+    assert statements[5] == 'ALTER VIEW public.a_summary OWNER TO chad'
+
+
+def test_view_definitions(shift, monkeypatch):
+    rows = [
+        ('public', 'a_summary', 'SELECT id FROM daily', 'public', 'daily'),
+        ('public', 'daily', 'SELECT id FROM events', 'public', 'events'),
+        ('public', 'other', 'SELECT 1', None, None),
+    ]
+    execute = Mock(return_value=rows)
+    monkeypatch.setattr(shift.engine, 'execute', execute)
+    statement = shift.view_definitions('public', copy_privileges=False)
+    expected = """
+    CREATE VIEW public.daily AS SELECT id FROM events;
+    CREATE VIEW public.other AS SELECT 1;
+    CREATE VIEW public.a_summary AS SELECT id FROM daily;
+    """
+    assert(cleaned(statement) == cleaned(expected))
+    assert execute.call_count == 1
+
+
+def test_deep_copy_rebuild_views(shift, monkeypatch, table):
+    dependencies = [
+        ('public', 'daily', 'public', 'my_table'),
+        ('public', 'summary', 'public', 'daily'),
+        ('public', 'unrelated', 'public', 'other_table'),
+    ]
+    views = [
+        ('public', 'daily', 'SELECT col1 FROM my_table', 'public', 'my_table'),
+        ('public', 'summary', 'SELECT col1 FROM daily', 'public', 'daily'),
+    ]
+
+    def execute(statement, params=None):
+        if 'pg_get_viewdef' in statement:
+            return views
+        return dependencies
+
+    monkeypatch.setattr(shift.engine, 'execute', execute)
+    table.schema = 'public'
+    assert shift.dependent_views(table) == ['public.daily', 'public.summary']
+    statement = shift.deep_copy(table, copy_privileges=False,
+                                rebuild_views=True, analyze=False)
+    expected = """
+    LOCK TABLE public.my_table;
+    ALTER TABLE public.my_table RENAME TO my_table$outgoing;
+    CREATE TABLE public.my_table (
+    col1 INTEGER
+    );
+
+    INSERT INTO public.my_table SELECT * FROM public.my_table$outgoing;
+
+    DROP TABLE public.my_table$outgoing CASCADE;
+
+    CREATE VIEW public.daily AS SELECT col1 FROM my_table;
+
+    CREATE VIEW public.summary AS SELECT col1 FROM daily;
+    """
+    assert(cleaned(statement) == cleaned(expected))
+
+
+def test_chunked_deep_copy(shift, monkeypatch):
+    table = sa.Table("my_table", sa.MetaData(),
+                     sa.schema.Column("id", sa.INTEGER),
+                     redshift_sortkey=('id',))
+    result = Mock()
+    result.fetchone.return_value = (0, 30)
+    monkeypatch.setattr(shift.engine, 'execute', Mock(return_value=result))
+    batches = shift.chunked_deep_copy(table, chunks=3, copy_privileges=False)
+    expected = [
+        """
+        LOCK TABLE my_table;
+        ALTER TABLE my_table RENAME TO my_table$outgoing;
+        CREATE TABLE my_table (
+        id INTEGER
+        ) SORTKEY (id);
+        """,
+        "INSERT INTO my_table SELECT * FROM my_table$outgoing "
+        "WHERE id < 10 ORDER BY id;",
+        "INSERT INTO my_table SELECT * FROM my_table$outgoing "
+        "WHERE id >= 10 AND id < 20 ORDER BY id;",
+        "INSERT INTO my_table SELECT * FROM my_table$outgoing "
+        "WHERE id >= 20 ORDER BY id;",
+        "INSERT INTO my_table SELECT * FROM my_table$outgoing "
+        "WHERE id IS NULL ORDER BY id;",
+        """
+        DROP TABLE my_table$outgoing;
+        ANALYZE my_table;
+        """,
+    ]
+    assert [cleaned(b) for b in batches] == [cleaned(e) for e in expected]
+
+
+def test_chunked_deep_copy_shadow(shift, monkeypatch):
+    table = sa.Table("my_table", sa.MetaData(),
+                     sa.schema.Column("id", sa.INTEGER),
+                     redshift_sortkey=('id',))
+    result = Mock()
+    result.fetchone.return_value = (0, 30)
+    monkeypatch.setattr(shift.engine, 'execute', Mock(return_value=result))
+    batches = shift.chunked_deep_copy(table, chunks=3, shadow=True,
+                                      copy_privileges=False, analyze=False)
+    assert cleaned(batches[0]) == cleaned("""
+        CREATE TABLE my_table$incoming (
+        id INTEGER
+        ) SORTKEY (id);
+        """)
+    assert batches[1] == ("INSERT INTO my_table$incoming SELECT * FROM "
+                          "my_table WHERE id < 10 ORDER BY id;")
+    expected = """
+        LOCK TABLE my_table;
+        DELETE FROM my_table$incoming WHERE id >= 20;
+        INSERT INTO my_table$incoming SELECT * FROM my_table
+        WHERE id >= 20 ORDER BY id;
+        DELETE FROM my_table$incoming WHERE id IS NULL;
+        INSERT INTO my_table$incoming SELECT * FROM my_table
+        WHERE id IS NULL ORDER BY id;
+        ALTER TABLE my_table RENAME TO my_table$outgoing;
+        ALTER TABLE my_table$incoming RENAME TO my_table;
+        DROP TABLE my_table$outgoing;
+        """
+    assert batches[-1].split() == expected.split()
+
+
+def test_shadow_deep_copy(shift):
+    table = sa.Table("my_table", sa.MetaData(),
+                     sa.schema.Column("id", sa.INTEGER),
+                     sa.schema.Column("loaded", sa.TIMESTAMP),
+                     redshift_sortkey=('id',))
+    batches = shift.shadow_deep_copy(table, 'loaded', use_append=True,
+                                     copy_privileges=False)
+    catch_up = ("SELECT * FROM my_table WHERE loaded > "
+                "(SELECT MAX(loaded) FROM my_table$incoming) "
+                "OR (SELECT MAX(loaded) FROM my_table$incoming) IS NULL "
+                "ORDER BY id")
+    assert batches[0].startswith('CREATE TABLE my_table$incoming (')
+    assert batches[1:] == [
+        "INSERT INTO my_table$incoming SELECT * FROM my_table ORDER BY id;",
+        "CREATE TABLE my_table$delta (LIKE my_table$incoming);\n"
+        "INSERT INTO my_table$delta " + catch_up + ";",
+        "ALTER TABLE my_table$incoming APPEND FROM my_table$delta;",
+        "DROP TABLE my_table$delta;",
+        "LOCK TABLE my_table;\n"
+        "INSERT INTO my_table$incoming " + catch_up + ";\n"
+        "ALTER TABLE my_table RENAME TO my_table$outgoing;\n"
+        "ALTER TABLE my_table$incoming RENAME TO my_table;\n"
+        "DROP TABLE my_table$outgoing;",
+        "ANALYZE my_table;",
+    ]
+
+
+def test_shadow_deep_copy_empty_initial_copy(shift):
+    """Rows written after an empty initial copy are caught up."""
+    import sqlite3
+
+    table = sa.Table("my_table", sa.MetaData(),
+                     sa.schema.Column("id", sa.INTEGER),
+                     sa.schema.Column("loaded", sa.INTEGER))
+    batches = shift.shadow_deep_copy(table, 'loaded', copy_privileges=False,
+                                     analyze=False)
+    catch_up = batches[2].rstrip(';').replace('$', '_')
+
+    db = sqlite3.connect(':memory:')
+    db.execute('CREATE TABLE my_table (id INTEGER, loaded INTEGER)')
+    db.execute('CREATE TABLE my_table_incoming (id INTEGER, loaded INTEGER)')
+    # The source was empty at the initial copy; rows arrived since
+    db.executemany('INSERT INTO my_table VALUES (?, ?)', [(1, 1), (2, 2)])
+    db.execute(catch_up)
+    db.execute('INSERT INTO my_table VALUES (3, 3)')
+    db.execute(catch_up)
+    assert db.execute('SELECT id FROM my_table_incoming ORDER BY id'
+                      ).fetchall() == [(1,), (2,), (3,)]
+
+
+def test_incremental_deduplicate(shift):
+    table = sa.Table("events", sa.MetaData(),
+                     sa.schema.Column("id", sa.INTEGER),
+                     sa.schema.Column("kind", sa.VARCHAR(10)),
+                     sa.schema.Column("loaded", sa.INTEGER),
+                     schema='analytics')
+    batch = shift.incremental_deduplicate(table, 'id, kind', 'loaded', 42,
+                                          order_by='loaded DESC')
+    assert batch == (
+        'LOCK TABLE analytics.events;\n'
+        'CREATE TEMP TABLE events$duplicates AS\n'
+        'SELECT id, kind FROM analytics.events WHERE loaded >= 42\n'
+        'GROUP BY id, kind HAVING COUNT(*) > 1;\n'
+        'CREATE TEMP TABLE events$retained AS\n'
+        'SELECT id, kind, loaded FROM (\n'
+        '\tSELECT analytics.events.*, ROW_NUMBER() OVER ('
+        'PARTITION BY analytics.events.id, analytics.events.kind '
+        'ORDER BY loaded DESC) AS "row_number"\n'
+        '\tFROM analytics.events JOIN events$duplicates ON '
+        'analytics.events.id = events$duplicates.id AND '
+        'analytics.events.kind = events$duplicates.kind\n'
+        '\tWHERE analytics.events.loaded >= 42\n'
+        ') WHERE "row_number" = 1;\n'
+        'DELETE FROM analytics.events USING events$duplicates\n'
+        'WHERE analytics.events.id = events$duplicates.id AND '
+        'analytics.events.kind = events$duplicates.kind AND '
+        'analytics.events.loaded >= 42;\n'
+        'INSERT INTO analytics.events (id, kind, loaded)\n'
+        'SELECT id, kind, loaded FROM events$retained;\n'
+        'DROP TABLE events$retained;\n'
+        'DROP TABLE events$duplicates;')
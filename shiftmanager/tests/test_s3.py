@@ -35,7 +35,7 @@ class SqlTextMatcher(object):
 def assert_execute(shift, expected):
     """Helper for asserting an executed SQL statement on mock connection"""
     assert shift.execute.called
-    shift.execute.assert_called_with(SqlTextMatcher(expected))
+    shift.execute.assert_called_with(SqlTextMatcher(expected), retry=None)
 
 
 def test_connection_with_security_token(shift):
@@ -189,3 +189,149 @@ def test_copy_to_json(shift, json_data, tmpdir):
     bukkit = shift.s3_conn.get_bucket("com.simple.mock")
     check_key_calls(bukkit.s3keys, 10)
     assert len(os.listdir(dpath)) == 10
+
+
+def test_copy_json_to_table_events(shift, json_data):
+    from shiftmanager.instrumentation import AggregatingListener
+
+    stats = AggregatingListener()
+    shift.add_listener(stats)
+    shift.copy_json_to_table("com.simple.mock",
+                             "tmp/tests/",
+                             json_data,
+                             shift.gen_jsonpaths(json_data[0]),
+                             "foo_table",
+                             slices=4)
+
+    phases = dict((s.name, s) for s in stats.summary())
+    assert set(phases) == set(['serialize', 'upload', 'copy'])
+    assert phases['serialize'].rowcount == 16
+    assert phases['serialize'].bytes_serialized > 0
+    assert (phases['upload'].bytes_uploaded ==
+            phases['serialize'].bytes_compressed)
+
+
+def test_copy_json_to_table_create_table(shift, json_data, monkeypatch):
+    monkeypatch.setattr(shift, 'table_exists', lambda name: False)
+    written = []
+    monkeypatch.setattr(shift, 'write_dict_to_key',
+                        lambda data, key, **kwargs: written.append(data))
+    shift.copy_json_to_table("com.simple.mock",
+                             "tmp/tests/",
+                             json_data,
+                             None,
+                             "analytics.foo_table",
+                             slices=4,
+                             create_table=True,
+                             table_options={'sortkey': 'a'})
+
+    create = shift.execute.call_args_list[0][0][0]
+    assert cleaned(create) == cleaned("""
+        CREATE TABLE analytics.foo_table (
+        a SMALLINT
+        ) SORTKEY (a)""")
+    assert written[-1] == {"jsonpaths": ["$['a']"]}
+
+
+def test_copy_json_to_table_merge(shift, json_data, monkeypatch):
+    import sqlalchemy as sa
+
+    monkeypatch.setattr(shift, 'reflected_table', lambda name, schema: (
+        sa.Table(name, sa.MetaData(), sa.Column('a', sa.INTEGER,
+                                                primary_key=True),
+                 schema=schema)))
+    shift.copy_json_to_table("com.simple.mock",
+                             "tmp/tests/",
+                             json_data,
+                             shift.gen_jsonpaths(json_data[0]),
+                             "analytics.foo_table",
+                             slices=4,
+                             merge=True)
+
+    bukkit = shift.s3_conn.get_bucket("com.simple.mock")
+    mfest, jpaths = get_manifest_and_jsonpaths_keys(bukkit.s3keys)
+    expect_creds = ("aws_access_key_id={};aws_secret_access_key={};token={}"
+                    .format("access_key", "secret_key", "security_token"))
+    expected = """
+            CREATE TEMP TABLE foo_table$staging (LIKE analytics.foo_table);
+            COPY foo_table$staging
+            FROM '{manifest}'
+            CREDENTIALS '{creds}'
+            JSON '{jsonpaths}'
+            MANIFEST GZIP TIMEFORMAT 'auto' COMPUPDATE OFF STATUPDATE OFF;
+            DELETE FROM analytics.foo_table USING foo_table$staging
+            WHERE analytics.foo_table.a = foo_table$staging.a;
+            INSERT INTO analytics.foo_table (a)
+            SELECT a FROM (
+            SELECT *, ROW_NUMBER() OVER (PARTITION BY a) AS "$row"
+            FROM foo_table$staging) AS ranked
+            WHERE "$row" = 1;
+            DROP TABLE foo_table$staging;
+            """.format(manifest=mfest, creds=expect_creds,
+                       jsonpaths=jpaths)
+    assert_execute(shift, expected)
+
+
+def test_merge_batch_keeps_one_row_per_key(shift, monkeypatch):
+    import sqlite3
+    import sqlalchemy as sa
+
+    monkeypatch.setattr(shift, 'reflected_table', lambda name, schema: (
+        sa.Table(name, sa.MetaData(),
+                 sa.Column('a', sa.INTEGER, primary_key=True),
+                 sa.Column('b', sa.INTEGER))))
+    batch = shift._merge_batch('foo', lambda target: 'COPY %s' % target)
+    insert = [s for s in batch.split(';\n') if s.startswith('INSERT')][0]
+
+    db = sqlite3.connect(':memory:')
+    db.execute('CREATE TABLE foo (a INTEGER, b INTEGER)')
+    db.execute('CREATE TABLE "foo$staging" (a INTEGER, b INTEGER)')
+    db.executemany('INSERT INTO "foo$staging" VALUES (?, ?)',
+                   [(1, 10), (1, 11), (2, 20)])
+    db.execute(insert.replace('foo$staging', '"foo$staging"'))
+    rows = db.execute('SELECT a FROM foo ORDER BY a').fetchall()
+    assert rows == [(1,), (2,)]
+
+
+def test_copy_json_to_table_copy_options(shift, json_data):
+    from shiftmanager.copy_options import CopyOptions
+
+    options = CopyOptions(columns=['a'], timeformat='auto', maxerror=5,
+                          acceptinvchars='?', truncatecolumns=True)
+    shift.copy_json_to_table("com.simple.mock",
+                             "tmp/tests/",
+                             json_data,
+                             shift.gen_jsonpaths(json_data[0]),
+                             "foo_table",
+                             slices=4,
+                             copy_options=options)
+    statement = cleaned(shift.execute.call_args[0][0]).split('\n')
+    assert statement[0] == 'COPY foo_table ("a")'
+    assert statement[4] == ("MANIFEST GZIP TIMEFORMAT 'auto' "
+                            "ACCEPTINVCHARS AS '?' TRUNCATECOLUMNS MAXERROR 5")
+
+    with pytest.raises(ValueError):
+        shift.copy_json_to_table("com.simple.mock", "tmp/tests/", json_data,
+                                 None, "foo_table",
+                                 copy_options=CopyOptions('csv'))
+    with pytest.raises(ValueError):
+        CopyOptions(maxerror=-1)
+
+
+def test_copy_json_to_table_without_s3_connection(shift, json_data,
+                                                  monkeypatch):
+    from mock import Mock
+
+    def refuse(*args, **kwargs):
+        raise ValueError("No S3 credentials")
+
+    shift.s3_conn = None
+    monkeypatch.setattr(shift, 'get_s3_connection', refuse)
+    monkeypatch.setattr(shift, 'table_exists', Mock(return_value=False))
+    with pytest.raises(ValueError) as excinfo:
+        shift.copy_json_to_table("com.simple.mock", "tmp/tests/", json_data,
+                                 None, "foo_table", create_table=True)
+    assert str(excinfo.value) == "No S3 credentials"
+    # The connection is checked before anything touches Redshift
+    assert not shift.table_exists.called
+    assert not shift.execute.called
@@ -4,6 +4,8 @@
 Util tests
 """
 
+import pytest
+
 from shiftmanager import util
 
 
@@ -22,3 +24,10 @@ def test_recur_dict():
 
     test_4 = {"one": [1, 2]}
     assert util.recur_dict(set(), test_4, list_idx=1) == set(["$['one'][1]"])
+
+
+def test_topological_sort():
+    deps = {'v2': ['v1', 't'], 'v1': ['t'], 't': [], 'v3': ['v2', 'other']}
+    assert util.topological_sort(deps) == ['t', 'v1', 'v2', 'v3']
+    with pytest.raises(ValueError):
+        util.topological_sort({'a': ['b'], 'b': ['a']})
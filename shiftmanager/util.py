@@ -73,3 +73,35 @@ def linspace(start, stop, num):
             break
         res.append(int(math.floor(accum)))
     return res
+
+
+def topological_sort(dependencies):
+    """
+    Order the keys of *dependencies* so that each comes after everything
+    it depends on. Dependencies not themselves keys are ignored, and
+    ties are broken by sorting, so the result is deterministic.
+
+    Parameters
+    ----------
+    dependencies : dict
+        Maps each node to an iterable of nodes it depends on
+
+    Example
+    -------
+    >>> topological_sort({'c': ['a', 'b'], 'b': ['a'], 'a': [], 'd': ['x']})
+    ['a', 'd', 'b', 'c']
+    """
+    remaining = dict((node, set(deps) & set(dependencies) - set([node]))
+                     for node, deps in dependencies.items())
+    ordered = []
+    while remaining:
+        ready = sorted(node for node, deps in remaining.items() if not deps)
+        if not ready:
+            raise ValueError("Circular dependency among: %s"
+                             % ', '.join(sorted(remaining)))
+        for node in ready:
+            del remaining[node]
+        for deps in remaining.values():
+            deps.difference_update(ready)
+        ordered += ready
+    return ordered
@@ -0,0 +1,64 @@
+"""
+Helpers for running operations in a particular WLM query group
+or with a particular number of WLM query slots.
+
+Redshift's workload management assigns each query to a queue based
+on the session's ``query_group`` and gives it ``wlm_query_slot_count``
+slots' worth of memory. Heavy operations like deep copies and COPYs
+benefit from claiming extra slots so that they don't spill to disk.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+
+# A suggested policy mapping operations to WLM settings; pass this
+# (or your own variant) as the *wlm_policy* argument to `Redshift`.
+DEFAULT_WLM_POLICY = {
+    'deep_copy': {'slot_count': 3},
+    'copy': {'slot_count': 2},
+    'analyze_compression': {'slot_count': 2},
+}
+
+
+def wlm_statements(query_group=None, slot_count=None):
+    """Return lists of statements to apply and then reset WLM settings.
+
+    >>> setup, teardown = wlm_statements('etl', 3)
+    >>> print(';\\n'.join(setup))
+    SET query_group TO 'etl';
+    SET wlm_query_slot_count TO 3
+    >>> print(';\\n'.join(teardown))
+    RESET wlm_query_slot_count;
+    RESET query_group
+    """
+    setup, teardown = [], []
+    if query_group is not None:
+        setup.append("SET query_group TO '%s'"
+                     % query_group.replace("'", "''"))
+        teardown.insert(0, "RESET query_group")
+    if slot_count is not None:
+        setup.append("SET wlm_query_slot_count TO %d" % int(slot_count))
+        teardown.insert(0, "RESET wlm_query_slot_count")
+    return setup, teardown
+
+
+def wrap_batch(batch, query_group=None, slot_count=None):
+    """Return *batch* surrounded by statements applying WLM settings.
+
+    >>> print(wrap_batch('ANALYZE foo;', slot_count=2))
+    SET wlm_query_slot_count TO 2;
+    ANALYZE foo;
+    RESET wlm_query_slot_count;
+    >>> print(wrap_batch('ANALYZE foo;'))
+    ANALYZE foo;
+    """
+    setup, teardown = wlm_statements(query_group, slot_count)
+    if not setup:
+        return batch
+    batch = batch.strip()
+    if not batch.endswith(';'):
+        batch += ';'
+    return '\n'.join([';\n'.join(setup) + ';',
+                      batch,
+                      ';\n'.join(teardown) + ';'])